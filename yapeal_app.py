@@ -1,24 +1,18 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
 import plotly.express as px
 import plotly.graph_objects as go
-from sklearn.cluster import KMeans
-from sklearn.preprocessing import StandardScaler
-import scipy.cluster.hierarchy as sch
-import scipy.stats as stats
-from sklearn.cluster import DBSCAN, KMeans
-from sklearn.decomposition import PCA
-from sklearn.preprocessing import MinMaxScaler
-import plotly.figure_factory as ff
-from sklearn.neighbors import NearestNeighbors
-from sklearn.metrics import silhouette_score
+import plotly.io as pio
 import json
 import os
 from datetime import datetime
 
+import yapeal_cube
+import yapeal_data
+import yapeal_metrics
+import yapeal_segments
+
 # Set page configuration
 st.set_page_config(
     page_title="Business Transaction Pattern Analysis",
@@ -82,85 +76,237 @@ with st.sidebar:
 @st.cache_data
 def load_data():
     try:
-        # Define file paths - adjust these to match your environment
-        transactions_path = "/Users/valeskablank/Documents/App/Data/preprocessed_transactions_with_mcc_desc.csv"
-        share_of_wallet_path = "/Users/valeskablank/Documents/App/Data/preprocessed_share_of_wallet_per_user.csv"
-        share_of_wallet_date_path = "/Users/valeskablank/Documents/App/Data/preprocessed_share_of_wallet_per_user_date.csv"
-        
-        # Load data
-        transactions_df = pd.read_csv(transactions_path)
-        share_of_wallet_df = pd.read_csv(share_of_wallet_path)
-        share_of_wallet_date_df = pd.read_csv(share_of_wallet_date_path)
-        
-        # Convert date columns
-        transactions_df['trx_date'] = pd.to_datetime(transactions_df['trx_date'], errors='coerce')
-        if 'date' in share_of_wallet_date_df.columns:
-            share_of_wallet_date_df['date'] = pd.to_datetime(share_of_wallet_date_df['date'], errors='coerce')
-        
-        # Calculate transaction frequency per customer
-        customer_transaction_freq = transactions_df.groupby('customer_id').size().reset_index(name='transaction_frequency')
+        # Load data through the columnar cache (file paths are defined in yapeal_data.py);
+        # calendar columns (weekday, hour, month, season, ...) are derived once and cached with it;
+        # the share-of-wallet exports are only loaded on demand through load_dataset()
+        transactions_df = yapeal_data.load_transactions()
         
-        # Calculate average transaction amount per customer
-        customer_avg_amount = transactions_df.groupby('customer_id')['amount_chf'].mean().reset_index(name='avg_transaction_amount')
-        customer_total_spent = transactions_df.groupby('customer_id')['amount_chf'].sum().reset_index(name='total_spent')
+        # Calculate per-customer metrics (frequency, amounts, category shares, weekday ratio)
+        # from persisted per-customer aggregates; they are only rebuilt when the transaction file
+        # changed outside of yapeal_metrics.append_transactions()
+        customer_aggregates = yapeal_metrics.current_customer_aggregates(transactions_df=transactions_df)
+        customer_metrics = yapeal_metrics.customer_metrics_from_aggregates(customer_aggregates)
         
-        # Calculate transaction frequency by year if year column exists
-        if 'year' in transactions_df.columns:
-            yearly_freq = transactions_df.groupby(['customer_id', 'year']).size().reset_index(name='yearly_transactions')
-        
-        # Merge metrics into a single DataFrame
-        customer_metrics = pd.merge(customer_transaction_freq, customer_avg_amount, on='customer_id')
-        customer_metrics = pd.merge(customer_metrics, customer_total_spent, on='customer_id')
+        # Customer-indexed feature table shared by all pages
+        customer_features = yapeal_metrics.customer_feature_table(customer_aggregates)
         
-        # Add category spending percentages if category column exists
-        if 'category' in transactions_df.columns:
-            category_spending = transactions_df.groupby(['customer_id', 'category'])['amount_chf'].sum().reset_index()
-            
-            # Get total spending per customer for percentage calculation
-            customer_totals = transactions_df.groupby('customer_id')['amount_chf'].sum().reset_index()
-            customer_totals.columns = ['customer_id', 'total_customer_spend']
-            
-            # Merge with category spending
-            category_spending = pd.merge(category_spending, customer_totals, on='customer_id')
-            
-            # Calculate percentage
-            category_spending['percentage'] = (category_spending['amount_chf'] / category_spending['total_customer_spend']) * 100
-            
-            # Pivot to get categories as columns
-            category_pivot = category_spending.pivot_table(
-                index='customer_id', 
-                columns='category', 
-                values='percentage',
-                fill_value=0
-            )
-            
-            # Rename columns to add _pct suffix
-            category_pivot.columns = [f"{col}_pct" for col in category_pivot.columns]
-            
-            # Reset index to merge with customer_metrics
-            category_pivot = category_pivot.reset_index()
-            
-            # Merge with main metrics dataframe
-            customer_metrics = pd.merge(customer_metrics, category_pivot, on='customer_id', how='left')
-        
-        # Calculate weekday vs weekend transaction ratio
-        transactions_df['weekday'] = transactions_df['trx_date'].dt.dayofweek
-        transactions_df['is_weekend'] = transactions_df['weekday'].isin([5, 6]).astype(int)
-        
-        # Calculate weekday/weekend counts
-        weekday_counts = transactions_df.groupby('customer_id')['is_weekend'].mean().reset_index()
-        weekday_counts.columns = ['customer_id', 'weekend_ratio']
-        weekday_counts['weekday_ratio'] = 100 - (weekday_counts['weekend_ratio'] * 100)
-        
-        # Merge with customer metrics
-        customer_metrics = pd.merge(customer_metrics, weekday_counts[['customer_id', 'weekday_ratio']], on='customer_id', how='left')
-        
-        return customer_metrics, transactions_df, share_of_wallet_df, share_of_wallet_date_df
+        return customer_metrics, transactions_df, customer_features
     
     except Exception as e:
         st.error(f"Error loading data: {str(e)}")
         st.exception(e)
-        return pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
+        return pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
+
+# Helper function to load one of the additional datasets registered in yapeal_data.DATASETS
+# (e.g. 'share_of_wallet'); each file is read and cached the first time a page asks for it
+@st.cache_data
+def load_dataset(name):
+    try:
+        return yapeal_data.load_dataset(name)
+    except Exception as e:
+        st.error(f"Error loading dataset '{name}': {str(e)}")
+        return pd.DataFrame()
+
+# Helper function to compare the memory footprint of the transaction data with and without
+# the compact schema, cached like load_data() so the Overview page only computes it once
+@st.cache_data
+def load_memory_report():
+    _, transactions_df, _ = load_data()
+    return yapeal_data.memory_report(transactions_df)
+
+# Helper function to compute the business segments of all customers (one boolean column
+# per rule in yapeal_segments.SEGMENTS), cached per IQR multiplier
+@st.cache_data
+def load_segments(iqr_multiplier=yapeal_metrics.DEFAULT_IQR_MULTIPLIER):
+    _, transactions_df, customer_features = load_data()
+    if transactions_df.empty:
+        return pd.DataFrame(columns=list(yapeal_segments.SEGMENTS), dtype=bool)
+    return yapeal_segments.build_segments(transactions_df, customer_features, iqr_multiplier=iqr_multiplier)
+
+# Helper function to build the sorted per-customer arrays behind the percentile threshold sliders
+@st.cache_data
+def load_percentile_index():
+    _, transactions_df, customer_features = load_data()
+    business_share = yapeal_segments.business_mcc_share(transactions_df, customer_features.index)
+    return yapeal_segments.build_percentile_index(customer_features, business_share)
+
+# Helper function to select the transactions of the Clustering page and build its features once:
+# rows with a zero amount and customers with fewer than 10 transactions are dropped, only
+# customers of the business MCC segment are kept, and the feature matrix is built from the
+# per-customer aggregates of the remaining transactions.
+# Returns (the kept transactions with the columns the page reads, customer_ids, feature names, matrix).
+@st.cache_data
+def load_clustering_features():
+    import yapeal_clustering
+
+    _, transactions_df, _ = load_data()
+    keep = np.ones(len(transactions_df), dtype=bool)
+    
+    # Remove rows with zero amount
+    if 'amount_chf' in transactions_df.columns:
+        keep &= (transactions_df['amount_chf'] != 0).to_numpy()
+
+    # Filter low activity customers (those with fewer than 10 transactions)
+    customer_codes, _ = pd.factorize(transactions_df['customer_id'])
+    kept_counts = np.bincount(customer_codes[keep & (customer_codes >= 0)], minlength=customer_codes.max() + 1)
+    keep &= (customer_codes >= 0) & (kept_counts[customer_codes] >= 10)
+
+    # Keep only customers with b2b related transactions (business MCC segment)
+    if 'mcc' in transactions_df.columns:
+        keep &= yapeal_segments.transaction_segment(load_segments(), transactions_df['customer_id'], 'business_mcc')
+
+    aggregates = yapeal_metrics.customer_aggregates(transactions_df[keep])
+    customer_ids, feature_names, matrix = yapeal_clustering.clustering_features(aggregates)
+
+    # Forget categories and customers that were filtered out
+    columns = [col for col in ['customer_id', 'category', 'mcc_description'] if col in transactions_df.columns]
+    clustering_transactions = yapeal_data.drop_unused_categories(transactions_df.loc[keep, columns])
+    return clustering_transactions, customer_ids, feature_names, matrix
+
+# Helper function to fit the min-max scaler and the 2-D PCA projection of the clustering
+# features (one PCA stage shared by all clustering tabs, see yapeal_clustering.PCA_MODES).
+# Persisted in the artifact store by the content hash of the unscaled matrix and the mode,
+# so new sessions and restarted workers load them instead of fitting again.
+@st.cache_data
+def load_preprocessing(feature_key, _feature_matrix, n_components=2, pca_mode='auto'):
+    import yapeal_artifacts
+    import yapeal_clustering
+
+    def fit():
+        scaler = yapeal_clustering.fit_minmax_scaler(_feature_matrix)
+        features_scaled = yapeal_clustering.minmax_transform(_feature_matrix, scaler)
+        mode = yapeal_clustering.pca_mode(features_scaled, pca_mode)
+        pca, reduced = yapeal_clustering.fit_pca(features_scaled, n_components, mode)
+        return {'scaler': scaler, 'pca': pca, 'reduced': reduced, 'pca_mode': mode}
+
+    params = {'n_components': n_components, 'pca_mode': pca_mode}
+    return yapeal_artifacts.cached_artifact('preprocessing', feature_key, params, fit)
+
+# Helper function to fit K-Means for every k of the sweep on the scaled clustering features.
+# Cached by the content hash of the feature matrix (and persisted in the artifact store),
+# so changing k in the UI is instant.
+@st.cache_data
+def load_kmeans_sweep(feature_key, _features_scaled):
+    import yapeal_artifacts
+    import yapeal_clustering
+    params = {'k_values': yapeal_clustering.KMEANS_K_VALUES, 'random_state': 0}
+    return yapeal_artifacts.cached_artifact('kmeans_sweep', feature_key, params,
+                                            lambda: yapeal_clustering.kmeans_sweep(_features_scaled))
+
+# Helper function to save the selected K-Means model for the batch scoring CLI (yapeal_score.py):
+# feature names, scaler, PCA and centroids as one .npz in the artifact store, once per (features, PCA points, k)
+@st.cache_data
+def store_scoring_model(feature_key, reduced_key, k, _feature_names, _scaler, _pca, _centroids):
+    import yapeal_artifacts
+    try:
+        return yapeal_artifacts.save_scoring_model(feature_key, _feature_names, _scaler, _pca, _centroids)
+    except OSError:
+        return None
+
+# Helper function to validate a clustering against the spending categories (chi-square,
+# Cramer's V, residuals and a permutation test across worker processes), cached per
+# (feature matrix hash, labels hash)
+@st.cache_data
+def load_validation(feature_key, labels_key, _category_counts, _labels):
+    import yapeal_validation
+    return yapeal_validation.validate_clusters(_category_counts, _labels)
+
+# Helper function to score a labelling of the customers with the silhouette service:
+# a stratified-sample estimate with a confidence interval, or the exact score computed
+# in chunks across worker processes. Cached per (feature matrix hash, labels hash).
+@st.cache_data
+def load_silhouette(feature_key, labels_key, _features_scaled, _labels, exact=False):
+    import yapeal_clustering
+    if exact:
+        return yapeal_clustering.silhouette_exact(_features_scaled, _labels)
+    return yapeal_clustering.silhouette_estimate(_features_scaled, _labels)
+
+# Helper function to build the KD-tree, k-distances and radius-neighbours graph of the PCA
+# points once (cached by their content hash), so moving the DBSCAN sliders only re-labels the cached graph
+@st.cache_data
+def load_neighbor_graph(points_key, _points):
+    import yapeal_clustering
+    return yapeal_clustering.fit_neighbor_graph(_points)
+
+# Helper function to start the DBSCAN eps x min_samples grid sweep in the background: a
+# thread hands the grid to a worker-process pool and the page polls the returned future.
+# A cache resource (not cache_data) because a future cannot be pickled; one sweep per set of PCA points
+# (a failed sweep is evicted by the page, so the next run starts it again).
+@st.cache_resource
+def start_dbscan_sweep(points_key, _neighbor_graph, _points, eps_step):
+    from concurrent.futures import ThreadPoolExecutor
+    import yapeal_clustering
+    eps_values = yapeal_clustering.dbscan_eps_grid(yapeal_clustering.DBSCAN_MIN_EPS, _neighbor_graph['sweep_max_eps'],
+                                                   eps_step)
+    executor = ThreadPoolExecutor(max_workers=1)
+    future = executor.submit(yapeal_clustering.dbscan_sweep, _neighbor_graph, _points, eps_values)
+    executor.shutdown(wait=False)
+    return future
+
+# Move the DBSCAN sliders to the grid cell picked below the sweep heatmap
+def load_dbscan_cell(eps_by_label):
+    st.session_state['dbscan_eps'] = eps_by_label[st.session_state['dbscan_cell_eps']]
+    st.session_state['dbscan_min_samples'] = st.session_state['dbscan_cell_min_samples']
+
+# Helper function to build the Ward hierarchy of the customers (exact, or on micro-clusters
+# for large customer bases), cached by the content hash of the feature matrix and
+# persisted in the artifact store (linkage, leaf assignment and weights as .npz)
+@st.cache_data
+def load_hierarchy(feature_key, _features_scaled):
+    import yapeal_artifacts
+    import yapeal_clustering
+    params = {'max_exact_rows': yapeal_clustering.HIERARCHY_EXACT_MAX_ROWS,
+              'n_micro_clusters': yapeal_clustering.HIERARCHY_MICRO_CLUSTERS, 'random_state': 0}
+    return yapeal_artifacts.cached_artifact('hierarchy', feature_key, params,
+                                            lambda: yapeal_clustering.fit_hierarchy(_features_scaled))
+
+# Helper function to compute the hierarchy's elbow curve: WCSS of the PCA points for every
+# k up to yapeal_clustering.ELBOW_MAX_CLUSTERS, all cuts in one vectorized pass
+# (cached per feature matrix hash, which fixes the hierarchy, and PCA points hash)
+@st.cache_data
+def load_hierarchy_wcss(feature_key, points_key, _hierarchy, _points):
+    import yapeal_clustering
+    return yapeal_clustering.hierarchical_wcss(_hierarchy, _points)
+
+# Helper function to draw the truncated dendrogram of a hierarchy as a single line trace;
+# the figure JSON is cached per linkage so reruns only send a few KB to the browser
+@st.cache_data
+def load_dendrogram_json(feature_key, _hierarchy):
+    import yapeal_clustering
+    segments = yapeal_clustering.dendrogram_segments(_hierarchy['linkage'], _hierarchy['weights'])
+    fig = go.Figure(go.Scatter(
+        x=segments['x'],
+        y=segments['y'],
+        mode='lines',
+        line=dict(color='blue', width=1),
+        hoverinfo='none'
+    ))
+    fig.update_layout(
+        title=f"Hierarchical Clustering Dendrogram (top {len(segments['leaf_labels'])} clusters)",
+        xaxis=dict(
+            title="Customers per Cluster",
+            tickmode='array',
+            tickvals=segments['leaf_positions'],
+            ticktext=segments['leaf_labels'],
+            tickangle=-90
+        ),
+        yaxis_title="Distance",
+        showlegend=False,
+        height=600
+    )
+    return fig.to_json()
+
+# Helper function to build the pre-aggregated transaction cube and daily totals
+# (the time-series and category charts are roll-ups of these tables)
+@st.cache_data
+def load_transaction_cube():
+    _, transactions_df, customer_features = load_data()
+    if transactions_df.empty:
+        return pd.DataFrame(columns=list(yapeal_cube.CUBE_DIMENSIONS) + yapeal_cube.CUBE_MEASURES), pd.DataFrame()
+    
+    # Potential business customers: top 20% by transaction frequency
+    business_customers = yapeal_segments.segment_customers(load_segments(), 'high_frequency')
+    return yapeal_cube.build_cube(transactions_df, business_customers), yapeal_cube.build_daily_table(transactions_df)
 
 # Helper function to load MCC data
 @st.cache_data
@@ -196,7 +342,7 @@ def load_mcc_data():
         return {}
 
 # Load data
-df, transactions_df, share_of_wallet_df, share_of_wallet_date_df = load_data()
+df, transactions_df, customer_features = load_data()
 mcc_data = load_mcc_data()
 
 # Main content based on page selection
@@ -248,6 +394,16 @@ if page == "Overview":
         if 'amount_chf' in filtered_transactions_df.columns:
             col3.metric("Avg. Transaction Amount", f"CHF {filtered_transactions_df['amount_chf'].mean():.2f}")
             col4.metric("Total Transaction Volume", f"CHF {filtered_transactions_df['amount_chf'].sum():,.2f}")
+        
+        # Memory used by the compact in-memory schema
+        with st.expander("Memory Footprint of the Transaction Data"):
+            memory_report = load_memory_report()
+            total_row = memory_report.iloc[-1]
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Bytes per Row (default pandas)", f"{total_row['bytes_per_row_before']:.1f}")
+            col2.metric("Bytes per Row (compact)", f"{total_row['bytes_per_row_after']:.1f}")
+            col3.metric("Reduction", f"{total_row['reduction']:.1f}x")
+            st.dataframe(memory_report, hide_index=True)
     else:
         st.error("Could not load the transaction dataset. Please check the file paths and try again.")
 
@@ -264,7 +420,14 @@ elif page == "Data Transformation":
     else:
         # Remove year 2020 if present (not analyzed)
         if 'year' in transactions_df.columns:
-            transactions_df = transactions_df[transactions_df['year'] != 2020]
+            transactions_df = yapeal_data.drop_unused_categories(transactions_df[transactions_df['year'] != 2020])
+        
+        # Outlier rule used below: values above Q3 + multiplier * IQR of their year
+        iqr_multiplier = st.slider(
+            "IQR multiplier for outliers (upper bound = Q3 + multiplier × IQR)",
+            min_value=1.0, max_value=5.0, value=yapeal_metrics.DEFAULT_IQR_MULTIPLIER, step=0.5
+        )
+        segments = load_segments(iqr_multiplier)
         
         # Transaction Frequency Analysis
         st.markdown('<div class="section-header">Transaction Frequency</div>', unsafe_allow_html=True)
@@ -273,21 +436,7 @@ elif page == "Data Transformation":
         
         with col1:
             # Calculate transaction frequency per customer per year
-            customer_yearly_freq = transactions_df.groupby(['customer_id', 'year']).size().reset_index(name='transaction_count')
-            
-            # Identify outliers using IQR method per year
-            outliers_per_year = {}
-            years = customer_yearly_freq['year'].unique()
-            
-            for year in sorted(years):
-                data_year = customer_yearly_freq[customer_yearly_freq['year'] == year]
-                q1 = data_year['transaction_count'].quantile(0.25)
-                q3 = data_year['transaction_count'].quantile(0.75)
-                iqr = q3 - q1
-                upper_bound = q3 + 2.0 * iqr
-                
-                outliers = data_year[data_year['transaction_count'] > upper_bound]
-                outliers_per_year[year] = outliers
+            customer_yearly_freq = transactions_df.groupby(['customer_id', 'year'], observed=True).size().reset_index(name='transaction_count')
             
             # Create boxplot with outliers
             fig = px.box(customer_yearly_freq, x='year', y='transaction_count',
@@ -310,23 +459,12 @@ elif page == "Data Transformation":
             """)
             st.markdown('</div>', unsafe_allow_html=True)
             
-            # Identify customers who are outliers in all active years
-            all_outlier_customers = set()
-            for year in years:
-                all_outlier_customers.update(outliers_per_year[year]['customer_id'].unique())
-            
-            active_years_per_customer = transactions_df.groupby('customer_id')['year'].unique().to_dict()
-            
-            final_outliers = []
-            for customer in all_outlier_customers:
-                active_years = set(active_years_per_customer.get(customer, []))
-                outlier_years = {yr for yr in years if customer in outliers_per_year[yr]['customer_id'].values}
-                if active_years.issubset(outlier_years):
-                    final_outliers.append(customer)
+            # Identify customers who are outliers (IQR rule per year) in all their active years
+            final_outliers = yapeal_segments.segment_customers(segments, 'iqr_count_all_years')
             
             # Prepare data for business vs non-business comparison
-            customer_yearly_freq['group'] = customer_yearly_freq['customer_id'].apply(
-                lambda x: 'Potential-Business' if x in final_outliers else 'Potential-Non-Business'
+            customer_yearly_freq['group'] = yapeal_data.membership_labels(
+                customer_yearly_freq['customer_id'], final_outliers, 'Potential-Business', 'Potential-Non-Business'
             )
             
             # Boxplot comparing business vs non-business
@@ -350,7 +488,7 @@ elif page == "Data Transformation":
         
         with col1:
             # Calculate yearly average transaction amount per customer
-            customer_yearly_amount = transactions_df.groupby(['customer_id', 'year'])['amount_chf'].agg(
+            customer_yearly_amount = transactions_df.groupby(['customer_id', 'year'], observed=True)['amount_chf'].agg(
                 transaction_count='count',
                 total_amount='sum',
                 average_amount='mean',
@@ -359,19 +497,6 @@ elif page == "Data Transformation":
                 max_amount='max'
             ).reset_index()
             
-            # Identify amount outliers using IQR method per year
-            amount_outliers_per_year = {}
-            
-            for year in sorted(years):
-                data_year = customer_yearly_amount[customer_yearly_amount['year'] == year]
-                q1 = data_year['average_amount'].quantile(0.25)
-                q3 = data_year['average_amount'].quantile(0.75)
-                iqr = q3 - q1
-                upper_bound = q3 + 2.0 * iqr
-                
-                outliers = data_year[data_year['average_amount'] > upper_bound]
-                amount_outliers_per_year[year] = outliers
-            
             # Boxplot of average transaction amount
             fig_amount = px.box(
                 customer_yearly_amount, 
@@ -398,20 +523,11 @@ elif page == "Data Transformation":
             st.markdown('</div>', unsafe_allow_html=True)
             
             # Identify customers who are amount outliers in all their active years
-            all_amount_outlier_customers = set()
-            for year in years:
-                all_amount_outlier_customers.update(amount_outliers_per_year[year]['customer_id'].unique())
-            
-            final_amount_outliers = []
-            for customer in all_amount_outlier_customers:
-                active_years = set(active_years_per_customer.get(customer, []))
-                outlier_years = {yr for yr in years if customer in amount_outliers_per_year[yr]['customer_id'].values}
-                if active_years.issubset(outlier_years):
-                    final_amount_outliers.append(customer)
+            final_amount_outliers = yapeal_segments.segment_customers(segments, 'iqr_amount_all_years')
             
             # Prepare data for amount comparison
-            customer_yearly_amount['group'] = customer_yearly_amount['customer_id'].apply(
-                lambda x: 'Potential-Business' if x in final_amount_outliers else 'Potential-Non-Business'
+            customer_yearly_amount['group'] = yapeal_data.membership_labels(
+                customer_yearly_amount['customer_id'], final_amount_outliers, 'Potential-Business', 'Potential-Non-Business'
             )
             
             # Boxplot comparing business vs non-business amounts
@@ -445,7 +561,7 @@ elif page == "Data Transformation":
             
             with col2:
                 # Get top categories by amount
-                category_amounts = transactions_df.groupby('category')['amount_chf'].sum().reset_index()
+                category_amounts = transactions_df.groupby('category', observed=True)['amount_chf'].sum().reset_index()
                 category_amounts.columns = ['Category', 'Total Amount (CHF)']
                 category_amounts = category_amounts.sort_values('Total Amount (CHF)', ascending=False)
                 
@@ -487,8 +603,8 @@ elif page == "Data Transformation":
         
         # Add weekday column if not present
         if 'weekday' not in transactions_df.columns:
-            transactions_df['weekday'] = transactions_df['trx_date'].dt.dayofweek
-            transactions_df['is_weekend'] = transactions_df['weekday'].isin([5, 6]).astype(int)
+            transactions_df['weekday'] = yapeal_data.small_int(transactions_df['trx_date'].dt.dayofweek, 'int8')
+            transactions_df['is_weekend'] = transactions_df['weekday'].isin([5, 6]).astype('int8')
         
         col1, col2 = st.columns(2)
         
@@ -499,9 +615,7 @@ elif page == "Data Transformation":
             day_counts = day_counts.sort_values('day_of_week')
             
             # Map day numbers to names
-            day_names = {0: 'Monday', 1: 'Tuesday', 2: 'Wednesday', 3: 'Thursday', 
-                         4: 'Friday', 5: 'Saturday', 6: 'Sunday'}
-            day_counts['day_name'] = day_counts['day_of_week'].map(day_names)
+            day_counts['day_name'] = yapeal_data.day_name_column(day_counts['day_of_week'])
             
             fig = px.bar(day_counts, x='day_name', y='count',
                         title="Transaction Count by Day of Week",
@@ -519,7 +633,7 @@ elif page == "Data Transformation":
             st.markdown('</div>', unsafe_allow_html=True)
             
             # Calculate weekday ratio per customer
-            customer_weekday = transactions_df.groupby('customer_id')['is_weekend'].mean().reset_index()
+            customer_weekday = transactions_df.groupby('customer_id', observed=True)['is_weekend'].mean().reset_index()
             customer_weekday['weekday_ratio'] = (1 - customer_weekday['is_weekend']) * 100
             
             fig = px.histogram(customer_weekday, x="weekday_ratio", 
@@ -556,15 +670,32 @@ elif page == "Visualization":
             
         viz_type = st.selectbox("Select Visualization Type", viz_options)
         
+        # Pre-aggregated transaction cube (built on the first visit of this page)
+        transaction_cube, daily_transactions_df = load_transaction_cube()
+        
         if viz_type == "Transaction Patterns Overview":
             st.subheader("Transaction Pattern Overview")
             
             # Calculate metrics per customer
-            customer_metrics = transactions_df.groupby('customer_id').agg(
-                transaction_count=('trx_date', 'count'),
-                avg_amount=('amount_chf', 'mean'),
-                total_amount=('amount_chf', 'sum')
-            ).reset_index()
+            customer_metrics = customer_features[['transaction_count', 'avg_amount', 'total_amount']].reset_index()
+            
+            # Adjustable percentile thresholds (resolved on pre-sorted per-customer arrays)
+            percentile_index = load_percentile_index()
+            st.markdown("**Percentile thresholds for potential business customers**")
+            threshold_cols = st.columns(len(yapeal_segments.THRESHOLD_METRICS))
+            threshold_percentiles = {}
+            for threshold_col, (metric, metric_label) in zip(threshold_cols, yapeal_segments.THRESHOLD_METRICS.items()):
+                with threshold_col:
+                    threshold_percentiles[metric] = st.slider(
+                        f"{metric_label} percentile", min_value=50, max_value=99, value=80, key=f"percentile_{metric}"
+                    )
+                    summary = yapeal_segments.threshold_summary(percentile_index, metric, threshold_percentiles[metric])
+                    st.metric(
+                        f"Customers ≥ {summary['threshold']:,.1f}",
+                        f"{summary['customers']:,}",
+                        f"{summary['amount'] / summary['total_amount'] * 100:.1f}% of volume" if summary['total_amount'] else None
+                    )
+                    st.caption(f"{summary['transactions']:,.0f} transactions, CHF {summary['amount']:,.0f}")
             
             col1, col2 = st.columns(2)
             
@@ -582,10 +713,10 @@ elif page == "Visualization":
                                 },
                                 title="Transaction Count vs. Average Amount per Customer")
                 
-                # Add reference lines for potential thresholds
-                fig.add_hline(y=customer_metrics['avg_amount'].quantile(0.8), 
+                # Add reference lines for the selected thresholds
+                fig.add_hline(y=yapeal_segments.percentile_value(percentile_index, 'avg_amount', threshold_percentiles['avg_amount']), 
                              line_dash="dash", line_color="red")
-                fig.add_vline(x=customer_metrics['transaction_count'].quantile(0.8), 
+                fig.add_vline(x=yapeal_segments.percentile_value(percentile_index, 'transaction_count', threshold_percentiles['transaction_count']), 
                              line_dash="dash", line_color="red")
                 
                 st.plotly_chart(fig, use_container_width=True)
@@ -596,7 +727,7 @@ elif page == "Visualization":
                 - Several outliers with 1,000+ transactions annually likely represent business accounts
                 - The larger bubble sizes indicate higher total spending volume
                 - Most customers fall in the lower-left with under 500 transactions and relatively low average amounts
-                - The 80th percentile thresholds (red dashed lines) effectively separate potential business from personal users
+                - The percentile thresholds (red dashed lines, 80th percentile by default) effectively separate potential business from personal users
                 - A small group shows extremely high transaction counts (5,000+) with moderate average amounts
                 """)
             
@@ -626,13 +757,8 @@ elif page == "Visualization":
             with ts_tabs[0]:
                 st.subheader("Daily Transaction Patterns")
                 
-                # Aggregate transactions by date
-                daily_transactions = transactions_df.groupby(transactions_df['trx_date'].dt.date).agg(
-                    transaction_count=('customer_id', 'count'),
-                    unique_customers=('customer_id', 'nunique'),
-                    total_amount=('amount_chf', 'sum'),
-                    avg_amount=('amount_chf', 'mean')
-                ).reset_index()
+                # Daily totals are materialised once at load time
+                daily_transactions = daily_transactions_df
                 
                 # Time series metrics selection
                 ts_metric = st.selectbox(
@@ -659,30 +785,19 @@ elif page == "Visualization":
                 )
                 st.plotly_chart(fig, use_container_width=True)
             
+            # Years present in the data
+            years = sorted(transaction_cube['year'].dropna().unique().tolist())
+            
             with ts_tabs[1]:
                 st.subheader("Weekly Transaction Patterns")
                 
-                # Extract day of week
-                transactions_df['day_of_week'] = transactions_df['trx_date'].dt.dayofweek
-                transactions_df['day_name'] = transactions_df['trx_date'].dt.day_name()
-                
                 # Define day order for plotting
                 day_order = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
                 
-                # Function to get average spending per weekday for each year
-                years = sorted(transactions_df['year'].unique())
-                weekly_data = {}
-                
-                for year in years:
-                    year_data = transactions_df[transactions_df['year'] == year]
-                    weekly_data[year] = year_data.groupby('day_name')['amount_chf'].mean()
-                
-                # Combine data for plotting
-                weekly_df = pd.DataFrame(weekly_data)
-                weekly_df = weekly_df.reindex(day_order)
-                weekly_df = weekly_df.reset_index()
-                weekly_df.columns = ['day_name'] + list(weekly_df.columns[1:])
-                weekly_df = weekly_df.melt(id_vars='day_name', var_name='year', value_name='avg_amount')
+                # Average spending per weekday for each year (roll-up of the transaction cube)
+                weekly_df = yapeal_cube.rollup(transaction_cube, ['year', 'weekday'])
+                weekly_df['day_name'] = yapeal_data.day_name_column(weekly_df['weekday'])
+                weekly_df = weekly_df.sort_values(['year', 'weekday'])
                 
                 # Create visualization
                 fig = px.line(
@@ -691,6 +806,7 @@ elif page == "Visualization":
                     y='avg_amount',
                     color='year',
                     markers=True,
+                    category_orders={"day_name": day_order},
                     title="Average Spending by Day of the Week (By Year)",
                     labels={
                         "day_name": "Day of Week",
@@ -703,24 +819,18 @@ elif page == "Visualization":
                 # Business vs. personal pattern comparison
                 st.subheader("Business vs. Personal Weekly Patterns")
                 
-                # Identify potential business customers (top 20% by transaction frequency)
-                high_freq_threshold = transactions_df.groupby('customer_id').size().quantile(0.8)
-                high_freq_customers = transactions_df.groupby('customer_id').size()
-                high_freq_customers = high_freq_customers[high_freq_customers >= high_freq_threshold].index
-                
-                # Add business flag to transactions
-                transactions_df['potential_business'] = transactions_df['customer_id'].isin(high_freq_customers)
-                
-                # Compare patterns by day of week
-                business_day_counts = transactions_df.groupby(['day_name', 'potential_business']).agg(
-                    transaction_count=('customer_id', 'count')
-                ).reset_index()
+                # Potential business customers (top 20% by transaction frequency) form the
+                # 'segment' dimension of the transaction cube
+                business_day_counts = yapeal_cube.rollup(transaction_cube, ['weekday', 'segment'])
+                business_day_counts['day_name'] = yapeal_data.day_name_column(business_day_counts['weekday'])
+                business_day_counts = business_day_counts.rename(columns={
+                    'segment': 'potential_business',
+                    'count': 'transaction_count'
+                })
                 
                 # Convert to relative percentages within each group
-                for group in business_day_counts['potential_business'].unique():
-                    group_total = business_day_counts[business_day_counts['potential_business'] == group]['transaction_count'].sum()
-                    business_day_counts.loc[business_day_counts['potential_business'] == group, 'percentage'] = \
-                        business_day_counts.loc[business_day_counts['potential_business'] == group, 'transaction_count'] / group_total * 100
+                group_totals = business_day_counts.groupby('potential_business')['transaction_count'].transform('sum')
+                business_day_counts['percentage'] = business_day_counts['transaction_count'] / group_totals * 100
                 
                 # Create visualization
                 fig = px.bar(
@@ -743,29 +853,26 @@ elif page == "Visualization":
             with ts_tabs[2]:
                 st.subheader("Monthly Transaction Patterns")
                 
-                # Extract month and year
-                transactions_df['month'] = transactions_df['trx_date'].dt.to_period('M')
-                
                 # Create a selector for the year
-                selected_year = st.selectbox("Select Year", sorted(transactions_df['year'].unique()))
+                selected_year = st.selectbox("Select Year", years)
                 
-                # Filter transactions for selected year
-                transactions_year = transactions_df[transactions_df['year'] == selected_year]
+                # Restrict the cube to the selected year
+                cube_year = transaction_cube[transaction_cube['year'] == selected_year]
                 
                 # Calculate average spending per month
-                monthly_avg_spending = transactions_year.groupby(transactions_year['trx_date'].dt.month)['amount_chf'].mean().reset_index()
-                monthly_avg_spending['month_name'] = monthly_avg_spending['trx_date'].apply(lambda x: pd.Timestamp(2023, x, 1).strftime('%B'))
+                monthly_avg_spending = yapeal_cube.rollup(cube_year, ['month'])
+                monthly_avg_spending['month_name'] = yapeal_data.month_name_column(monthly_avg_spending['month'])
                 
                 # Create visualization
                 fig = px.line(
                     monthly_avg_spending,
                     x='month_name',
-                    y='amount_chf',
+                    y='avg_amount',
                     markers=True,
                     title=f"Monthly Average Spending in {selected_year}",
                     labels={
                         "month_name": "Month",
-                        "amount_chf": "Average Spending (CHF)"
+                        "avg_amount": "Average Spending (CHF)"
                     }
                 )
                 
@@ -775,26 +882,21 @@ elif page == "Visualization":
                 st.subheader("Business vs. Personal Monthly Patterns")
                 
                 # Compare business vs. personal average spending by month
-                business_monthly = transactions_year[transactions_year['potential_business']].groupby(transactions_year['trx_date'].dt.month)['amount_chf'].mean().reset_index()
-                business_monthly['month_name'] = business_monthly['trx_date'].apply(lambda x: pd.Timestamp(2023, x, 1).strftime('%B'))
-                business_monthly['group'] = 'Business'
-                
-                personal_monthly = transactions_year[~transactions_year['potential_business']].groupby(transactions_year['trx_date'].dt.month)['amount_chf'].mean().reset_index()
-                personal_monthly['month_name'] = personal_monthly['trx_date'].apply(lambda x: pd.Timestamp(2023, x, 1).strftime('%B'))
-                personal_monthly['group'] = 'Personal'
-                
-                combined_monthly = pd.concat([business_monthly, personal_monthly])
+                combined_monthly = yapeal_cube.rollup(cube_year, ['segment', 'month'])
+                combined_monthly['month_name'] = yapeal_data.month_name_column(combined_monthly['month'])
+                combined_monthly['group'] = np.where(combined_monthly['segment'], 'Business', 'Personal')
+                combined_monthly = combined_monthly.sort_values(['segment', 'month'], ascending=[False, True])
                 
                 fig = px.line(
                     combined_monthly,
                     x='month_name',
-                    y='amount_chf',
+                    y='avg_amount',
                     color='group',
                     markers=True,
                     title=f"Business vs. Personal Average Spending by Month ({selected_year})",
                     labels={
                         "month_name": "Month",
-                        "amount_chf": "Average Spending (CHF)",
+                        "avg_amount": "Average Spending (CHF)",
                         "group": "Customer Type"
                     }
                 )
@@ -803,34 +905,14 @@ elif page == "Visualization":
             with ts_tabs[3]:
                 st.subheader("Seasonal Transaction Patterns")
                 
-                # Define a function to assign a season to each transaction
-                def get_season(month):
-                    if month in [3, 4, 5]:  # Spring
-                        return 'Spring'
-                    elif month in [6, 7, 8]:  # Summer
-                        return 'Summer'
-                    elif month in [9, 10, 11]:  # Autumn
-                        return 'Autumn'
-                    else:  # Winter
-                        return 'Winter'
-                
-                # Add a season column
-                transactions_df['season'] = transactions_df['trx_date'].dt.month.apply(get_season)
-                
-                # Function to get seasonal average spending for each year
+                # Roll the cube up to year x month and derive the season
+                # (Spring = Mar-May, Summer = Jun-Aug, Autumn = Sep-Nov, Winter = Dec-Feb)
                 seasons_order = ['Spring', 'Summer', 'Autumn', 'Winter']
-                seasonal_data = {}
+                monthly_cube = yapeal_cube.rollup(transaction_cube, ['segment', 'year', 'month'])
+                monthly_cube['season'] = yapeal_data.season_column(monthly_cube['month'])
                 
-                for year in years:
-                    year_data = transactions_df[transactions_df['year'] == year]
-                    seasonal_data[year] = year_data.groupby('season')['amount_chf'].mean()
-                
-                # Combine data for plotting
-                seasonal_df = pd.DataFrame(seasonal_data)
-                seasonal_df = seasonal_df.reindex(seasons_order)
-                seasonal_df = seasonal_df.reset_index()
-                seasonal_df.columns = ['season'] + list(seasonal_df.columns[1:])
-                seasonal_df = seasonal_df.melt(id_vars='season', var_name='year', value_name='avg_amount')
+                # Seasonal average spending for each year
+                seasonal_df = yapeal_cube.rollup(monthly_cube, ['year', 'season']).sort_values(['year', 'season'])
                 
                 # Create visualization
                 fig = px.line(
@@ -853,43 +935,25 @@ elif page == "Visualization":
                 st.subheader("Business vs. Personal Seasonal Patterns")
                 
                 # Compare seasonal patterns between business and personal
-                business_seasonal = pd.DataFrame()
-                personal_seasonal = pd.DataFrame()
-                
-                for year in years:
-                    year_data = transactions_df[transactions_df['year'] == year]
-                    
-                    # Business
-                    bus_data = year_data[year_data['potential_business']].groupby('season')['amount_chf'].mean()
-                    bus_df = pd.DataFrame(bus_data).reset_index()
-                    bus_df['year'] = year
-                    bus_df['group'] = 'Business'
-                    business_seasonal = pd.concat([business_seasonal, bus_df])
-                    
-                    # Personal
-                    pers_data = year_data[~year_data['potential_business']].groupby('season')['amount_chf'].mean()
-                    pers_df = pd.DataFrame(pers_data).reset_index()
-                    pers_df['year'] = year
-                    pers_df['group'] = 'Personal'
-                    personal_seasonal = pd.concat([personal_seasonal, pers_df])
-                
-                combined_seasonal = pd.concat([business_seasonal, personal_seasonal])
+                combined_seasonal = yapeal_cube.rollup(monthly_cube, ['segment', 'year', 'season'])
+                combined_seasonal['group'] = np.where(combined_seasonal['segment'], 'Business', 'Personal')
+                combined_seasonal = combined_seasonal.sort_values(['segment', 'season'], ascending=[False, True])
                 
                 # Allow selection of a specific year
-                selected_year_seasonal = st.selectbox("Select Year for Seasonal Comparison", sorted(years), key="seasonal_year")
+                selected_year_seasonal = st.selectbox("Select Year for Seasonal Comparison", years, key="seasonal_year")
                 filtered_seasonal = combined_seasonal[combined_seasonal['year'] == selected_year_seasonal]
                 
                 fig = px.line(
                     filtered_seasonal,
                     x='season',
-                    y='amount_chf',
+                    y='avg_amount',
                     color='group',
                     markers=True,
                     category_orders={"season": seasons_order},
                     title=f"Business vs. Personal Average Spending by Season ({selected_year_seasonal})",
                     labels={
                         "season": "Season",
-                        "amount_chf": "Average Spending (CHF)",
+                        "avg_amount": "Average Spending (CHF)",
                         "group": "Customer Type"
                     }
                 )
@@ -898,19 +962,8 @@ elif page == "Visualization":
             with ts_tabs[4]:
                 st.subheader("Hourly Transaction Patterns")
                 
-                # Extract hour from transaction time
-                transactions_df['hour'] = transactions_df['trx_date'].dt.hour
-                
-                # Function to get hourly average spending for each year
-                hourly_data = {}
-                
-                for year in years:
-                    year_data = transactions_df[transactions_df['year'] == year]
-                    hourly_data[year] = year_data.groupby('hour')['amount_chf'].mean()
-                
-                # Combine data for plotting
-                hourly_df = pd.DataFrame(hourly_data)
-                hourly_df = hourly_df.reset_index().melt(id_vars='hour', var_name='year', value_name='avg_amount')
+                # Hourly average spending for each year
+                hourly_df = yapeal_cube.rollup(transaction_cube, ['year', 'hour']).sort_values(['year', 'hour'])
                 
                 # Create visualization
                 fig = px.line(
@@ -936,28 +989,20 @@ elif page == "Visualization":
                 # Compare business vs. personal
                 # Use the most recent complete year
                 latest_year = max(years)
-                latest_data = transactions_df[transactions_df['year'] == latest_year]
-                
-                # Business hourly pattern
-                business_hourly = latest_data[latest_data['potential_business']].groupby('hour')['amount_chf'].mean().reset_index()
-                business_hourly['group'] = 'Business'
-                
-                # Personal hourly pattern
-                personal_hourly = latest_data[~latest_data['potential_business']].groupby('hour')['amount_chf'].mean().reset_index()
-                personal_hourly['group'] = 'Personal'
-                
-                combined_hourly = pd.concat([business_hourly, personal_hourly])
+                combined_hourly = yapeal_cube.rollup(transaction_cube[transaction_cube['year'] == latest_year], ['segment', 'hour'])
+                combined_hourly['group'] = np.where(combined_hourly['segment'], 'Business', 'Personal')
+                combined_hourly = combined_hourly.sort_values(['segment', 'hour'], ascending=[False, True])
                 
                 fig = px.line(
                     combined_hourly,
                     x='hour',
-                    y='amount_chf',
+                    y='avg_amount',
                     color='group',
                     markers=True,
                     title=f"Business vs. Personal Average Spending by Hour ({latest_year})",
                     labels={
                         "hour": "Hour of Day (24-hour)",
-                        "amount_chf": "Average Spending (CHF)",
+                        "avg_amount": "Average Spending (CHF)",
                         "group": "Customer Type"
                     }
                 )
@@ -1001,8 +1046,12 @@ elif page == "Visualization":
         elif viz_type == "Category Analysis":
             st.subheader("Category Analysis")
             
+            # Category totals rolled up from the transaction cube
+            category_totals = yapeal_cube.rollup(transaction_cube, ['category'])
+            category_totals['category'] = category_totals['category'].astype(str)
+            
             # Top categories
-            top_categories = transactions_df['category'].value_counts().head(10).reset_index()
+            top_categories = category_totals.sort_values('count', ascending=False).head(10)[['category', 'count']]
             top_categories.columns = ['Category', 'Count']
             
             fig = px.bar(
@@ -1015,8 +1064,8 @@ elif page == "Visualization":
             st.plotly_chart(fig, use_container_width=True)
             
             # Category spending
-            category_spending = transactions_df.groupby('category')['amount_chf'].sum().reset_index()
-            category_spending = category_spending.sort_values('amount_chf', ascending=False).head(10)
+            category_spending = category_totals[['category', 'amount_sum']]
+            category_spending = category_spending.sort_values('amount_sum', ascending=False).head(10)
             category_spending.columns = ['Category', 'Total Amount']
             
             fig = px.pie(
@@ -1030,32 +1079,17 @@ elif page == "Visualization":
             # Category analysis by customer
             st.subheader("Customer Category Spending Patterns")
             
-            # Calculate spending percentage by category for each customer
-            customer_category = transactions_df.groupby(['customer_id', 'category'])['amount_chf'].sum().reset_index()
-            customer_total = transactions_df.groupby('customer_id')['amount_chf'].sum().reset_index()
-            customer_total.columns = ['customer_id', 'total_spend']
-            
-            # Merge to calculate percentages
-            customer_category = pd.merge(customer_category, customer_total, on='customer_id')
-            customer_category['percentage'] = (customer_category['amount_chf'] / customer_category['total_spend']) * 100
-            
             # Select a few common categories for comparison
-            common_categories = transactions_df['category'].value_counts().head(6).index.tolist()
-            filtered_data = customer_category[customer_category['category'].isin(common_categories)]
-            
-            # Pivot data for parallel coordinates
-            pivot_data = filtered_data.pivot_table(
-                index='customer_id',
-                columns='category',
-                values='percentage',
-                fill_value=0
-            ).reset_index()
+            common_categories = sorted(transactions_df['category'].value_counts().head(6).index.tolist())
+            
+            # Spending percentage per category for customers active in at least one of them
+            active_customers = (customer_features[[f"{category}_count" for category in common_categories]] > 0).any(axis=1)
+            pivot_data = customer_features.loc[active_customers, [f"{category}_pct" for category in common_categories]]
+            pivot_data = pivot_data.rename(columns={f"{category}_pct": category for category in common_categories}).reset_index()
             
             if not pivot_data.empty and pivot_data.shape[1] > 1:  # Ensure we have data to plot
                 # Add transaction count for coloring
-                customer_txn_count = transactions_df.groupby('customer_id').size().reset_index()
-                customer_txn_count.columns = ['customer_id', 'transaction_count']
-                pivot_data = pd.merge(pivot_data, customer_txn_count, on='customer_id')
+                pivot_data['transaction_count'] = customer_features.loc[active_customers, 'transaction_count'].values
                 
                 # Create parallel coordinates plot
                 dimensions = [{
@@ -1098,17 +1132,16 @@ elif page == "Visualization":
             # Allow user to select categories of interest
             selected_categories = st.multiselect(
                 "Select categories to analyze",
-                options=sorted(transactions_df['category'].unique()),
-                default=transactions_df['category'].value_counts().head(3).index.tolist()
+                options=sorted(category_totals['category']),
+                default=top_categories['Category'].head(3).tolist()
             )
             
             if selected_categories:
-                # Filter transactions 
-                cat_filter = transactions_df['category'].isin(selected_categories)
-                filtered_txn = transactions_df[cat_filter]
+                # Filter the category totals
+                selected_totals = category_totals[category_totals['category'].isin(selected_categories)]
                 
                 # Show transactions by selected categories
-                category_counts = filtered_txn['category'].value_counts().reset_index()
+                category_counts = selected_totals.sort_values('count', ascending=False)[['category', 'count']]
                 category_counts.columns = ['Category', 'Count']
                 
                 fig = px.bar(
@@ -1121,7 +1154,7 @@ elif page == "Visualization":
                 st.plotly_chart(fig, use_container_width=True)
                 
                 # Show comparison of average transaction amount by category
-                cat_amount = filtered_txn.groupby('category')['amount_chf'].mean().reset_index()
+                cat_amount = selected_totals[['category', 'avg_amount']]
                 cat_amount.columns = ['Category', 'Average Amount']
                 
                 fig = px.bar(
@@ -1146,19 +1179,16 @@ elif page == "Visualization":
                 if 'counterpart' not in transactions_df.columns:
                         st.warning("Counterpart data is not available in the transaction dataset.")
                 else:
-                        # Define business-related MCC codes
-                        business_mccs = [2741, 2842, 5013, 5021, 5039, 5044, 5045, 
-                                         5046, 5047, 5051, 5065, 5072, 5074, 5085, 
-                                         5094, 5099, 5111, 5122, 5131, 5137, 5139, 
-                                         5189, 5172, 5192, 5193, 5198, 5199, 7375, 7829]
+                        # Business-related MCC codes (shared with the business segments)
+                        business_mccs = yapeal_segments.BUSINESS_MCCS
                         
                         # Safely convert MCC to string and handle NaN values
-                        transactions_df['mcc_clean'] = pd.to_numeric(transactions_df['mcc'], errors='coerce').astype('Int64')
+                        transactions_df['mcc_clean'] = pd.to_numeric(transactions_df['mcc'], errors='coerce').astype('Int32')
                         
                         # Filter transactions to business-related MCCs
-                        business_transactions = transactions_df[
+                        business_transactions = yapeal_data.drop_unused_categories(transactions_df[
                                 transactions_df['mcc_clean'].isin(business_mccs)
-                        ]
+                        ])
                         
                         # Top Counterparts Analysis
                         col1, col2 = st.columns(2)
@@ -1189,8 +1219,8 @@ elif page == "Visualization":
                         st.markdown("### Counterpart-Category Associations")
                         
                         # Group by counterpart and MCC description
-                        counterpart_mcc_counts = business_transactions.groupby(['counterpart', 'mcc_description']).size().reset_index(name='count')
-                        top_pairs = counterpart_mcc_counts.sort_values('count', ascending=False).head(15)
+                        counterpart_mcc_counts = business_transactions.groupby(['counterpart', 'mcc_description'], observed=True).size().reset_index(name='count')
+                        top_pairs = yapeal_data.drop_unused_categories(counterpart_mcc_counts.sort_values('count', ascending=False).head(15))
                         
                         fig = px.bar(
                                 top_pairs, 
@@ -1230,7 +1260,7 @@ elif page == "Visualization":
                         st.markdown("### Transaction Amount by Counterpart")
                         
                         # Top counterparts by total transaction amount
-                        top_amount_counterparts = business_transactions.groupby('counterpart')['amount_chf'].agg([
+                        top_amount_counterparts = business_transactions.groupby('counterpart', observed=True)['amount_chf'].agg([
                                 ('total_amount', 'sum'),
                                 ('avg_amount', 'mean'),
                                 ('transaction_count', 'count')
@@ -1282,7 +1312,7 @@ elif page == "Visualization":
                 
                 with col2:
                     # Show MCC by amount
-                    mcc_amounts = transactions_df.groupby(mcc_field)['amount_chf'].sum().reset_index()
+                    mcc_amounts = transactions_df.groupby(mcc_field, observed=True)['amount_chf'].sum().reset_index()
                     mcc_amounts = mcc_amounts.sort_values('amount_chf', ascending=False).head(15)
                     mcc_amounts.columns = ['MCC', 'Total Amount']
                     
@@ -1327,7 +1357,7 @@ elif page == "Visualization":
                     mcc_filter = transactions_df['mcc'].astype(str).isin(business_mccs)
                 
                 # Filter for business transactions
-                business_transactions = transactions_df[mcc_filter]
+                business_transactions = yapeal_data.drop_unused_categories(transactions_df[mcc_filter])
                 
                 # Calculate percentage of business transactions
                 business_pct = len(business_transactions) / len(transactions_df) * 100
@@ -1363,14 +1393,14 @@ elif page == "Visualization":
                     
                     # Customer business MCC analysis
                     # Calculate business spending percentage per customer
-                    customer_total = transactions_df.groupby('customer_id')['amount_chf'].sum()
-                    customer_business = business_transactions.groupby('customer_id')['amount_chf'].sum()
+                    customer_total = transactions_df.groupby('customer_id', observed=True)['amount_chf'].sum()
+                    customer_business = business_transactions.groupby('customer_id', observed=True)['amount_chf'].sum()
                     
                     # Merge and calculate percentage
                     customer_business_pct = pd.DataFrame({
                         'total_spent': customer_total,
                         'business_spent': customer_business
-                    }).reset_index().fillna(0)
+                    }).fillna(0).reset_index()
                     
                     customer_business_pct['business_pct'] = (customer_business_pct['business_spent'] / customer_business_pct['total_spent'] * 100).fillna(0)
                     
@@ -1411,6 +1441,10 @@ elif page == "Visualization":
                     st.warning("No business-related MCC transactions found in the dataset.")
 
 elif page == "Clustering":
+    # The machine-learning stack is only imported once this page is opened,
+    # so sessions that stay on the other pages start without it
+    import yapeal_clustering
+    
     st.markdown('<div class="main-header">Business Customer Clustering Analysis</div>', unsafe_allow_html=True)
     
     st.markdown("""
@@ -1421,77 +1455,20 @@ elif page == "Clustering":
     if transactions_df.empty:
         st.error("Could not load the transaction dataset. Please check the file paths and try again.")
     else:
-        # Remove rows with zero amount
-        if 'amount_chf' in transactions_df.columns:
-            transactions_df = transactions_df[transactions_df['amount_chf'] != 0]
-
-        # Filter low activity customers (those with fewer than 10 transactions)
-        if 'customer_id' in transactions_df.columns:
-            low_activity_cluster = transactions_df.groupby('customer_id').size().reset_index(name='low_activity_count')
-            low_activity_cluster = low_activity_cluster[low_activity_cluster['low_activity_count'] < 10]
-        
-            # Remove low activity customers
-            transactions_df = transactions_df[~transactions_df['customer_id'].isin(low_activity_cluster['customer_id'])]
-
-        # Keep only b2b related transactions based on MCC codes
-        if 'mcc' in transactions_df.columns:
-            mcc_to_keep = {2741, 2842,
-                        5013, 5021, 5039, 5044, 5045, 5046, 5047, 5051, 5065, 5072, 5074, 5085, 5094, 5099,
-                        5111, 5122, 5131, 5137, 5139, 5189, 5172, 5192, 5193, 5198, 5199,
-                        7375, 7829}
-        
-            # Get customer IDs with B2B transactions
-            ids_with_b2b = transactions_df.loc[transactions_df['mcc'].isin(mcc_to_keep), 'customer_id'].unique()
-        
-            # Keep only those customers
-            transactions_df = transactions_df[transactions_df['customer_id'].isin(ids_with_b2b)]
-
-        # One-hot encode categories
-        one_hot_category = pd.get_dummies(transactions_df['category']).astype(int)
-
-        # Combine with relevant columns and aggregate by customer
-        df_category = pd.concat([transactions_df['customer_id'], one_hot_category], axis=1)
-        if 'amount_chf' in transactions_df.columns:
-            df_category = pd.concat([df_category, transactions_df[['amount_chf']]], axis=1)
-
-        # Aggregate by customer
-        customer_features = df_category.groupby('customer_id').sum().reset_index()
-
-        # Add transaction count and average amount
-        txn_stats = transactions_df.groupby('customer_id').agg(
-            transaction_count=('customer_id', 'count'),
-            avg_amount=('amount_chf', 'mean')
-        )
-
-        customer_features = pd.merge(
-            customer_features, 
-            txn_stats, 
-            on='customer_id'
-        )
-
-        # IMPORTANT: Store customer IDs before dropping the column
-        customer_ids = customer_features['customer_id'].values
-
-        # Create a copy for clustering that doesn't include customer_id and amount_chf
-        customer_features_for_clustering = customer_features.copy()
-        
-        # Remove columns not needed for clustering
-        if 'customer_id' in customer_features_for_clustering.columns:
-            customer_features_for_clustering = customer_features_for_clustering.drop(columns=['customer_id'])
-
-        if 'amount_chf' in customer_features_for_clustering.columns:
-            customer_features_for_clustering = customer_features_for_clustering.drop(columns=['amount_chf'])
+        # Transactions kept for clustering and their sparse customer x category count matrix plus
+        # transaction count and average amount (customer_ids holds the customer of every matrix row)
+        transactions_df, customer_ids, cluster_columns, feature_matrix = load_clustering_features()
 
-        # Choose columns for clustering
-        cluster_columns = customer_features_for_clustering.columns.tolist()
-
-        # Standardize features for clustering
-        scaler = MinMaxScaler()
-        features_scaled = scaler.fit_transform(customer_features_for_clustering)
-
-        # Apply PCA for visualization
-        pca = PCA(n_components=2)
-        reduced_data = pca.fit_transform(features_scaled)
+        # Min-max scaler and PCA for visualization (fitted once per feature matrix and mode, then
+        # loaded from the artifact store); the scaled matrix stays sparse
+        pca_modes = {label: mode for mode, label in yapeal_clustering.PCA_MODES.items()}
+        pca_mode = pca_modes[st.selectbox("PCA solver", list(pca_modes), key="pca_mode")]
+        preprocessing = load_preprocessing(yapeal_clustering.matrix_fingerprint(feature_matrix), feature_matrix,
+                                           pca_mode=pca_mode)
+        scaler, pca, reduced_data = preprocessing['scaler'], preprocessing['pca'], preprocessing['reduced']
+        features_scaled = yapeal_clustering.minmax_transform(feature_matrix, scaler)
+        # Key of everything built from the PCA points (changes with the PCA solver)
+        reduced_key = yapeal_clustering.matrix_fingerprint(reduced_data)
 
         # Create tabs for different clustering methods
         clustering_tabs = st.tabs(["Data Preparation", "DBSCAN", "K-Means", "Hierarchical Clustering", "Statistical Validation"])
@@ -1536,11 +1513,13 @@ elif page == "Clustering":
                     
                 # Display sample of the features
                 st.subheader("Sample Features for Clustering")
-                st.write(customer_features_for_clustering.head(5))
+                st.write(yapeal_clustering.feature_frame(feature_matrix[:5], cluster_columns))
                 
                 # Show explained variance
                 explained_variance = pca.explained_variance_ratio_.sum() * 100
                 st.metric("PCA Explained Variance", f"{explained_variance:.1f}%")
+                st.caption(f"Solver: {yapeal_clustering.PCA_MODES[preprocessing['pca_mode']]}; explained variance per component: "
+                           + ", ".join(f"{ratio * 100:.1f}%" for ratio in pca.explained_variance_ratio_))
                 
                 # Create DataFrame for PCA visualization
                 pca_df = pd.DataFrame({
@@ -1597,9 +1576,14 @@ elif page == "Clustering":
                 # Compare features across different metrics
                 st.subheader("Feature Distribution Analysis")
                 
+                # Transaction count and average amount of every customer
+                customer_totals = yapeal_clustering.feature_frame(
+                    feature_matrix, cluster_columns, ['transaction_count', 'avg_amount']
+                )
+                
                 # Transaction count distribution
                 fig = px.histogram(
-                    customer_features_for_clustering,
+                    customer_totals,
                     x='transaction_count',
                     nbins=50,
                     title="Distribution of Transaction Count per Customer",
@@ -1608,9 +1592,9 @@ elif page == "Clustering":
                 st.plotly_chart(fig, use_container_width=True)
                 
                 # Average amount distribution
-                if 'avg_amount' in customer_features_for_clustering.columns:
+                if 'avg_amount' in customer_totals.columns:
                     fig = px.histogram(
-                        customer_features_for_clustering,
+                        customer_totals,
                         x='avg_amount',
                         nbins=50,
                         title="Distribution of Average Transaction Amount per Customer",
@@ -1623,11 +1607,11 @@ elif page == "Clustering":
                     st.subheader("Feature Correlation")
                     
                     # Select a subset of features for visualization (top categories by variance)
-                    feature_var = customer_features_for_clustering[cluster_columns].var().sort_values(ascending=False)
-                    top_features = feature_var.head(10).index.tolist()
+                    feature_var = pd.Series(yapeal_clustering.column_variance(feature_matrix), index=cluster_columns)
+                    top_features = feature_var.sort_values(ascending=False).head(10).index.tolist()
                     
                     # Calculate correlation matrix
-                    corr_matrix = customer_features_for_clustering[top_features].corr()
+                    corr_matrix = yapeal_clustering.feature_frame(feature_matrix, cluster_columns, top_features).corr()
                     
                     # Create heatmap
                     fig = px.imshow(
@@ -1649,14 +1633,10 @@ elif page == "Clustering":
                 # Find optimal epsilon for DBSCAN based on k-distance graph
                 st.subheader("Epsilon Parameter Selection")
                 
-                # Calculate distances to nearest neighbors
-                k = 5  # Number of neighbors to consider
-                nn = NearestNeighbors(n_neighbors=k)
-                nn.fit(reduced_data)
-                distances, _ = nn.kneighbors(reduced_data)
-                
-                # Get distances to the k-th nearest neighbor
-                k_distances = np.sort(distances[:, k-1])
+                # KD-tree, sorted k-th neighbour distances and radius graph (built once per feature matrix)
+                k = yapeal_clustering.DBSCAN_KDIST_NEIGHBORS  # Number of neighbors to consider
+                neighbor_graph = load_neighbor_graph(reduced_key, reduced_data)
+                k_distances = neighbor_graph['k_distances']
                 
                 # Plot k-distance graph
                 fig = px.line(
@@ -1667,8 +1647,7 @@ elif page == "Clustering":
                 )
                 
                 # Try to detect knee point (simplified method)
-                knee_idx = np.argmax(np.diff(k_distances)) + 1
-                optimal_eps = float(k_distances[knee_idx])
+                knee_idx, optimal_eps = yapeal_clustering.dbscan_knee(k_distances)
                 
                 # Add vertical line at knee point
                 fig.add_vline(x=knee_idx, line_dash="dash", line_color="red")
@@ -1677,22 +1656,82 @@ elif page == "Clustering":
                 
                 st.plotly_chart(fig, use_container_width=True)
                 
-                # Allow user to adjust epsilon
+                # eps slider step; the sweep grid spans the slider from its smallest eps up to the knee
+                eps_step = yapeal_clustering.DBSCAN_EPS_STEP
+                eps_format = "%.2f"
+                
+                # eps x min_samples grid sweep, started in the background when the tab first opens
+                st.subheader("Parameter Grid Sweep")
+                sweep_future = start_dbscan_sweep(reduced_key, neighbor_graph, reduced_data, eps_step)
+                dbscan_sweep = {}
+                if not sweep_future.done():
+                    st.info("The eps x min_samples grid is being evaluated in the background. "
+                            "Use the sliders below in the meantime.")
+                    st.button("Refresh sweep results", key="dbscan_sweep_refresh")
+                elif sweep_future.exception() is not None:
+                    start_dbscan_sweep.clear()
+                    st.warning(f"The DBSCAN parameter sweep failed: {sweep_future.exception()}")
+                    st.button("Retry sweep", key="dbscan_sweep_retry")
+                elif not sweep_future.result():
+                    st.info("The points are too dense for a grid sweep within the slider range. "
+                            "Use the sliders below.")
+                else:
+                    dbscan_sweep = sweep_future.result()
+                    sweep_df = yapeal_clustering.dbscan_sweep_summary(dbscan_sweep)
+                    sweep_metrics = {
+                        "Number of Clusters": 'n_clusters',
+                        "Noise Share": 'noise_share',
+                        "Silhouette Score (sampled, noise excluded)": 'silhouette',
+                    }
+                    sweep_label = st.radio("Heatmap metric", list(sweep_metrics), horizontal=True,
+                                           key="dbscan_sweep_metric")
+                    sweep_metric = sweep_metrics[sweep_label]
+                    heatmap = sweep_df.pivot(index='min_samples', columns='eps', values=sweep_metric)
+                    eps_by_label = {f"{value:.4g}": value for value in heatmap.columns}
+                    fig = px.imshow(
+                        heatmap,
+                        x=list(eps_by_label),
+                        y=[str(value) for value in heatmap.index],
+                        text_auto='.2f' if sweep_metric != 'n_clusters' else True,
+                        aspect='auto',
+                        color_continuous_scale='Viridis',
+                        title=f"DBSCAN Grid Sweep: {sweep_label}",
+                        labels={"x": "eps", "y": "min_samples", "color": sweep_label}
+                    )
+                    st.plotly_chart(fig, use_container_width=True)
+                    
+                    # Pick a grid cell; its labels come from the sweep without recomputation
+                    cell_col1, cell_col2, cell_col3 = st.columns(3)
+                    cell_col1.selectbox("Grid cell eps", list(eps_by_label), key="dbscan_cell_eps")
+                    cell_col2.selectbox("Grid cell min_samples", list(heatmap.index), key="dbscan_cell_min_samples")
+                    cell_col3.button("Load grid cell", on_click=load_dbscan_cell, args=(eps_by_label,),
+                                     key="dbscan_load_cell")
+                
+                # Allow user to adjust epsilon and min_samples (defaults: knee of the k-distance graph, 5)
+                if 'dbscan_eps' not in st.session_state:
+                    st.session_state['dbscan_eps'] = neighbor_graph['knee_eps']
+                if 'dbscan_min_samples' not in st.session_state:
+                    st.session_state['dbscan_min_samples'] = 5
                 eps = st.slider("Select epsilon value for DBSCAN", 
-                               min_value=0.01, 
-                               max_value=1.0, 
-                               value=float(optimal_eps),
-                               step=0.01,
-                               format="%.2f")
+                               min_value=yapeal_clustering.DBSCAN_MIN_EPS, 
+                               max_value=yapeal_clustering.DBSCAN_MAX_EPS, 
+                               step=eps_step,
+                               format=eps_format,
+                               key="dbscan_eps")
                 
                 min_samples = st.slider("Select minimum samples per cluster", 
                                       min_value=2, 
                                       max_value=20, 
-                                      value=5)
-                
-                # Apply DBSCAN with selected parameters
-                dbscan = DBSCAN(eps=eps, min_samples=min_samples)
-                dbscan_labels = dbscan.fit_predict(reduced_data)
+                                      key="dbscan_min_samples")
+                
+                # Apply DBSCAN with selected parameters: cached labels of a sweep cell, otherwise
+                # a re-labelling of the precomputed neighbour graph (a DBSCAN refit for an eps
+                # above the graph radius)
+                sweep_cell = dbscan_sweep.get((round(eps, 10), min_samples))
+                if sweep_cell is not None:
+                    dbscan_labels = sweep_cell['labels']
+                else:
+                    dbscan_labels = yapeal_clustering.dbscan_labels(neighbor_graph, eps, min_samples)
                 
                 # Count number of clusters and noise points
                 n_clusters = len(set(dbscan_labels)) - (1 if -1 in dbscan_labels else 0)
@@ -1708,7 +1747,7 @@ elif page == "Clustering":
                     'customer_id': customer_ids,
                     'PCA1': reduced_data[:, 0],
                     'PCA2': reduced_data[:, 1],
-                    'cluster': [f"Cluster {label}" if label >= 0 else "Noise" for label in dbscan_labels]
+                    'cluster': yapeal_data.cluster_label_column(dbscan_labels)
                 })
                 
                 # Visualize DBSCAN results
@@ -1717,7 +1756,7 @@ elif page == "Clustering":
                     x='PCA1',
                     y='PCA2',
                     color='cluster',
-                    title=f"DBSCAN Clustering (eps={eps:.2f}, min_samples={min_samples})",
+                    title=f"DBSCAN Clustering (eps={eps_format % eps}, min_samples={min_samples})",
                     labels={"PCA1": "Principal Component 1", "PCA2": "Principal Component 2"}
                 )
                 st.plotly_chart(fig, use_container_width=True)
@@ -1779,10 +1818,10 @@ elif page == "Clustering":
                         transactions_clustered['cluster'] = transactions_clustered['customer_id'].map(cluster_map)
                         
                         # Calculate category distribution per cluster
-                        category_by_cluster = transactions_clustered.groupby(['cluster', 'category']).size().reset_index(name='count')
+                        category_by_cluster = transactions_clustered.groupby(['cluster', 'category'], observed=True).size().reset_index(name='count')
                         
                         # Get total transactions per cluster for normalization
-                        cluster_totals = category_by_cluster.groupby('cluster')['count'].sum().reset_index(name='total')
+                        cluster_totals = category_by_cluster.groupby('cluster', observed=True)['count'].sum().reset_index(name='total')
                         category_by_cluster = pd.merge(category_by_cluster, cluster_totals, on='cluster')
                         category_by_cluster['percentage'] = category_by_cluster['count'] / category_by_cluster['total'] * 100
                         
@@ -1818,45 +1857,33 @@ elif page == "Clustering":
             col1, col2 = st.columns(2)
     
             with col1:
-                # Fixed number of clusters to match the image
-                k = 4
-    
-                # Make sure we're using the same PCA implementation as in the colleague's code
-                pca = PCA(n_components=2)
-                # Use the original scaled data (before any previous PCA was applied)
-                fresh_reduced_data = pca.fit_transform(features_scaled)
-        
-                # Initialize centroids with fixed seed
-                np.random.seed(42)
-                n_samples = fresh_reduced_data.shape[0]
-                indices = np.random.choice(n_samples, k, replace=False)
-                centroids = fresh_reduced_data[indices]
-        
-                # Setup for K-means algorithm
-                distances = np.zeros((n_samples, k))
-        
-                # Run a single pass of K-means assignment (this is what might be different)
-                # Calculate distances to centroids
-                for i in range(k):
-                    distances[:, i] = np.sqrt(np.sum((fresh_reduced_data - centroids[i]) ** 2, axis=1))
-        
-                # Assign points to closest centroid
-                fresh_kmeans_labels = np.argmin(distances, axis=1)
-        
-                # Update centroids once
-                for i in range(k):
-                    if np.sum(fresh_kmeans_labels == i) > 0:
-                        centroids[i] = np.mean(fresh_reduced_data[fresh_kmeans_labels == i], axis=0)
+                # K-Means models for every k of the sweep (fitted once per feature matrix and cached)
+                kmeans_sweep = load_kmeans_sweep(yapeal_clustering.matrix_fingerprint(features_scaled), features_scaled)
+                k_options = sorted(kmeans_sweep)
+                k = st.select_slider(
+                    "Number of clusters (k)",
+                    options=k_options,
+                    value=4 if 4 in k_options else k_options[0]
+                )
+                kmeans_model = kmeans_sweep[k]['model']
+                kmeans_labels = kmeans_sweep[k]['labels']
+                
+                # Project the centroids into the PCA space of the scatter plot
+                centroids = pca.transform(kmeans_model.cluster_centers_)
                 
-                # Assign points to closest centroid
-                kmeans_labels = np.argmin(distances, axis=1)
+                # Keep the selected model available for nightly batch scoring outside the app
+                scoring_model_path = store_scoring_model(yapeal_clustering.matrix_fingerprint(features_scaled), reduced_key,
+                                                         k, cluster_columns, scaler, pca, kmeans_model.cluster_centers_)
+                if scoring_model_path is not None:
+                    st.caption(f"Scoring model saved for batch assignment: `python yapeal_score.py <input> <output> "
+                               f"--model {scoring_model_path}`")
         
                 # Create DataFrame with clustering results
                 kmeans_result = pd.DataFrame({
                     'customer_id': customer_ids,
-                    'PCA1': fresh_reduced_data[:, 0],
-                    'PCA2': fresh_reduced_data[:, 1],
-                    'cluster': [f"Cluster {label}" for label in fresh_kmeans_labels]
+                    'PCA1': reduced_data[:, 0],
+                    'PCA2': reduced_data[:, 1],
+                    'cluster': yapeal_data.cluster_label_column(kmeans_labels)
                 })
         
                 # Visualize with Plotly
@@ -1888,11 +1915,47 @@ elif page == "Clustering":
         
                 st.plotly_chart(fig, use_container_width=True)
         
-                # Calculate silhouette score
-                if len(np.unique(kmeans_labels)) > 1:
-                    silhouette_avg = silhouette_score(reduced_data, kmeans_labels)
-                    st.metric("Silhouette Score", f"{silhouette_avg:.3f}", 
-                            delta="higher is better (range: -1 to 1)")                
+                # Silhouette score (stratified-sample estimate, or exact over all customers on request)
+                exact_silhouette = st.checkbox("Exact silhouette score (all customers, slow for large customer bases)",
+                                               value=False, key="kmeans_exact_silhouette")
+                silhouette = load_silhouette(yapeal_clustering.matrix_fingerprint(features_scaled),
+                                             yapeal_clustering.matrix_fingerprint(kmeans_labels),
+                                             features_scaled, kmeans_labels, exact=exact_silhouette)
+                if silhouette is not None:
+                    if silhouette['exact']:
+                        st.metric("Silhouette Score (exact)", f"{silhouette['silhouette']:.3f}", 
+                                delta="higher is better (range: -1 to 1)")
+                    else:
+                        st.metric("Silhouette Score (estimated)", f"{silhouette['silhouette']:.3f}", 
+                                delta="higher is better (range: -1 to 1)")
+                        st.caption(f"95% confidence interval {silhouette['ci_low']:.3f} - {silhouette['ci_high']:.3f} "
+                                   f"from a stratified sample of {silhouette['n_evaluated']:,} customers")
+                
+                # Elbow and silhouette curves over all k of the sweep
+                sweep_df = yapeal_clustering.sweep_summary(kmeans_sweep)
+                fig = px.line(
+                    sweep_df,
+                    x='k',
+                    y='wcss',
+                    markers=True,
+                    title="Elbow Curve: Within-Cluster Sum of Squares by Number of Clusters",
+                    labels={"k": "Number of Clusters (k)", "wcss": "Within-Cluster Sum of Squares"}
+                )
+                st.plotly_chart(fig, use_container_width=True)
+                
+                sweep_df['ci_plus'] = sweep_df['silhouette_ci_high'] - sweep_df['silhouette']
+                sweep_df['ci_minus'] = sweep_df['silhouette'] - sweep_df['silhouette_ci_low']
+                fig = px.line(
+                    sweep_df,
+                    x='k',
+                    y='silhouette',
+                    error_y='ci_plus',
+                    error_y_minus='ci_minus',
+                    markers=True,
+                    title="Silhouette Score by Number of Clusters (estimated, 95% confidence interval)",
+                    labels={"k": "Number of Clusters (k)", "silhouette": "Silhouette Score"}
+                )
+                st.plotly_chart(fig, use_container_width=True)
             
             with col2:
                 st.markdown('<div class="insight-box">', unsafe_allow_html=True)
@@ -1951,10 +2014,10 @@ elif page == "Clustering":
                     transactions_clustered['cluster'] = transactions_clustered['customer_id'].map(cluster_map)
                     
                     # Calculate category distribution per cluster
-                    category_by_cluster = transactions_clustered.groupby(['cluster', 'category']).size().reset_index(name='count')
+                    category_by_cluster = transactions_clustered.groupby(['cluster', 'category'], observed=True).size().reset_index(name='count')
                     
                     # Get total transactions per cluster for normalization
-                    cluster_totals = category_by_cluster.groupby('cluster')['count'].sum().reset_index(name='total')
+                    cluster_totals = category_by_cluster.groupby('cluster', observed=True)['count'].sum().reset_index(name='total')
                     category_by_cluster = pd.merge(category_by_cluster, cluster_totals, on='cluster')
                     category_by_cluster['percentage'] = category_by_cluster['count'] / category_by_cluster['total'] * 100
                     
@@ -1982,58 +2045,33 @@ elif page == "Clustering":
     
             with col1:
                 # Calculate linkage matrix for hierarchical clustering
-                linkage_matrix = sch.linkage(features_scaled, method='ward')
-        
-                # Create dendrogram figure
-                fig = go.Figure()
-        
-                # Convert scipy dendrogram to plotly format
-                dendro = sch.dendrogram(linkage_matrix, no_plot=True)
-        
-                # Add dendrogram traces
-                for i, d in enumerate(dendro['dcoord']):
-                    x = dendro['icoord'][i]
-                    y = d
-                    fig.add_trace(go.Scatter(
-                        x=x, 
-                        y=y,
-                        mode='lines',
-                        line=dict(color='blue', width=1),
-                        hoverinfo='none'
-                    ))
-        
-                fig.update_layout(
-                    title="Hierarchical Clustering Dendrogram",
-                    xaxis_title="Sample Index",
-                    yaxis_title="Distance",
-                    showlegend=False,
-                    height=600
+                # (above yapeal_clustering.HIERARCHY_EXACT_MAX_ROWS customers Ward runs on weighted micro-cluster centroids)
+                hierarchy = load_hierarchy(yapeal_clustering.matrix_fingerprint(features_scaled), features_scaled)
+                linkage_matrix = hierarchy['linkage']
+                if not hierarchy['exact']:
+                    st.caption(f"{len(customer_ids):,} customers compressed into {len(hierarchy['weights']):,} micro-clusters; "
+                               "the dendrogram shows the micro-clusters and labels are propagated back to the customers.")
+        
+                # Truncated dendrogram (top merges, leaf labels = number of customers)
+                fig = pio.from_json(
+                    load_dendrogram_json(yapeal_clustering.matrix_fingerprint(features_scaled), hierarchy)
                 )
-        
                 st.plotly_chart(fig, use_container_width=True)
         
                 # Determine optimal number of clusters
-                # Calculate within-cluster sum of squares for different cluster counts
-                wcss = []
-                max_clusters = 10
-        
-                for i in range(1, max_clusters + 1):
-                    labels = sch.fcluster(linkage_matrix, t=i, criterion='maxclust')
-            
-                    # Calculate WCSS for this clustering
-                    wcss_i = 0
-                    for cluster_id in range(1, i + 1):
-                        cluster_points = reduced_data[labels == cluster_id]
-                        if len(cluster_points) > 0:
-                            centroid = np.mean(cluster_points, axis=0)
-                            wcss_i += np.sum(np.square(cluster_points - centroid))
-            
-                    wcss.append(wcss_i)
+                # Within-cluster sum of squares for every cut of the hierarchy (computed once for all k)
+                wcss = load_hierarchy_wcss(yapeal_clustering.matrix_fingerprint(features_scaled), reduced_key,
+                                           hierarchy, reduced_data)
+                max_clusters = st.slider("Maximum number of clusters in the elbow curve",
+                                min_value=2,
+                                max_value=len(wcss),
+                                value=min(10, len(wcss)),
+                                key="hclust_elbow_max")
         
                 # Plot WCSS (elbow method)
                 fig = px.line(
                     x=list(range(1, max_clusters + 1)),
-                    y=wcss,
+                    y=wcss[:max_clusters],
                     markers=True,
                     title="Elbow Method for Optimal Cluster Count",
                     labels={"x": "Number of Clusters", "y": "Within-Cluster Sum of Squares"}
@@ -2047,18 +2085,15 @@ elif page == "Clustering":
                                 value=4,
                                 key="hclust_k")
         
-                # Apply hierarchical clustering with selected number of clusters
-                hclust_labels = sch.fcluster(linkage_matrix, t=hclust_k, criterion='maxclust')
-        
-                # Adjust labels to be 0-based instead of 1-based
-                hclust_labels = hclust_labels - 1
+                # Apply hierarchical clustering with selected number of clusters (0-based labels)
+                hclust_labels = yapeal_clustering.hierarchical_labels(hierarchy, hclust_k)
         
                 # Create DataFrame with clustering results using consistent naming (Cluster 0, Cluster 1, etc.)
                 hclust_result = pd.DataFrame({
                     'customer_id': customer_ids,
                     'PCA1': reduced_data[:, 0],
                     'PCA2': reduced_data[:, 1],
-                    'cluster': [f"Cluster {label}" for label in hclust_labels]
+                    'cluster': yapeal_data.cluster_label_column(hclust_labels)
                 })
         
                 # Visualize hierarchical clustering results
@@ -2072,6 +2107,15 @@ elif page == "Clustering":
                 )
                 st.plotly_chart(fig, use_container_width=True)
         
+                # Silhouette score of the selected cut (stratified-sample estimate)
+                silhouette = load_silhouette(yapeal_clustering.matrix_fingerprint(features_scaled),
+                                             yapeal_clustering.matrix_fingerprint(hclust_labels),
+                                             features_scaled, hclust_labels)
+                if silhouette is not None:
+                    st.metric("Silhouette Score (estimated)", f"{silhouette['silhouette']:.3f}", 
+                            delta="higher is better (range: -1 to 1)")
+                    st.caption(f"95% confidence interval {silhouette['ci_low']:.3f} - {silhouette['ci_high']:.3f}")
+        
             with col2:
                 st.markdown('<div class="insight-box">', unsafe_allow_html=True)
                 st.markdown("""
@@ -2130,10 +2174,10 @@ elif page == "Clustering":
                     transactions_clustered['cluster'] = transactions_clustered['customer_id'].map(cluster_map)
             
                     # Calculate category distribution per cluster
-                    category_by_cluster = transactions_clustered.groupby(['cluster', 'category']).size().reset_index(name='count')
+                    category_by_cluster = transactions_clustered.groupby(['cluster', 'category'], observed=True).size().reset_index(name='count')
             
                     # Get total transactions per cluster for normalization
-                    cluster_totals = category_by_cluster.groupby('cluster')['count'].sum().reset_index(name='total')
+                    cluster_totals = category_by_cluster.groupby('cluster', observed=True)['count'].sum().reset_index(name='total')
                     category_by_cluster = pd.merge(category_by_cluster, cluster_totals, on='cluster')
                     category_by_cluster['percentage'] = category_by_cluster['count'] / category_by_cluster['total'] * 100
             
@@ -2158,120 +2202,109 @@ elif page == "Clustering":
             # Create two columns
             col1, col2 = st.columns([2, 1])
     
+            # Chi-square, Cramer's V, residuals and permutation test of the K-Means clusters
+            # against the spending categories (computed once per feature matrix and labelling)
+            category_names = np.array(cluster_columns[:-2])
+            validation = load_validation(yapeal_clustering.matrix_fingerprint(feature_matrix),
+                                         yapeal_clustering.matrix_fingerprint(kmeans_labels),
+                                         feature_matrix[:, :-2], kmeans_labels)
+            validation_categories = category_names[validation['categories_used']]
+            validation_clusters = yapeal_data.cluster_label_column(np.arange(validation['table'].shape[0]))
+    
             with col1:
                 st.markdown('<div class="section-header">Statistical Validation of Clustering</div>', unsafe_allow_html=True)
         
                 st.markdown('<div class="insight-box">', unsafe_allow_html=True)
-                st.markdown("""
+                st.markdown(f"""
                 ### Chi-Square Test and Statistical Validation
         
                 **Validation Approach:**
-                - Used Chi-Square tests to validate cluster distinctiveness
-                - Examined spending patterns across different clusters
-                - Analyzed standardized residuals to identify characteristic features
-        
-                **Statistical Findings:**
-                - Confirmed statistically significant differences in spending patterns across clusters
-                - p-values consistently below 0.001, indicating robust cluster differentiation
-                - Strong association between clusters and spending categories (Cramer's V > 0.6)
-        
-                **Categorical Distinctiveness:**
-                - Each cluster shows significantly different spending behaviors
-                - Standardized residuals reveal unique spending characteristics:
+                - Contingency table of transactions by K-Means cluster (k={k}) and spending category
+                - Chi-Square test of independence between clusters and categories
+                - Permutation test: customers are shuffled between clusters {validation['permutations']:,} times,
+                  so the p-value does not assume independent transactions
+                - Adjusted standardized residuals identify the characteristic categories of each cluster:
                   * **Positive Residuals**: Categories where a cluster spends more than expected
                   * **Negative Residuals**: Categories with less spending than anticipated
-        
-                **Cluster Profiles Based on Statistical Analysis:**
-                
-                - **Cluster 0 (Professional Services):**
-                  * Significantly higher spending in software and digital services
-                  * Lower than expected spending in retail and entertainment
-                
-                - **Cluster 1 (Tech & Equipment):**
-                  * Excess spending in computer equipment and technology
-                  * Substantially lower spending in services and consumables
-                
-                - **Cluster 2 (Business Supplies):**
-                  * Concentrated spending in office supplies and business materials
-                  * Minimal spending in digital services
-                
-                - **Cluster 3 (Mixed Business):**
-                  * Balanced spending across multiple categories
-                  * No single dominant category, but consistent business-oriented spending
                 """)
                 st.markdown('</div>', unsafe_allow_html=True)
+                
+                # Test results
+                metric_col1, metric_col2, metric_col3 = st.columns(3)
+                metric_col1.metric("Chi-Square", f"{validation['chi2']:,.1f}", delta=f"{validation['dof']} degrees of freedom",
+                                   delta_color="off")
+                if validation['permutation_p_value'] is not None:
+                    # No chi-square p-value without degrees of freedom (a single category or cluster)
+                    chi2_p_value = (f"chi-square distribution: {validation['p_value']:.2g}"
+                                    if validation['p_value'] is not None else None)
+                    metric_col2.metric("Permutation p-value", f"{validation['permutation_p_value']:.4f}",
+                                       delta=chi2_p_value, delta_color="off")
+                if validation['cramers_v'] is not None:
+                    cramers_v = validation['cramers_v']
+                    strength = "strong" if cramers_v >= 0.5 else "moderate" if cramers_v >= 0.3 else "weak" if cramers_v >= 0.1 else "negligible"
+                    metric_col3.metric("Cramer's V", f"{cramers_v:.3f}", delta=f"{strength} association", delta_color="off")
+                
+                # Adjusted standardized residuals (|r| > 1.96 is significant at the 5% level)
+                residual_df = pd.DataFrame(validation['residuals'], index=validation_clusters, columns=validation_categories)
+                limit = max(float(np.abs(validation['residuals']).max()), 1.96)
+                fig = px.imshow(
+                    residual_df,
+                    color_continuous_scale='RdBu_r',
+                    zmin=-limit,
+                    zmax=limit,
+                    text_auto='.1f',
+                    aspect='auto',
+                    title='Adjusted Standardized Residuals by Cluster and Category'
+                )
+                fig.update_layout(xaxis_title='Categories', yaxis_title='Clusters', height=500,
+                                  coloraxis_colorbar=dict(title="Residual"))
+                fig.update_xaxes(tickangle=45)
+                st.plotly_chart(fig, use_container_width=True)
+                
+                # Cluster profiles from the significant residuals
+                st.markdown("**Cluster Profiles Based on Statistical Analysis:**")
+                for cluster, residuals in residual_df.iterrows():
+                    ordered = residuals.sort_values()
+                    over = [f"{name} ({value:+.1f})" for name, value in ordered[::-1].items() if value > 1.96][:3]
+                    under = [f"{name} ({value:+.1f})" for name, value in ordered.items() if value < -1.96][:3]
+                    st.markdown(f"- **{cluster}:** more than expected: {', '.join(over) or 'none'}; "
+                                f"less than expected: {', '.join(under) or 'none'}")
     
             with col2:
-                # Use the kmeans results for demonstration purposes
                 st.subheader("Category Distribution by Cluster")
                 
-                # Add cluster information to customer data if not already done
-                try:
-                    # Create a copy of the k-means labels to use for this visualization
-                    kmeans_labels_for_heatmap = kmeans_labels.copy()
-                    
-                    # Prepare data for heatmap
-                    if 'category' in transactions_df.columns:
-                        # Merge cluster information with transactions
-                        cluster_map = dict(zip(customer_ids, kmeans_labels_for_heatmap))
-                        transactions_clustered = transactions_df.copy()
-                        transactions_clustered['cluster'] = transactions_clustered['customer_id'].map(cluster_map)
-                        
-                        # Get top categories for analysis
-                        top_categories = transactions_df['category'].value_counts().head(5).index.tolist()
-                        
-                        # Create contingency table of categories by cluster
-                        contingency = pd.crosstab(
-                            transactions_clustered['cluster'],
-                            transactions_clustered['category'],
-                            values=transactions_clustered['amount_chf'],
-                            aggfunc='count',
-                            normalize='index'  # Convert to proportions within each cluster
-                        ) * 100  # Convert to percentages
-                        
-                        # Filter to top categories and fill NaN values with 0
-                        contingency = contingency[top_categories].fillna(0)
-                        
-                        # Create heatmap DataFrame
-                        heatmap_df = contingency.copy()
-                        
-                        # Reset index to get cluster as a column
-                        heatmap_df = heatmap_df.reset_index()
-                        
-                        # Rename clusters for display
-                        heatmap_df['cluster'] = heatmap_df['cluster'].apply(lambda x: f'Cluster {int(x)}')
-                        
-                        # Set index back to cluster for visualization
-                        heatmap_df = heatmap_df.set_index('cluster')
-                        
-                        # Create Plotly heatmap
-                        fig = px.imshow(
-                            heatmap_df, 
-                            color_continuous_scale='Blues',
-                            text_auto='.1f',  # Show 1 decimal place
-                            title='Category Distribution by Cluster (% of transactions)'
-                        )
-                        
-                        # Customize layout
-                        fig.update_layout(
-                            xaxis_title='Categories',
-                            yaxis_title='Clusters',
-                            height=500,
-                            coloraxis_colorbar=dict(
-                                title="% of Transactions"
-                            )
-                        )
-                        
-                        # Rotate x-axis labels for better readability
-                        fig.update_xaxes(tickangle=45)
-                        
-                        # Display the plot
-                        st.plotly_chart(fig, use_container_width=True)
-                    else:
-                        st.warning("Category information not available for heatmap visualization.")
-                except Exception as e:
-                    st.error(f"Error creating heatmap: {str(e)}")
-                    st.warning("Please run K-means clustering first to generate cluster assignments.")
+                # Share of each cluster's transactions in the five most frequent categories,
+                # read from the contingency table of the validation
+                table = validation['table']
+                top = np.argsort(-table.sum(axis=0), kind='stable')[:5]
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    shares = np.nan_to_num(table[:, top] / table.sum(axis=1, keepdims=True) * 100)
+                heatmap_df = pd.DataFrame(shares, index=pd.Index(validation_clusters, name='cluster'),
+                                          columns=validation_categories[top])
+                
+                # Create Plotly heatmap
+                fig = px.imshow(
+                    heatmap_df, 
+                    color_continuous_scale='Blues',
+                    text_auto='.1f',  # Show 1 decimal place
+                    title='Category Distribution by Cluster (% of transactions)'
+                )
+                
+                # Customize layout
+                fig.update_layout(
+                    xaxis_title='Categories',
+                    yaxis_title='Clusters',
+                    height=500,
+                    coloraxis_colorbar=dict(
+                        title="% of Transactions"
+                    )
+                )
+                
+                # Rotate x-axis labels for better readability
+                fig.update_xaxes(tickangle=45)
+                
+                # Display the plot
+                st.plotly_chart(fig, use_container_width=True)
 
 elif page == "Findings & Recommendations":
     st.markdown('<div class="main-header">Findings & Recommendations</div>', unsafe_allow_html=True)
@@ -2331,32 +2364,30 @@ elif page == "Findings & Recommendations":
     if not transactions_df.empty:
         # Calculate metrics if data is available
         try:
-            # Identify potential business customers (top 15% by transaction count)
-            txn_threshold = np.percentile(transactions_df.groupby('customer_id').size(), 85)
-            high_txn_customers = transactions_df.groupby('customer_id').size()
-            high_txn_customers = high_txn_customers[high_txn_customers >= txn_threshold].index
+            st.markdown('<div class="section-header">Value Proposition</div>', unsafe_allow_html=True)
             
-            # Calculate business vs. non-business metrics
-            business_txns = transactions_df[transactions_df['customer_id'].isin(high_txn_customers)]
-            non_business_txns = transactions_df[~transactions_df['customer_id'].isin(high_txn_customers)]
+            # Identify potential business customers (top 15% by transaction count by default)
+            business_percentile = st.slider(
+                "Transaction count percentile for potential business customers",
+                min_value=50, max_value=99, value=85, key="findings_percentile"
+            )
+            business_summary = yapeal_segments.threshold_summary(load_percentile_index(), 'transaction_count', business_percentile)
             
             # Transaction metrics
-            business_customers_count = len(high_txn_customers)
-            total_customers_count = transactions_df['customer_id'].nunique()
+            business_customers_count = business_summary['customers']
+            total_customers_count = business_summary['total_customers']
             business_customer_pct = business_customers_count / total_customers_count * 100
             
-            business_txn_count = len(business_txns)
-            total_txn_count = len(transactions_df)
+            business_txn_count = int(business_summary['transactions'])
+            total_txn_count = int(business_summary['total_transactions'])
             business_txn_pct = business_txn_count / total_txn_count * 100
             
             # Amount metrics
-            business_amount = business_txns['amount_chf'].sum()
-            total_amount = transactions_df['amount_chf'].sum()
+            business_amount = business_summary['amount']
+            total_amount = business_summary['total_amount']
             business_amount_pct = business_amount / total_amount * 100
             
             # Display value metrics
-            st.markdown('<div class="section-header">Value Proposition</div>', unsafe_allow_html=True)
-            
             st.markdown(f"""
             Our analysis identified **{business_customers_count:,} potential business customers** 
             ({business_customer_pct:.1f}% of the customer base) who represent:
@@ -0,0 +1,132 @@
+# Persisted clustering artifacts for the Clustering page.
+# Fitted scalers, PCA projections, K-Means models, linkages and labels are saved
+# in <DATA_DIR>/.yapeal_cache/artifacts, keyed by a hash of the input feature
+# matrix and the parameters, so a new session or a restarted worker loads them
+# from disk instead of fitting them again.
+# Kept free of Streamlit so the same code can be reused outside the app.
+import hashlib
+import json
+import os
+
+import joblib
+import numpy as np
+
+import yapeal_data
+
+ARTIFACT_DIR = os.path.join(yapeal_data.CACHE_DIR, 'artifacts')
+
+# Bump this whenever the content of an artifact changes so old files are ignored
+ARTIFACT_VERSION = 1
+
+
+# Hash of an artifact name, the fingerprint of its input matrix and its parameters
+def artifact_key(name, feature_key, params=None):
+    key = json.dumps([name, feature_key, params or {}, ARTIFACT_VERSION], sort_keys=True, default=str)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+
+# Location of an artifact file ('.npz' for plain arrays, '.joblib' for fitted models)
+def artifact_path(name, key, extension, artifact_dir=None):
+    return os.path.join(artifact_dir or ARTIFACT_DIR, f"{name}-{key}{extension}")
+
+
+# True for a flat dict of arrays and numbers, which is stored as .npz (no pickling)
+def _is_array_dict(value):
+    return isinstance(value, dict) and all(
+        isinstance(item, (np.ndarray, np.generic, bool, int, float)) for item in value.values()
+    )
+
+
+# Write an artifact atomically (temporary file first, so readers never see a partial file)
+def save_artifact(name, key, value, artifact_dir=None):
+    artifact_dir = artifact_dir or ARTIFACT_DIR
+    os.makedirs(artifact_dir, exist_ok=True)
+    extension = '.npz' if _is_array_dict(value) else '.joblib'
+    path = artifact_path(name, key, extension, artifact_dir)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    if extension == '.npz':
+        with open(tmp, 'wb') as handle:
+            np.savez(handle, **value)
+    else:
+        joblib.dump(value, tmp)
+    os.replace(tmp, path)
+    return path
+
+
+# Read an artifact, or None when it does not exist or cannot be read
+def load_artifact(name, key, artifact_dir=None):
+    npz_path = artifact_path(name, key, '.npz', artifact_dir)
+    joblib_path = artifact_path(name, key, '.joblib', artifact_dir)
+    try:
+        if os.path.exists(npz_path):
+            with np.load(npz_path, allow_pickle=False) as data:
+                # 0-d arrays hold the numbers and flags of the dict
+                return {item: data[item].item() if data[item].ndim == 0 else data[item] for item in data.files}
+        if os.path.exists(joblib_path):
+            return joblib.load(joblib_path)
+    except Exception:
+        # Corrupt or unreadable artifact - recomputed by the caller
+        pass
+    return None
+
+
+# Load an artifact from the store, or compute it with compute() and store it.
+# A store that cannot be written (read-only data folder) only costs the recomputation.
+def cached_artifact(name, feature_key, params, compute, artifact_dir=None):
+    key = artifact_key(name, feature_key, params)
+    value = load_artifact(name, key, artifact_dir)
+    if value is None:
+        value = compute()
+        try:
+            save_artifact(name, key, value, artifact_dir)
+        except (OSError, ValueError, TypeError):
+            pass
+    return value
+
+
+# Newest artifact file of a name (by modification time), or None
+def latest_artifact_path(name, artifact_dir=None):
+    artifact_dir = artifact_dir or ARTIFACT_DIR
+    if not os.path.isdir(artifact_dir):
+        return None
+    paths = [os.path.join(artifact_dir, file) for file in os.listdir(artifact_dir)
+             if file.startswith(f"{name}-") and file.endswith(('.npz', '.joblib'))]
+    return max(paths, key=os.path.getmtime, default=None)
+
+
+# Store everything batch scoring needs as plain arrays (.npz, no pickled models):
+# the feature names in column order, the min-max scaler, the PCA projection and
+# the K-Means centroids in scaled feature space. The key covers the PCA projection
+# (it depends on the PCA solver); an existing file for the same configuration is
+# only touched, so it becomes the latest scoring model.
+def save_scoring_model(feature_key, feature_names, scaler, pca, centroids, artifact_dir=None):
+    # TruncatedSVD projects without centring
+    pca_mean = getattr(pca, 'mean_', np.zeros(len(feature_names)))
+    pca_components = np.ascontiguousarray(pca.components_, dtype='float64')
+    pca_hash = hashlib.sha1(np.ascontiguousarray(pca_mean, dtype='float64').tobytes() + pca_components.tobytes())
+    key = artifact_key('scoring_model', feature_key, {'k': len(centroids), 'pca': pca_hash.hexdigest()[:16]})
+    path = artifact_path('scoring_model', key, '.npz', artifact_dir)
+    if os.path.exists(path):
+        os.utime(path)
+        return path
+    return save_artifact('scoring_model', key, {
+        'feature_names': np.asarray(feature_names, dtype=str),
+        'data_min': scaler['data_min'],
+        'scale': scaler['scale'],
+        'pca_mean': pca_mean,
+        'pca_components': pca.components_,
+        'centroids': np.asarray(centroids, dtype='float64'),
+    }, artifact_dir)
+
+
+# Load a scoring model file (the latest one saved by the Clustering page by default)
+def load_scoring_model(path=None, artifact_dir=None):
+    path = path or latest_artifact_path('scoring_model', artifact_dir)
+    if path is None or not os.path.exists(path):
+        raise FileNotFoundError("No scoring model found - open the K-Means tab of the Clustering page once "
+                                f"or pass the path of a scoring_model-*.npz file (looked in {artifact_dir or ARTIFACT_DIR})")
+    with np.load(path, allow_pickle=False) as data:
+        model = {item: data[item] for item in data.files}
+    model['feature_names'] = [str(name) for name in model['feature_names']]
+    model['path'] = path
+    return model
@@ -0,0 +1,478 @@
+# Benchmarks for the data and clustering helpers of the app.
+# Run with: python yapeal_bench.py <benchmark> [--rows N]
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import yapeal_data
+import yapeal_metrics
+
+CATEGORIES = ['groceries', 'restaurants', 'software', 'travel', 'office', 'entertainment',
+              'transport', 'health', 'telecom', 'publishing', 'clothing', 'insurance']
+MCCS = [5411, 5812, 5734, 4511, 5111, 7832, 4111, 5045, 2741, 5099, 5651, 6300]
+
+
+# Synthetic transactions with the columns and dtypes of the real export
+def synthetic_transactions(n_rows, n_customers=None, seed=0):
+    rng = np.random.default_rng(seed)
+    n_customers = n_customers or max(n_rows // 200, 10)
+
+    # A few heavy customers and a long tail, like the real data
+    weights = rng.pareto(1.2, n_customers) + 1
+    customer_codes = rng.choice(n_customers, n_rows, p=weights / weights.sum())
+    seconds = rng.integers(0, 3 * 365 * 24 * 3600, n_rows)
+    trx_date = pd.Timestamp('2021-01-01') + pd.to_timedelta(seconds, unit='s')
+    category_codes = rng.integers(0, len(CATEGORIES), n_rows)
+
+    return pd.DataFrame({
+        'customer_id': pd.Categorical.from_codes(customer_codes, [f"c{i:07d}" for i in range(n_customers)]),
+        'trx_date': trx_date,
+        'amount_chf': rng.lognormal(3, 1, n_rows).astype('float32'),
+        'category': pd.Categorical.from_codes(category_codes, CATEGORIES),
+        'mcc': np.asarray(MCCS, dtype='int32')[category_codes],
+        'year': trx_date.year.astype('int16'),
+    })
+
+
+# Best wall-clock time of a few runs, in seconds
+def timed(func, *args, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+# The groupby + merge chain that load_data() and the Clustering page used before the feature engine
+def legacy_customer_features(transactions_df):
+    freq = transactions_df.groupby('customer_id', observed=True).size().reset_index(name='transaction_frequency')
+    avg = transactions_df.groupby('customer_id', observed=True)['amount_chf'].mean().reset_index(name='avg_transaction_amount')
+    total = transactions_df.groupby('customer_id', observed=True)['amount_chf'].sum().reset_index(name='total_spent')
+    metrics = pd.merge(pd.merge(freq, avg, on='customer_id'), total, on='customer_id')
+
+    spending = transactions_df.groupby(['customer_id', 'category'], observed=True)['amount_chf'].sum().reset_index()
+    totals = transactions_df.groupby('customer_id', observed=True)['amount_chf'].sum().reset_index()
+    totals.columns = ['customer_id', 'total_customer_spend']
+    spending = pd.merge(spending, totals, on='customer_id')
+    spending['percentage'] = spending['amount_chf'] / spending['total_customer_spend'] * 100
+    pivot = spending.pivot_table(index='customer_id', columns='category', values='percentage',
+                                 fill_value=0, observed=True).reset_index()
+    metrics = pd.merge(metrics, pivot, on='customer_id', how='left')
+
+    is_weekend = transactions_df['trx_date'].dt.dayofweek.isin([5, 6]).astype(int)
+    weekend = is_weekend.groupby(transactions_df['customer_id'], observed=True).mean().reset_index()
+    metrics = pd.merge(metrics, weekend, on='customer_id', how='left')
+
+    one_hot = pd.get_dummies(transactions_df['category']).astype(int)
+    category_counts = pd.concat([transactions_df['customer_id'], one_hot], axis=1).groupby('customer_id', observed=True).sum()
+    return metrics, category_counts
+
+
+# Single-pass feature engine
+def engine_customer_features(transactions_df):
+    return yapeal_metrics.customer_feature_table(yapeal_metrics.customer_aggregates(transactions_df))
+
+
+# Check that the engine reproduces the groupby/merge and get_dummies path
+# (including customers with missing amounts, which mean() skips). The amounts are
+# float32, which pandas sums in float32, so amounts are compared to float32 precision.
+def check_customer_features(transactions_df):
+    import yapeal_clustering
+
+    metrics, category_counts = legacy_customer_features(transactions_df)
+    metrics = metrics.set_index('customer_id')
+    features = engine_customer_features(transactions_df)
+    np.testing.assert_array_equal(features['transaction_count'], metrics['transaction_frequency'])
+    np.testing.assert_allclose(features['avg_amount'], metrics['avg_transaction_amount'], rtol=1e-5)
+    np.testing.assert_allclose(features['total_amount'], metrics['total_spent'], rtol=1e-5)
+    # The weekend share of the legacy frame is in its trx_date column
+    np.testing.assert_allclose(features['weekday_ratio'], 100 - metrics['trx_date'].to_numpy() * 100, atol=1e-9)
+    for category in category_counts.columns:
+        np.testing.assert_allclose(features[f"{category}_pct"], metrics[category].fillna(0), atol=1e-4)
+        np.testing.assert_array_equal(features[f"{category}_count"], category_counts[category])
+
+    # Clustering matrix: category counts (alphabetical), transaction count and average amount per customer
+    _, _, matrix = yapeal_clustering.clustering_features(yapeal_metrics.customer_aggregates(transactions_df))
+    legacy_matrix = category_counts[sorted(category_counts.columns)].join(metrics[['transaction_frequency', 'avg_transaction_amount']])
+    np.testing.assert_allclose(matrix.toarray(), legacy_matrix.to_numpy(dtype='float64'), rtol=1e-5)
+
+
+def bench_features(n_rows):
+    transactions_df = synthetic_transactions(n_rows)
+    # Some amounts are missing (apply_schema turns unparsable amounts into NaN)
+    transactions_df.loc[transactions_df.index[::97], 'amount_chf'] = np.nan
+    check_customer_features(transactions_df)
+    legacy = timed(legacy_customer_features, transactions_df)
+    engine = timed(engine_customer_features, transactions_df)
+    print(f"customer features, {n_rows:,} transactions, {transactions_df['customer_id'].nunique():,} customers")
+    print(f"  groupby + merge chain: {legacy:8.3f} s")
+    print(f"  single-pass engine:    {engine:8.3f} s  ({legacy / engine:.1f}x faster)")
+
+
+# Per-row Python labelling the pages used before the vectorized label utilities
+def legacy_labels(customer_ids, outlier_customers, months, cluster_labels):
+    outlier_list = list(outlier_customers)
+    group = customer_ids.apply(lambda x: 'Potential-Business' if x in outlier_list else 'Potential-Non-Business')
+    season = months.apply(lambda m: 'Spring' if m in [3, 4, 5] else 'Summer' if m in [6, 7, 8]
+                          else 'Autumn' if m in [9, 10, 11] else 'Winter')
+    month_name = months.apply(lambda x: pd.Timestamp(2023, x, 1).strftime('%B'))
+    cluster = [f"Cluster {label}" if label >= 0 else "Noise" for label in cluster_labels]
+    return group, season, month_name, cluster
+
+
+# Vectorized label utilities (membership test, lookup arrays)
+def vectorized_labels(customer_ids, outlier_customers, months, cluster_labels):
+    group = yapeal_data.membership_labels(customer_ids, outlier_customers, 'Potential-Business', 'Potential-Non-Business')
+    season = yapeal_data.season_column(months)
+    month_name = yapeal_data.month_name_column(months)
+    cluster = yapeal_data.cluster_label_column(cluster_labels)
+    return group, season, month_name, cluster
+
+
+def bench_labels(n_rows):
+    rng = np.random.default_rng(0)
+    n_customers = max(n_rows // 200, 10)
+    customers = pd.Series([f"c{i:07d}" for i in range(n_customers)])
+    outlier_customers = customers.sample(frac=0.05, random_state=0)
+
+    def inputs(rows):
+        return (
+            pd.Series(customers.to_numpy()[rng.integers(0, n_customers, rows)]),
+            outlier_customers,
+            pd.Series(rng.integers(1, 13, rows)),
+            rng.integers(-1, 8, rows),
+        )
+
+    # The legacy version is quadratic in the number of outliers, so it only runs on the smallest size
+    small = max(n_rows // 100, 1)
+    legacy = timed(legacy_labels, *inputs(small), repeat=1)
+    print(f"label assignment, {len(outlier_customers):,} outlier customers")
+    print(f"  per-row lambdas, {small:>12,} rows: {legacy:8.3f} s  ({legacy / small * 1e9:8.1f} ns/row)")
+    for rows in (small, max(n_rows // 10, 1), n_rows):
+        vectorized = timed(vectorized_labels, *inputs(rows))
+        print(f"  vectorized,      {rows:>12,} rows: {vectorized:8.3f} s  ({vectorized / rows * 1e9:8.1f} ns/row)")
+
+
+# Check the cube roll-ups against a groupby of the raw transactions (count, mean and
+# std of the amount), with some amounts missing; mean() and std() skip them
+def check_cube_rollups(transactions_df, cube, dims_list):
+    import yapeal_cube
+
+    for dims in dims_list:
+        rolled = yapeal_cube.rollup(cube, dims).set_index(dims).sort_index()
+        grouped = transactions_df.assign(amount_chf=transactions_df['amount_chf'].astype('float64')).groupby(
+            dims, observed=True)['amount_chf'].agg(['size', 'mean', 'std']).sort_index()
+        np.testing.assert_array_equal(rolled['count'], grouped['size'])
+        np.testing.assert_allclose(rolled['avg_amount'], grouped['mean'], rtol=1e-9)
+        np.testing.assert_allclose(rolled['std_amount'], grouped['std'], rtol=1e-6)
+
+
+# Chart roll-ups from the pre-aggregated cube vs regrouping the transactions
+def bench_cube(n_rows):
+    import yapeal_cube
+
+    transactions_df = yapeal_data.add_calendar_features(synthetic_transactions(n_rows))
+    # Some amounts are missing (apply_schema turns unparsable amounts into NaN)
+    transactions_df.loc[transactions_df.index[::97], 'amount_chf'] = np.nan
+    business_customers = transactions_df['customer_id'].cat.categories[::5]
+    start = time.perf_counter()
+    cube = yapeal_cube.build_cube(transactions_df, business_customers)
+    build_time = time.perf_counter() - start
+    dims_list = [['year', 'weekday'], ['year', 'hour'], ['category']]
+    check_cube_rollups(transactions_df, cube, dims_list)
+
+    def regroup():
+        for dims in dims_list:
+            transactions_df.groupby(dims, observed=True)['amount_chf'].agg(['size', 'mean', 'std'])
+
+    def rollups():
+        for dims in dims_list:
+            yapeal_cube.rollup(cube, dims)
+
+    print(f"Chart roll-ups of {n_rows:,} transactions ({len(cube):,} cube cells, built once in {build_time:.2f} s)")
+    print(f"  groupby of the transactions: {timed(regroup) * 1000:8.1f} ms")
+    print(f"  roll-up of the cube:         {timed(rollups) * 1000:8.1f} ms")
+
+
+# Synthetic scaled clustering features: n_customers points around a few centres in [0, 1]
+def synthetic_features(n_customers, n_features=14, n_centres=6, seed=0):
+    rng = np.random.default_rng(seed)
+    centres = rng.random((n_centres, n_features))
+    points = centres[rng.integers(0, n_centres, n_customers)] + rng.normal(0, 0.05, (n_customers, n_features))
+    return np.clip(points, 0, 1)
+
+
+# Wall-clock time and peak traced memory (bytes) of one call
+def timed_peak(func, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+# Largest input the exact linkage is run on (its condensed distance matrix alone needs n^2 * 4 bytes)
+EXACT_LINKAGE_MAX_CUSTOMERS = 20_000
+
+
+def bench_hierarchy(n_rows):
+    import scipy.cluster.hierarchy as sch
+
+    import yapeal_clustering
+
+    sizes = [size for size in (10_000, 100_000, 1_000_000) if size <= n_rows] or [n_rows]
+    print("Ward hierarchical clustering (--rows = largest number of customers)")
+    for n_customers in sizes:
+        features = synthetic_features(n_customers)
+        if n_customers <= EXACT_LINKAGE_MAX_CUSTOMERS:
+            exact_time, exact_peak = timed_peak(sch.linkage, features, 'ward')
+            exact = f"{exact_time:8.2f} s, {exact_peak / 2 ** 20:9.1f} MiB"
+        else:
+            exact = f"skipped (needs ~{n_customers ** 2 * 4 / 2 ** 30:,.0f} GiB)"
+        micro_time, micro_peak = timed_peak(yapeal_clustering.fit_hierarchy, features, 0)
+        print(f"  {n_customers:>9,} customers: exact {exact} | "
+              f"micro-clusters {micro_time:8.2f} s, {micro_peak / 2 ** 20:9.1f} MiB")
+
+
+# Elbow curve (k = 1..ELBOW_MAX_CLUSTERS) of a hierarchy the way the Hierarchical tab did it:
+# one fcluster cut per k and a mask + mean per cluster
+def legacy_hierarchy_wcss(hierarchy, points, k_values):
+    import yapeal_clustering
+
+    wcss = []
+    for k in k_values:
+        labels = yapeal_clustering.hierarchical_labels(hierarchy, k)
+        total = 0.0
+        for cluster in range(k):
+            cluster_points = points[labels == cluster]
+            if len(cluster_points) > 0:
+                total += np.sum(np.square(cluster_points - cluster_points.mean(axis=0)))
+        wcss.append(total)
+    return np.array(wcss)
+
+
+def bench_wcss(n_rows):
+    import yapeal_clustering
+
+    k_values = list(range(1, yapeal_clustering.ELBOW_MAX_CLUSTERS + 1))
+    points = synthetic_features(n_rows, n_features=2)
+    hierarchy = yapeal_clustering.fit_hierarchy(points)
+    assert np.allclose(legacy_hierarchy_wcss(hierarchy, points, k_values),
+                       yapeal_clustering.hierarchical_wcss(hierarchy, points, k_values))
+    legacy_time = timed(legacy_hierarchy_wcss, hierarchy, points, k_values, repeat=1)
+    engine_time = timed(yapeal_clustering.hierarchical_wcss, hierarchy, points, k_values)
+    print(f"Hierarchy WCSS for k = 1..{k_values[-1]} over {n_rows:,} customers")
+    print(f"  per-k loop:        {legacy_time:8.3f} s")
+    print(f"  vectorized engine: {engine_time:8.3f} s  ({legacy_time / engine_time:.0f}x)")
+
+
+def bench_silhouette(n_rows):
+    import scipy.sparse as sp
+    from sklearn.cluster import MiniBatchKMeans
+    from sklearn.metrics import silhouette_score
+
+    import yapeal_clustering
+
+    features = synthetic_features(n_rows)
+    labels = MiniBatchKMeans(n_clusters=6, n_init=1, random_state=0).fit_predict(features)
+    matrix = sp.csr_matrix(features)
+    print(f"Silhouette score of {n_rows:,} customers")
+    for name, func in [('estimate (stratified)', yapeal_clustering.silhouette_estimate),
+                       ('exact (chunked, pool)', yapeal_clustering.silhouette_exact),
+                       ('silhouette_score', silhouette_score)]:
+        if name == 'silhouette_score' and n_rows > 50_000:
+            print(f"  {name:<22} skipped (O(n^2) distance blocks)")
+            continue
+        start = time.perf_counter()
+        result = func(matrix if name != 'silhouette_score' else features, labels)
+        elapsed = time.perf_counter() - start
+        if isinstance(result, dict):
+            result = f"{result['silhouette']:.4f} [{result['ci_low']:.4f}, {result['ci_high']:.4f}]"
+        else:
+            result = f"{result:.4f}"
+        print(f"  {name:<22} {elapsed:8.2f} s  {result}")
+
+
+# One DBSCAN slider move the way the DBSCAN tab handled it: k-distance graph and a full refit
+def legacy_dbscan(points, eps, min_samples):
+    from sklearn.cluster import DBSCAN
+    from sklearn.neighbors import NearestNeighbors
+
+    distances, _ = NearestNeighbors(n_neighbors=5).fit(points).kneighbors(points)
+    np.sort(distances[:, 4])
+    return DBSCAN(eps=eps, min_samples=min_samples).fit_predict(points)
+
+
+def bench_dbscan(n_rows):
+    import yapeal_clustering
+
+    points = synthetic_features(n_rows, n_features=2)
+    start = time.perf_counter()
+    graph = yapeal_clustering.fit_neighbor_graph(points)
+    build_time = time.perf_counter() - start
+    print(f"DBSCAN slider move over {n_rows:,} customers (graph radius {graph['max_eps']:.4f}, "
+          f"built once in {build_time:.2f} s)")
+    # Within the graph radius the cached graph is re-labelled, above it (up to the knee) DBSCAN is refitted
+    for eps in sorted({graph['max_eps'] / 2, graph['max_eps'], graph['knee_eps']}):
+        for min_samples in (2, 5, 20):
+            assert np.array_equal(legacy_dbscan(points, eps, min_samples),
+                                  yapeal_clustering.dbscan_labels(graph, eps, min_samples))
+        legacy_time = timed(legacy_dbscan, points, eps, 5)
+        relabel_time = timed(yapeal_clustering.dbscan_labels, graph, eps, 5)
+        print(f"  eps = {eps:.4f}  refit: {legacy_time * 1000:8.1f} ms  tab: {relabel_time * 1000:8.1f} ms")
+
+    # The sweep grid spans the slider from its smallest eps up to the knee; its top cell is a refit
+    eps_values = yapeal_clustering.dbscan_eps_grid(yapeal_clustering.DBSCAN_MIN_EPS, graph['sweep_max_eps'],
+                                                   yapeal_clustering.DBSCAN_EPS_STEP)
+    sweep = yapeal_clustering.dbscan_sweep(graph, points, eps_values[-1:], min_samples_values=(5,), n_jobs=1)
+    assert np.array_equal(legacy_dbscan(points, eps_values[-1], 5), sweep[(eps_values[-1], 5)]['labels'])
+    print(f"  sweep grid: {eps_values} (knee {graph['knee_eps']:.4f})")
+
+
+# Every PCA mode on sparse features: fit time, and the fitted model must project
+# sparse rows (e.g. new customers at scoring time) the same way as the fit
+def bench_pca(n_rows):
+    import scipy.sparse as sp
+
+    import yapeal_clustering
+
+    features = sp.csr_matrix(synthetic_features(n_rows))
+    rows = features[:1000]
+    print(f"PCA of {n_rows:,} sparse customer rows")
+    for mode in sorted(set(yapeal_clustering.PCA_MODES) - {'auto'}):
+        start = time.perf_counter()
+        model, projection = yapeal_clustering.fit_pca(features, 2, mode=mode,
+                                                      batch_rows=max(10, n_rows // 10))
+        fit_time = time.perf_counter() - start
+        np.testing.assert_allclose(model.transform(rows), projection[:1000], rtol=1e-6, atol=1e-8)
+        print(f"  {mode:<14} {fit_time:8.2f} s")
+
+
+def bench_artifacts(n_rows):
+    import scipy.sparse as sp
+
+    import yapeal_artifacts
+    import yapeal_clustering
+
+    features = sp.csr_matrix(synthetic_features(n_rows))
+    feature_key = yapeal_clustering.matrix_fingerprint(features)
+    steps = [
+        ('preprocessing', lambda: yapeal_clustering.fit_pca(features, 2)),
+        ('kmeans_sweep', lambda: yapeal_clustering.kmeans_sweep(features)),
+        ('hierarchy', lambda: yapeal_clustering.fit_hierarchy(features)),
+    ]
+    print(f"Clustering artifacts of {n_rows:,} customers: fit and store vs load from the store")
+    with tempfile.TemporaryDirectory() as artifact_dir:
+        for name, compute in steps:
+            start = time.perf_counter()
+            yapeal_artifacts.cached_artifact(name, feature_key, None, compute, artifact_dir)
+            fit_time = time.perf_counter() - start
+            load_time = timed(yapeal_artifacts.cached_artifact, name, feature_key, None, compute, artifact_dir)
+            print(f"  {name:<14} fit {fit_time:8.2f} s | load {load_time * 1000:8.1f} ms")
+
+
+# Chi-square validation of K-Means-sized clusters: the crosstab + chi2_contingency the
+# Statistical Validation tab could afford against the engine with its permutation test
+def bench_validation(n_rows):
+    from scipy.stats import chi2_contingency
+
+    import yapeal_clustering
+    import yapeal_validation
+
+    transactions_df = synthetic_transactions(n_rows)
+    customers, _, matrix = yapeal_clustering.clustering_features(yapeal_metrics.customer_aggregates(transactions_df))
+    labels = np.random.default_rng(0).integers(0, 6, len(customers))
+    n_categories = len(transactions_df['category'].cat.categories)
+    label_of = pd.Series(labels, index=customers)
+
+    def crosstab():
+        table = pd.crosstab(transactions_df['customer_id'].map(label_of), transactions_df['category'])
+        return chi2_contingency(table)
+
+    print(f"Cluster validation of {n_rows:,} transactions, {len(customers):,} customers, 6 clusters")
+    print(f"  crosstab + chi2_contingency:  {timed(crosstab):8.3f} s  (no permutation test)")
+    start = time.perf_counter()
+    result = yapeal_validation.validate_clusters(matrix[:, :n_categories], labels)
+    elapsed = time.perf_counter() - start
+    print(f"  engine, {result['permutations']:,} shuffles: {elapsed:8.3f} s  "
+          f"chi2 {result['chi2']:.1f}, p {result['p_value']:.3f}, permutation p {result['permutation_p_value']:.3f}")
+
+
+# Modules yapeal_app.py imported at the top before the machine-learning stack was deferred
+EAGER_IMPORTS = """
+import matplotlib.pyplot, seaborn, plotly.figure_factory
+import scipy.cluster.hierarchy, scipy.stats
+import sklearn.cluster, sklearn.decomposition, sklearn.metrics, sklearn.neighbors, sklearn.preprocessing
+"""
+
+# Render the Overview page once in a fresh Streamlit script run
+RENDER_OVERVIEW = """
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file({app!r}, default_timeout=600)
+app.run()
+assert not app.exception, app.exception
+"""
+
+
+# Wall-clock time of a snippet in a fresh interpreter (nothing imported yet), in seconds
+def fresh_process_seconds(code, env=None):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', code], check=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+    return time.perf_counter() - start
+
+
+def bench_startup(n_rows):
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'yapeal_app.py')
+    with tempfile.TemporaryDirectory() as data_dir:
+        # Synthetic export in place of the real transaction file
+        transactions_df = synthetic_transactions(n_rows)
+        transactions_df['mcc_category'] = transactions_df['category']
+        transactions_df.to_csv(os.path.join(data_dir, os.path.basename(yapeal_data.TRANSACTIONS_PATH)), index=False)
+        env = dict(os.environ, YAPEAL_DATA_DIR=data_dir)
+
+        # The first run builds the Parquet cache and aggregate store, later runs measure a warm start
+        render = RENDER_OVERVIEW.format(app=app_path)
+        cold = fresh_process_seconds(render, env)
+        warm = min(fresh_process_seconds(render, env) for _ in range(3))
+        baseline = min(fresh_process_seconds('import streamlit, pandas, plotly.express', env) for _ in range(3))
+        eager = min(fresh_process_seconds(EAGER_IMPORTS, env) for _ in range(3))
+
+    print(f"time to first render of the Overview page, {n_rows:,} transactions (fresh process each)")
+    print(f"  cold start (builds caches):        {cold:8.3f} s")
+    print(f"  warm start:                        {warm:8.3f} s")
+    print(f"  of which streamlit/pandas/plotly:  {baseline:8.3f} s")
+    print(f"  deferred ML/statistics imports:    {eager:8.3f} s  (now only paid on the Clustering page)")
+
+
+BENCHMARKS = {
+    'features': bench_features,
+    'labels': bench_labels,
+    'cube': bench_cube,
+    'hierarchy': bench_hierarchy,
+    'wcss': bench_wcss,
+    'silhouette': bench_silhouette,
+    'dbscan': bench_dbscan,
+    'pca': bench_pca,
+    'artifacts': bench_artifacts,
+    'validation': bench_validation,
+    'startup': bench_startup,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks for the Business Transaction Pattern Analysis app")
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--rows', type=int, default=1_000_000, help="number of synthetic transactions")
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args.rows)
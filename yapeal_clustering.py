@@ -0,0 +1,751 @@
+# Feature matrices and preprocessing for the Clustering page.
+# Customer x category features are built from the per-customer aggregates of
+# yapeal_metrics (one row per customer, not per transaction) and kept as
+# scipy.sparse CSR matrices, so scaling, distances and PCA only touch the
+# non-zero (customer, category) pairs.
+# Imported lazily by the Clustering page (scikit-learn and SciPy are heavy).
+import hashlib
+
+import numpy as np
+import pandas as pd
+import scipy.cluster.hierarchy as sch
+import scipy.sparse as sp
+import scipy.stats
+from joblib import Parallel, delayed
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial.distance import cdist
+from sklearn.cluster import DBSCAN, KMeans, MiniBatchKMeans
+from sklearn.decomposition import PCA, IncrementalPCA, TruncatedSVD
+from sklearn.metrics.pairwise import euclidean_distances
+from sklearn.neighbors import KDTree
+
+import yapeal_metrics
+
+# Numbers of clusters tried by the K-Means sweep
+KMEANS_K_VALUES = list(range(2, 11))
+
+# Above this many customers K-Means switches to mini-batches
+MINIBATCH_MIN_ROWS = 100_000
+
+# PCA stage: solver modes, the sizes at which 'auto' switches to them, and the
+# rows per batch of IncrementalPCA
+PCA_MODES = {
+    'auto': "Automatic (by matrix size)",
+    'exact': "Exact (full SVD, ARPACK for sparse input)",
+    'randomized': "Randomized SVD",
+    'incremental': "Incremental PCA (row batches)",
+    'truncated_svd': "Truncated SVD (sparse, uncentred)",
+}
+PCA_RANDOMIZED_MIN_ROWS = 100_000
+PCA_INCREMENTAL_MIN_ROWS = 1_000_000
+PCA_BATCH_ROWS = 100_000
+
+# Customers sampled (stratified by cluster) for silhouette estimates, and the
+# number of customers their distances are measured against
+SILHOUETTE_SAMPLE_SIZE = 2_000
+SILHOUETTE_REFERENCE_SIZE = 20_000
+
+# Entries of one block of the pairwise distance matrix in the silhouette computation
+SILHOUETTE_BLOCK_ENTRIES = 10_000_000
+
+# Up to this many customers the hierarchical clustering uses the exact Ward linkage;
+# above it customers are first compressed into this many micro-clusters
+HIERARCHY_EXACT_MAX_ROWS = 10_000
+HIERARCHY_MICRO_CLUSTERS = 2_000
+
+# Number of merged clusters shown at the bottom of a truncated dendrogram
+DENDROGRAM_LEAVES = 30
+
+# DBSCAN: neighbour used for the k-distance graph (the point itself counts as the
+# first one), range and step of the eps slider, and the average number of neighbours
+# per point the radius graph may hold (the graph radius shrinks until it fits). Past
+# about that many neighbours a DBSCAN refit is faster than re-labelling the graph.
+DBSCAN_KDIST_NEIGHBORS = 5
+DBSCAN_MIN_EPS = 0.01
+DBSCAN_MAX_EPS = 1.0
+DBSCAN_EPS_STEP = 0.01
+DBSCAN_GRAPH_NEIGHBORS = 100
+
+# Points whose neighbour counts drive the coarse shrinking of the graph radius
+DBSCAN_GRAPH_SAMPLE = 2_000
+
+# DBSCAN parameter grid of the background sweep: number of eps values (evenly
+# spaced from the smallest slider eps up to the k-distance knee), the min_samples
+# values, and the number of neighbour entries the refit at the largest eps may hold
+# (~8 bytes each; the top of the grid is lowered until it fits)
+DBSCAN_SWEEP_EPS_STEPS = 10
+DBSCAN_SWEEP_MIN_SAMPLES = (2, 3, 5, 10, 15, 20)
+DBSCAN_SWEEP_ENTRIES = 20_000_000
+
+# Customers sampled for the silhouette estimate of every sweep cell
+DBSCAN_SWEEP_SILHOUETTE_SAMPLE = 1_000
+
+# Largest number of clusters of the elbow (WCSS) curves
+ELBOW_MAX_CLUSTERS = 50
+
+# Index entries per bincount call of the WCSS engine; more cuts are processed in blocks
+WCSS_BLOCK_ENTRIES = 50_000_000
+
+
+# Clustering features as one sparse matrix, built from the per-customer aggregates
+# of yapeal_metrics.customer_aggregates: the transaction count per category (columns
+# named after the category, alphabetical), followed by the transaction count and
+# average amount per customer. The average skips missing amounts like mean();
+# customers without any amount get 0 so the matrix stays free of NaN.
+# Returns (customer_ids (sorted), feature_names, matrix).
+def clustering_features(aggregates):
+    aggregates = aggregates.sort_index()
+    categories = yapeal_metrics.aggregate_categories(aggregates)
+    count_columns = [f"{yapeal_metrics.CATEGORY_COUNT_PREFIX}{category}" for category in categories]
+    counts = sp.csr_matrix(aggregates[count_columns].to_numpy(dtype='float64'))
+
+    amount_count = aggregates['amount_count'].to_numpy(dtype='float64')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        avg_amount = np.where(amount_count > 0, aggregates['amount_sum'].to_numpy(dtype='float64') / amount_count, 0.0)
+    totals = np.column_stack([aggregates['transaction_count'].to_numpy(dtype='float64'), avg_amount])
+
+    matrix = sp.hstack([counts, sp.csr_matrix(totals)], format='csr')
+    feature_names = [str(category) for category in categories] + ['transaction_count', 'avg_amount']
+    return np.asarray(aggregates.index), feature_names, matrix
+
+
+# Dense DataFrame of some feature columns (for display and plotting)
+def feature_frame(matrix, feature_names, columns=None):
+    columns = feature_names if columns is None else list(columns)
+    positions = [feature_names.index(column) for column in columns]
+    block = matrix[:, positions]
+    return pd.DataFrame(block.toarray() if sp.issparse(block) else block, columns=columns)
+
+
+# Sample variance of every column of a sparse or dense matrix
+def column_variance(matrix):
+    n_rows = matrix.shape[0]
+    mean = np.asarray(matrix.mean(axis=0)).ravel()
+    mean_sq = np.asarray(matrix.multiply(matrix).mean(axis=0) if sp.issparse(matrix) else (matrix ** 2).mean(axis=0)).ravel()
+    return (mean_sq - mean ** 2) * n_rows / max(n_rows - 1, 1)
+
+
+# Min-max scaling parameters of every column (like sklearn's MinMaxScaler)
+def fit_minmax_scaler(matrix):
+    data_min = np.asarray(matrix.min(axis=0).toarray() if sp.issparse(matrix) else matrix.min(axis=0)).ravel()
+    data_max = np.asarray(matrix.max(axis=0).toarray() if sp.issparse(matrix) else matrix.max(axis=0)).ravel()
+    data_range = data_max - data_min
+    return {'data_min': data_min, 'scale': 1.0 / np.where(data_range == 0, 1.0, data_range)}
+
+
+# Scale the columns to [0, 1]. Sparse input stays sparse: only the stored
+# entries are shifted, which is exact for columns whose implicit zeros map to 0
+# (minimum 0). Columns with implicit zeros and another minimum (negative values)
+# are scaled densely and put back into the sparse result.
+def minmax_transform(matrix, scaler):
+    if not sp.issparse(matrix):
+        return (np.asarray(matrix, dtype='float64') - scaler['data_min']) * scaler['scale']
+    scaled = sp.csr_matrix(matrix, dtype='float64', copy=True)
+    stored_per_column = np.bincount(scaled.indices, minlength=scaled.shape[1])
+    shifted = np.flatnonzero((stored_per_column < scaled.shape[0]) & (scaler['data_min'] != 0))
+    scaled.data = (scaled.data - scaler['data_min'][scaled.indices]) * scaler['scale'][scaled.indices]
+    if len(shifted):
+        dense = ((sp.csc_matrix(matrix, dtype='float64')[:, shifted].toarray() - scaler['data_min'][shifted])
+                 * scaler['scale'][shifted])
+        # Zero the shifted columns, then add their dense values at the same positions
+        keep = np.ones(scaled.shape[1])
+        keep[shifted] = 0.0
+        placement = sp.csr_matrix((np.ones(len(shifted)), (np.arange(len(shifted)), shifted)),
+                                  shape=(len(shifted), scaled.shape[1]))
+        scaled = (scaled @ sp.diags(keep) + sp.csr_matrix(dense) @ placement).tocsr()
+        scaled.eliminate_zeros()
+    return scaled
+
+
+# Solver of the PCA stage for a mode of PCA_MODES ('auto' picks one by matrix size)
+def pca_mode(matrix, mode='auto'):
+    if mode not in PCA_MODES:
+        raise ValueError(f"Unknown PCA mode '{mode}', expected one of {sorted(PCA_MODES)}")
+    if mode != 'auto':
+        return mode
+    if matrix.shape[0] >= PCA_INCREMENTAL_MIN_ROWS:
+        return 'incremental'
+    if matrix.shape[0] >= PCA_RANDOMIZED_MIN_ROWS and not sp.issparse(matrix):
+        return 'randomized'
+    return 'exact'
+
+
+# PCA projection of dense or sparse features, fitted once per dataset and shared
+# by the clustering tabs. Modes (see PCA_MODES):
+# - exact: full SVD; sparse input uses ARPACK, which centres it implicitly
+# - randomized: randomized SVD (sparse input is densified; the features have few columns)
+# - incremental: IncrementalPCA over row batches, only one batch is ever dense
+# - truncated_svd: TruncatedSVD on the sparse matrix without centring
+# Every model has transform() and explained_variance_ratio_. Returns (model, projection).
+def fit_pca(matrix, n_components=2, mode='auto', batch_rows=PCA_BATCH_ROWS):
+    mode = pca_mode(matrix, mode)
+    if mode == 'incremental':
+        pca = IncrementalPCA(n_components=n_components)
+        # Equal batches, so the last one is never smaller than n_components
+        batches = np.array_split(np.arange(matrix.shape[0]), max(1, -(-matrix.shape[0] // batch_rows)))
+        for rows in batches:
+            pca.partial_fit(_dense_rows(matrix, rows))
+        # Only fit() sets the batch size transform() uses to densify sparse input; fitted
+        # through partial_fit, it would fail on sparse rows (e.g. scoring new customers)
+        pca.batch_size_ = batch_rows
+        return pca, np.vstack([pca.transform(_dense_rows(matrix, rows)) for rows in batches])
+    if mode == 'truncated_svd':
+        pca = TruncatedSVD(n_components=n_components, algorithm='randomized', random_state=0)
+        return pca, pca.fit_transform(matrix)
+    if mode == 'randomized':
+        pca = PCA(n_components=n_components, svd_solver='randomized', random_state=0)
+        return pca, pca.fit_transform(matrix.toarray() if sp.issparse(matrix) else matrix)
+    if sp.issparse(matrix) and n_components < min(matrix.shape):
+        pca = PCA(n_components=n_components, svd_solver='arpack', random_state=0)
+    else:
+        pca = PCA(n_components=n_components)
+        matrix = matrix.toarray() if sp.issparse(matrix) else matrix
+    return pca, pca.fit_transform(matrix)
+
+
+# Short content hash of a dense or sparse matrix, used as a cache key
+def matrix_fingerprint(matrix):
+    digest = hashlib.sha1(str(matrix.shape).encode('utf-8'))
+    if sp.issparse(matrix):
+        matrix = sp.csr_matrix(matrix)
+        for part in (matrix.data, matrix.indices, matrix.indptr):
+            digest.update(np.ascontiguousarray(part).tobytes())
+    else:
+        digest.update(np.ascontiguousarray(matrix).tobytes())
+    return digest.hexdigest()[:16]
+
+
+# K-Means with k-means++ seeding, run to convergence. Dense input uses Elkan's
+# algorithm; large inputs use mini-batches.
+def fit_kmeans(matrix, k, random_state=0):
+    if matrix.shape[0] >= MINIBATCH_MIN_ROWS:
+        model = MiniBatchKMeans(n_clusters=k, init='k-means++', n_init=3, batch_size=4096,
+                                random_state=random_state)
+    else:
+        model = KMeans(n_clusters=k, init='k-means++', n_init=3,
+                       algorithm='lloyd' if sp.issparse(matrix) else 'elkan', random_state=random_state)
+    return model.fit(matrix)
+
+
+# Stratified sample of row positions: every cluster contributes in proportion
+# to its size (at least two rows, or all of them for smaller clusters)
+def _stratified_sample(labels, size, rng):
+    clusters, counts = np.unique(labels, return_counts=True)
+    quota = np.minimum(counts, np.maximum(np.round(size * counts / len(labels)).astype('int64'), 2))
+    return np.sort(np.concatenate([
+        rng.choice(np.flatnonzero(labels == cluster), n, replace=False) for cluster, n in zip(clusters, quota)
+    ]))
+
+
+# Rows of a dense or sparse matrix as a dense array
+def _dense_rows(matrix, rows):
+    block = matrix[rows]
+    return block.toarray() if sp.issparse(block) else block
+
+
+# Silhouette value of some rows, with the mean intra- and nearest-cluster distances
+# measured against the reference rows. Distances are computed in blocks of rows;
+# the per-cluster sums are one sparse product with the cluster indicator matrix.
+# A row that is itself a reference row does not count towards its own cluster.
+# The clustering features have few columns, so sparse rows are densified per
+# block for the dense (BLAS) distance kernel.
+def _silhouette_values(matrix, labels, rows, reference, block_entries=SILHOUETTE_BLOCK_ENTRIES):
+    n_clusters = int(labels.max()) + 1
+    reference_labels = labels[reference]
+    indicator = sp.csr_matrix((np.ones(len(reference)), (np.arange(len(reference)), reference_labels)),
+                              shape=(len(reference), n_clusters))
+    reference_counts = np.bincount(reference_labels, minlength=n_clusters).astype('float64')
+    in_reference = np.zeros(len(labels), dtype=bool)
+    in_reference[reference] = True
+    reference_matrix = _dense_rows(matrix, reference)
+
+    block = max(1, block_entries // max(len(reference), 1))
+    values = np.empty(len(rows))
+    for start in range(0, len(rows), block):
+        block_rows = rows[start:start + block]
+        own = labels[block_rows]
+        cluster_sums = np.asarray(indicator.T @ euclidean_distances(reference_matrix, _dense_rows(matrix, block_rows))).T
+        own_counts = reference_counts[own] - in_reference[block_rows]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            intra = cluster_sums[np.arange(len(block_rows)), own] / own_counts
+            mean_distances = cluster_sums / reference_counts
+        mean_distances[np.arange(len(block_rows)), own] = np.inf
+        mean_distances[:, reference_counts == 0] = np.inf
+        nearest = mean_distances.min(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            silhouette = (nearest - intra) / np.maximum(intra, nearest)
+        # Rows alone in their cluster score 0 (same convention as scikit-learn)
+        values[start:start + len(block_rows)] = np.where(own_counts > 0, np.nan_to_num(silhouette), 0.0)
+    return values
+
+
+# Silhouette estimate from a stratified sample of the customers, with a normal
+# confidence interval of the stratified mean (finite-population corrected).
+# Distances are measured against a stratified reference sample, or against all
+# customers when there are at most reference_size of them. Returns None for a
+# single cluster, otherwise {'silhouette', 'ci_low', 'ci_high', 'n_evaluated', 'exact'}.
+def silhouette_estimate(matrix, labels, sample_size=SILHOUETTE_SAMPLE_SIZE, reference_size=SILHOUETTE_REFERENCE_SIZE,
+                        confidence=0.95, random_state=0):
+    labels = np.unique(np.asarray(labels), return_inverse=True)[1]
+    n_rows = len(labels)
+    if labels.max(initial=0) < 1:
+        return None
+    if n_rows <= sample_size:
+        return silhouette_exact(matrix, labels, n_jobs=1)
+
+    matrix = matrix.tocsr() if sp.issparse(matrix) else np.asarray(matrix)
+    rng = np.random.default_rng(random_state)
+    rows = _stratified_sample(labels, sample_size, rng)
+    reference = np.arange(n_rows) if n_rows <= reference_size else _stratified_sample(labels, reference_size, rng)
+    values = _silhouette_values(matrix, labels, rows, reference)
+
+    # Stratified mean and its variance: sum over clusters of W_h * mean_h and W_h^2 * s_h^2 / n_h * (1 - n_h / N_h)
+    sampled_labels = labels[rows]
+    weights = np.bincount(labels) / n_rows
+    n_sampled = np.bincount(sampled_labels, minlength=len(weights))
+    means = np.bincount(sampled_labels, weights=values, minlength=len(weights)) / n_sampled
+    squares = np.bincount(sampled_labels, weights=(values - means[sampled_labels]) ** 2, minlength=len(weights))
+    variances = squares / np.maximum(n_sampled - 1, 1)
+    correction = 1 - n_sampled / np.bincount(labels)
+    estimate = float(weights @ means)
+    margin = float(scipy.stats.norm.ppf(0.5 + confidence / 2) * np.sqrt(np.sum(weights ** 2 * variances / n_sampled * correction)))
+    return {
+        'silhouette': estimate,
+        'ci_low': estimate - margin,
+        'ci_high': estimate + margin,
+        'n_evaluated': len(rows),
+        'exact': False,
+    }
+
+
+# Exact silhouette score over all customers. The rows are split into chunks that
+# are scored in parallel worker processes, each chunk against all customers, so
+# no process holds more than a block of the pairwise distances.
+# Returns the same dict as silhouette_estimate (with a zero-width interval).
+def silhouette_exact(matrix, labels, n_jobs=-1):
+    labels = np.unique(np.asarray(labels), return_inverse=True)[1]
+    n_rows = len(labels)
+    if labels.max(initial=0) < 1:
+        return None
+
+    matrix = matrix.tocsr() if sp.issparse(matrix) else np.asarray(matrix)
+    reference = np.arange(n_rows)
+    n_chunks = max(1, min(n_rows, (n_rows * n_rows) // SILHOUETTE_BLOCK_ENTRIES))
+    chunks = np.array_split(reference, n_chunks)
+    values = Parallel(n_jobs=n_jobs)(delayed(_silhouette_values)(matrix, labels, chunk, reference) for chunk in chunks)
+    silhouette = float(np.concatenate(values).mean())
+    return {
+        'silhouette': silhouette,
+        'ci_low': silhouette,
+        'ci_high': silhouette,
+        'n_evaluated': n_rows,
+        'exact': True,
+    }
+
+
+def _kmeans_sweep_entry(matrix, k, random_state):
+    model = fit_kmeans(matrix, k, random_state)
+    return {
+        'k': k,
+        'model': model,
+        'labels': model.labels_,
+        'inertia': float(model.inertia_),
+        'silhouette': silhouette_estimate(matrix, model.labels_, random_state=random_state),
+    }
+
+
+# Fit K-Means for every k in parallel worker processes. The WCSS of all k is
+# computed afterwards over the full data in one pass (mini-batch inertia only
+# covers the last batches).
+# Returns {k: {'model', 'labels', 'inertia', 'wcss', 'silhouette'}}.
+def kmeans_sweep(matrix, k_values=KMEANS_K_VALUES, random_state=0, n_jobs=-1):
+    k_values = [k for k in k_values if k < matrix.shape[0]]
+    results = Parallel(n_jobs=n_jobs)(delayed(_kmeans_sweep_entry)(matrix, k, random_state) for k in k_values)
+    if results:
+        for result, value in zip(results, wcss(matrix, np.column_stack([result['labels'] for result in results]))):
+            result['wcss'] = float(value)
+    return {result['k']: result for result in results}
+
+
+# Inertia, WCSS and silhouette estimate (with its confidence interval) of every k
+# of a sweep as a DataFrame (for the elbow chart)
+def sweep_summary(sweep):
+    records = []
+    for k, result in sorted(sweep.items()):
+        silhouette = result['silhouette'] or {}
+        records.append({'k': k, 'inertia': result['inertia'], 'wcss': result['wcss'],
+                        'silhouette': silhouette.get('silhouette'), 'silhouette_ci_low': silhouette.get('ci_low'),
+                        'silhouette_ci_high': silhouette.get('ci_high')})
+    return pd.DataFrame(records)
+
+
+# Sum over the clusters of ||cluster sum||^2 / cluster size, for every column of a
+# label matrix (groups x cuts). counts holds the number of points of every group
+# and sums (COO) the sum of their coordinates. Cluster counts and sums of all cuts
+# come from single bincount calls over labels offset by cut, so each cut owns its
+# own range of bins.
+def _cluster_energy(counts, sums, label_matrix, block_entries=WCSS_BLOCK_ENTRIES):
+    n_groups, n_cuts = label_matrix.shape
+    n_clusters = int(label_matrix.max()) + 1 if label_matrix.size else 1
+    n_dims = sums.shape[1]
+    block = max(1, block_entries // max(sums.nnz, n_groups, 1))
+    energy = np.empty(n_cuts)
+    for start in range(0, n_cuts, block):
+        labels = label_matrix[:, start:start + block]
+        n_block = labels.shape[1]
+        offsets = labels + np.arange(n_block) * n_clusters
+        cluster_counts = np.bincount(offsets.ravel(), weights=np.repeat(counts, n_block),
+                                     minlength=n_block * n_clusters).reshape(n_block, n_clusters)
+        entries = offsets[sums.row] * n_dims + sums.col[:, None]
+        cluster_sums = np.bincount(entries.ravel(), weights=np.repeat(sums.data, n_block),
+                                   minlength=n_block * n_clusters * n_dims).reshape(n_block, n_clusters, n_dims)
+        energy[start:start + n_block] = ((cluster_sums ** 2).sum(axis=2) / np.maximum(cluster_counts, 1)).sum(axis=1)
+    return energy
+
+
+# Within-cluster sum of squares of many labelings of the same points at once:
+# label_matrix has one row per point and one column of 0-based labels per
+# labeling (e.g. K-Means for several k, or several cuts of a hierarchy).
+# Uses WCSS = sum ||x||^2 - sum over clusters ||cluster sum||^2 / size, so
+# dense or sparse points are never copied per cluster.
+def wcss(points, label_matrix):
+    label_matrix = np.asarray(label_matrix, dtype='int64')
+    if label_matrix.ndim == 1:
+        label_matrix = label_matrix[:, None]
+    coo = sp.coo_matrix(points)
+    total = float(coo.data @ coo.data)
+    energy = _cluster_energy(np.ones(coo.shape[0]), coo, label_matrix)
+    return np.maximum(total - energy, 0.0)
+
+
+# Radius-neighbours graph of the points of a KD-tree (self included) as its entries
+# sorted by distance: the entries within any smaller eps are then a prefix of the arrays.
+# Returns (distances, rows, indices).
+def _radius_graph(tree, eps):
+    points = np.asarray(tree.data)
+    neighbors, neighbor_distances = tree.query_radius(points, r=eps, return_distance=True)
+    lengths = np.array([len(row) for row in neighbors])
+    distances = np.concatenate(neighbor_distances)
+    order = np.argsort(distances, kind='stable')
+    rows = np.repeat(np.arange(len(points), dtype='int32'), lengths)
+    return distances[order], rows[order], np.concatenate(neighbors).astype('int32')[order]
+
+
+# Largest radius (shrinking from eps) whose radius graph holds at most max_entries
+# entries, estimated from the neighbour counts of a sample of the points and, if
+# exact, checked on all of them
+def _shrink_radius(tree, points, eps, max_entries, exact=True):
+    sample = points[np.random.default_rng(0).choice(len(points), min(len(points), DBSCAN_GRAPH_SAMPLE), replace=False)]
+    while eps > 0 and tree.query_radius(sample, r=eps, count_only=True).mean() * len(points) > max_entries:
+        eps *= 0.8
+    while exact and eps > 0 and tree.query_radius(points, r=eps, count_only=True).sum() > max_entries:
+        eps *= 0.8
+    return eps
+
+
+# Knee of the sorted k-distances (largest jump between neighbouring distances):
+# its position and distance, the default eps of the DBSCAN tab
+def dbscan_knee(k_distances):
+    knee_idx = int(np.argmax(np.diff(k_distances))) + 1
+    return knee_idx, float(k_distances[knee_idx])
+
+
+# KD-tree of the (PCA) points with everything the DBSCAN tab needs to re-label
+# quickly: the sorted k-distances for the eps knee plot and a radius-neighbours
+# graph of at most graph_neighbors entries per point on average (the radius shrinks
+# from max_eps until it fits); larger eps are refitted by dbscan_labels. knee_eps is
+# the knee of the k-distances within the slider range, and sweep_max_eps the top of
+# the sweep grid: the knee, lowered until a refit at it fits in DBSCAN_SWEEP_ENTRIES.
+# Returns {'tree', 'k_distances', 'knee_eps', 'sweep_max_eps', 'max_eps' (graph radius),
+# 'distances', 'rows', 'indices' (graph entries sorted by distance)}.
+def fit_neighbor_graph(points, max_eps=DBSCAN_MAX_EPS, k=DBSCAN_KDIST_NEIGHBORS,
+                       graph_neighbors=DBSCAN_GRAPH_NEIGHBORS):
+    points = np.asarray(points, dtype='float64')
+    tree = KDTree(points)
+    distances, _ = tree.query(points, k=min(k, len(points)))
+    k_distances = np.sort(distances[:, -1])
+    knee_eps = float(np.clip(dbscan_knee(k_distances)[1], DBSCAN_MIN_EPS, max_eps))
+
+    max_eps = _shrink_radius(tree, points, max_eps, graph_neighbors * len(points))
+    graph_distances, rows, indices = _radius_graph(tree, max_eps)
+    return {
+        'tree': tree,
+        'k_distances': k_distances,
+        'knee_eps': knee_eps,
+        'sweep_max_eps': float(_shrink_radius(tree, points, knee_eps, DBSCAN_SWEEP_ENTRIES, exact=False)),
+        'max_eps': float(max_eps),
+        'distances': graph_distances,
+        'rows': rows,
+        'indices': indices,
+    }
+
+
+# DBSCAN labels (-1 = noise) from a precomputed radius-neighbours graph. Same
+# result as sklearn's DBSCAN, but only the graph entries within eps (a prefix of
+# the sorted entries) are touched: core points are those with min_samples entries
+# within eps, clusters are the connected components of the core points (numbered
+# by their first core point), and a border point joins the lowest-numbered cluster
+# among its core neighbours.
+# An eps above the graph radius is a plain DBSCAN refit on the tree's points.
+def dbscan_labels(neighbor_graph, eps, min_samples):
+    if eps > neighbor_graph['max_eps']:
+        points = np.asarray(neighbor_graph['tree'].data)
+        return DBSCAN(eps=eps, min_samples=min_samples).fit_predict(points).astype('int64')
+    n_points = neighbor_graph['tree'].data.shape[0]
+    n_within = np.searchsorted(neighbor_graph['distances'], eps, side='right')
+    rows = neighbor_graph['rows'][:n_within]
+    indices = neighbor_graph['indices'][:n_within]
+    core = np.bincount(rows, minlength=n_points) >= min_samples
+    core_rows, core_indices = core[rows], core[indices]
+
+    # Edges between core points, grouped by row through a sort of row * n_points + index
+    # (much cheaper than scipy's COO to CSR conversion); the graph is symmetric, so
+    # strong components are the connected components
+    core_edges = core_rows & core_indices
+    keys = np.sort(rows[core_edges].astype('int64') * n_points + indices[core_edges])
+    indptr = np.searchsorted(keys, np.arange(n_points + 1, dtype='int64') * n_points)
+    adjacency = sp.csr_matrix((np.ones(len(keys), dtype='int8'), (keys % n_points).astype('int32'), indptr),
+                              shape=(n_points, n_points))
+    _, components = connected_components(adjacency, directed=True, connection='strong')
+    core_points = np.flatnonzero(core)
+    # Cluster numbers in the order of each component's first core point
+    _, first_core, core_components = np.unique(components[core_points], return_index=True, return_inverse=True)
+    cluster_of_component = np.empty(len(first_core), dtype='int64')
+    cluster_of_component[np.argsort(first_core)] = np.arange(len(first_core))
+    labels = np.full(n_points, -1, dtype='int64')
+    labels[core_points] = cluster_of_component[core_components]
+
+    border_edges = ~core_rows & core_indices
+    border = np.full(n_points, n_points, dtype='int64')
+    np.minimum.at(border, rows[border_edges], labels[indices[border_edges]])
+    labels = np.where(border < n_points, border, labels)
+    return labels
+
+
+# eps values of the sweep grid: evenly spaced from min_eps to max_eps and rounded
+# to multiples of step (the eps slider step), so grid cells match slider positions
+def dbscan_eps_grid(min_eps, max_eps, step, n_values=DBSCAN_SWEEP_EPS_STEPS):
+    if max_eps < min_eps:
+        return []
+    multiples = np.unique(np.floor(np.linspace(min_eps, max_eps, n_values) / step + 1e-9))
+    return [round(float(multiple * step), 10) for multiple in multiples if multiple * step >= min_eps - 1e-9]
+
+
+# All min_samples cells of one eps of the sweep grid
+def _dbscan_sweep_row(neighbor_graph, points, eps, min_samples_values, random_state):
+    cells = []
+    for min_samples in min_samples_values:
+        labels = dbscan_labels(neighbor_graph, eps, min_samples)
+        clustered = labels >= 0
+        silhouette = silhouette_estimate(points[clustered], labels[clustered], sample_size=DBSCAN_SWEEP_SILHOUETTE_SAMPLE,
+                                         random_state=random_state)
+        cells.append({
+            'eps': eps,
+            'min_samples': min_samples,
+            'labels': labels.astype('int32'),
+            'n_clusters': int(labels.max()) + 1,
+            'noise_share': float(1 - clustered.mean()),
+            # Silhouette of the clustered points (noise left out), None for fewer than two clusters
+            'silhouette': None if silhouette is None else silhouette['silhouette'],
+        })
+    return cells
+
+
+# DBSCAN over an eps x min_samples grid on a precomputed neighbour graph (refits for
+# eps above its radius), one eps per task in parallel worker processes.
+# Returns {(eps, min_samples): {'labels', 'n_clusters', 'noise_share', 'silhouette', ...}}.
+def dbscan_sweep(neighbor_graph, points, eps_values, min_samples_values=DBSCAN_SWEEP_MIN_SAMPLES,
+                 random_state=0, n_jobs=-1):
+    points = np.asarray(points, dtype='float64')
+    rows = Parallel(n_jobs=n_jobs)(
+        delayed(_dbscan_sweep_row)(neighbor_graph, points, eps, min_samples_values, random_state)
+        for eps in eps_values
+    )
+    return {(cell['eps'], cell['min_samples']): cell for row in rows for cell in row}
+
+
+# One row per cell of a DBSCAN sweep (without the labels), for the heatmap
+def dbscan_sweep_summary(sweep):
+    return pd.DataFrame([
+        {key: value for key, value in cell.items() if key != 'labels'}
+        for _, cell in sorted(sweep.items())
+    ])
+
+
+# Ward linkage of weighted points (e.g. micro-cluster centroids weighted by their
+# number of customers), in scipy's linkage format. Uses the nearest-neighbour
+# chain algorithm with the Lance-Williams update on squared Ward distances,
+# so time is O(m^2) and memory one m x m matrix. With unit weights the result
+# equals scipy.cluster.hierarchy.linkage(points, method='ward').
+def weighted_ward_linkage(points, weights):
+    points = np.asarray(points, dtype='float64')
+    size = np.asarray(weights, dtype='float64').copy()
+    m = len(points)
+    if m < 2:
+        return np.zeros((0, 4))
+
+    # Squared Ward distance between singletons: 2 wi wj / (wi + wj) * ||ci - cj||^2
+    dist = cdist(points, points, 'sqeuclidean')
+    dist *= 2 * np.outer(size, size) / np.add.outer(size, size)
+    np.fill_diagonal(dist, np.inf)
+
+    merges = []
+    chain = []
+    active = np.ones(m, dtype=bool)
+    while len(merges) < m - 1:
+        if not chain:
+            chain.append(int(np.flatnonzero(active)[0]))
+        while True:
+            x = chain[-1]
+            y = int(np.argmin(dist[x]))
+            # Prefer the previous chain element on ties so the chain always terminates
+            if len(chain) > 1 and dist[x, chain[-2]] <= dist[x, y]:
+                y = chain[-2]
+            if len(chain) > 1 and y == chain[-2]:
+                break
+            chain.append(y)
+        x, y = chain.pop(), chain.pop()
+
+        # Merge x into slot y
+        dxy = dist[x, y]
+        merges.append((x, y, np.sqrt(dxy), size[x] + size[y]))
+        with np.errstate(invalid='ignore'):
+            updated = ((size + size[x]) * dist[x] + (size + size[y]) * dist[y] - size * dxy) / (size + size[x] + size[y])
+        updated[~active] = np.inf
+        dist[y, :] = updated
+        dist[:, y] = updated
+        dist[y, y] = np.inf
+        dist[x, :] = np.inf
+        dist[:, x] = np.inf
+        active[x] = False
+        size[y] += size[x]
+
+    # scipy format: merges sorted by distance, new clusters numbered m, m+1, ...
+    merges.sort(key=lambda merge: merge[2])
+    parent = np.arange(2 * m - 1)
+
+    def find(node):
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    linkage = np.zeros((m - 1, 4))
+    for step, (x, y, distance, count) in enumerate(merges):
+        root_x, root_y = find(x), find(y)
+        linkage[step] = [min(root_x, root_y), max(root_x, root_y), distance, count]
+        parent[root_x] = parent[root_y] = m + step
+    return linkage
+
+
+# Hierarchical (Ward) clustering of the customers. Small inputs use the exact
+# linkage over all customers; larger inputs are compressed into micro-clusters
+# with MiniBatchKMeans first, and Ward runs on their centroids weighted by size.
+# Returns {'linkage', 'assignment' (leaf of every customer), 'weights' (customers per leaf), 'exact'}.
+def fit_hierarchy(matrix, max_exact_rows=HIERARCHY_EXACT_MAX_ROWS, n_micro_clusters=HIERARCHY_MICRO_CLUSTERS,
+                  random_state=0):
+    n_rows = matrix.shape[0]
+    if n_rows <= max_exact_rows:
+        dense = matrix.toarray() if sp.issparse(matrix) else np.asarray(matrix)
+        return {
+            'linkage': sch.linkage(dense, method='ward'),
+            'assignment': np.arange(n_rows),
+            'weights': np.ones(n_rows),
+            'exact': True,
+        }
+
+    micro = MiniBatchKMeans(n_clusters=n_micro_clusters, init='k-means++', init_size=3 * n_micro_clusters, n_init=1,
+                            batch_size=4096, max_no_improvement=5, random_state=random_state).fit(matrix)
+    weights = np.bincount(micro.labels_, minlength=n_micro_clusters)
+    # Drop micro-clusters that ended up empty and renumber the rest
+    used = np.flatnonzero(weights)
+    leaf_of_micro = np.full(n_micro_clusters, -1)
+    leaf_of_micro[used] = np.arange(len(used))
+    return {
+        'linkage': weighted_ward_linkage(micro.cluster_centers_[used], weights[used]),
+        'assignment': leaf_of_micro[micro.labels_],
+        'weights': weights[used].astype('float64'),
+        'exact': False,
+    }
+
+
+# 0-based cluster label of every customer when the hierarchy is cut into k clusters
+def hierarchical_labels(hierarchy, k):
+    if len(hierarchy['linkage']) == 0:
+        return np.zeros(len(hierarchy['assignment']), dtype='int64')
+    leaf_labels = sch.fcluster(hierarchy['linkage'], t=k, criterion='maxclust') - 1
+    return leaf_labels[hierarchy['assignment']]
+
+
+# 0-based leaf labels for several cuts of a linkage at once (leaves x len(k_values)),
+# the same partitions as scipy's cut_tree/fcluster for monotonic linkages such as
+# Ward. Node ids grow with the merge distance, so the cut into k clusters keeps the
+# nodes below id 2n - k: leaves are mapped once to their cluster of the finest cut,
+# and only those (at most max(k) nodes) are walked up the tree for every k.
+# k values above the number of leaves are capped.
+def _leaf_label_matrix(linkage, k_values):
+    n_leaves = len(linkage) + 1
+    k_values = [min(int(k), n_leaves) for k in k_values]
+    k_max = max(k_values, default=1)
+    children = linkage[:, :2].astype('int64')
+    parent = np.full(2 * n_leaves - 1, 2 * n_leaves)
+    parent[children[:, 0]] = parent[children[:, 1]] = np.arange(n_leaves, 2 * n_leaves - 1)
+
+    # Cluster node of the finest cut for every node, propagated from the top
+    finest = np.arange(2 * n_leaves - 1)
+    for node in range(2 * n_leaves - k_max - 1, n_leaves - 1, -1):
+        finest[children[node - n_leaves]] = finest[node]
+    leaf_nodes, leaf_index = np.unique(finest[:n_leaves], return_inverse=True)
+
+    labels = np.empty((n_leaves, len(k_values)), dtype='int64')
+    for column, k in enumerate(k_values):
+        nodes = leaf_nodes.copy()
+        while True:
+            up = parent[nodes] < 2 * n_leaves - k
+            if not up.any():
+                break
+            nodes[up] = parent[nodes[up]]
+        labels[:, column] = np.unique(nodes, return_inverse=True)[1][leaf_index]
+    return labels
+
+
+# Within-cluster sum of squares of points (one row per customer) for every k of
+# k_values when the hierarchy is cut into k clusters. The points are first
+# summed per leaf, so the cuts are evaluated on the leaves (micro-clusters)
+# instead of a customers x k label matrix.
+def hierarchical_wcss(hierarchy, points, k_values=range(1, ELBOW_MAX_CLUSTERS + 1)):
+    n_leaves = len(hierarchy['linkage']) + 1
+    assignment = hierarchy['assignment']
+    coo = sp.coo_matrix(points)
+    leaf_counts = np.bincount(assignment, minlength=n_leaves).astype('float64')
+    # COO -> CSR -> COO sums the duplicate (leaf, dimension) entries
+    leaf_sums = sp.coo_matrix((coo.data, (assignment[coo.row], coo.col)), shape=(n_leaves, coo.shape[1])).tocsr().tocoo()
+    total = float(coo.data @ coo.data)
+    energy = _cluster_energy(leaf_counts, leaf_sums, _leaf_label_matrix(hierarchy['linkage'], k_values))
+    return np.maximum(total - energy, 0.0)
+
+
+# Truncated dendrogram (top merges only, scipy's 'lastp' mode) as flat line
+# coordinates: every link is 4 points followed by None, so the whole tree can be
+# drawn as a single line trace. Leaf labels give the number of customers below
+# each leaf. Returns {'x', 'y', 'leaf_positions', 'leaf_labels'}.
+def dendrogram_segments(linkage, weights, p=DENDROGRAM_LEAVES):
+    n_leaves = len(linkage) + 1
+
+    def leaf_label(node):
+        customers = weights[node] if node < n_leaves else linkage[node - n_leaves, 3]
+        return f"({customers:,.0f})"
+
+    dendro = sch.dendrogram(linkage, truncate_mode='lastp', p=p, no_plot=True, leaf_label_func=leaf_label)
+    x, y = [], []
+    for link_x, link_y in zip(dendro['icoord'], dendro['dcoord']):
+        # Rounded coordinates keep the figure JSON small
+        x.extend([round(value, 1) for value in link_x] + [None])
+        y.extend([round(value, 4) for value in link_y] + [None])
+    return {
+        'x': x,
+        'y': y,
+        # scipy places leaf i at 5 + 10 * i
+        'leaf_positions': [5 + 10 * i for i in range(len(dendro['ivl']))],
+        'leaf_labels': dendro['ivl'],
+    }
@@ -0,0 +1,98 @@
+# Pre-aggregated transaction cube for the dashboard pages.
+# Transactions are counted and summed once per combination of
+# segment x year x month x weekday x hour x category x MCC; charts are then
+# roll-ups of the (much smaller) cube instead of regroupings of the raw rows.
+import numpy as np
+import pandas as pd
+
+import yapeal_data
+
+# Cube dimensions and the dtype their labels are stored in
+# (None keeps the dtype of the source column: bool segment flag, categorical category)
+CUBE_DIMENSIONS = {
+    'segment': None,
+    'year': 'int16',
+    'month': 'int8',
+    'weekday': 'int8',
+    'hour': 'int8',
+    'category': None,
+    'mcc': 'int32',
+}
+
+# Measures stored per cube cell (amount_count: transactions with an amount)
+CUBE_MEASURES = ['count', 'amount_count', 'amount_sum', 'amount_sumsq']
+
+
+# Calendar column of the transactions, derived from trx_date only when the
+# loader did not precompute it (see yapeal_data.add_calendar_features)
+def _calendar_column(transactions_df, name, accessor):
+    if name in transactions_df.columns:
+        return transactions_df[name]
+    return getattr(transactions_df['trx_date'].dt, accessor)
+
+
+# Values of each cube dimension for every transaction
+def _dimension_values(transactions_df, business_customers):
+    return {
+        'segment': transactions_df['customer_id'].isin(business_customers),
+        'year': _calendar_column(transactions_df, 'year', 'year'),
+        'month': _calendar_column(transactions_df, 'month', 'month'),
+        'weekday': _calendar_column(transactions_df, 'weekday', 'dayofweek'),
+        'hour': _calendar_column(transactions_df, 'hour', 'hour'),
+        'category': transactions_df['category'] if 'category' in transactions_df.columns else pd.Series(np.nan, index=transactions_df.index),
+        'mcc': transactions_df['mcc'] if 'mcc' in transactions_df.columns else pd.Series(np.nan, index=transactions_df.index),
+    }
+
+
+# Build the cube: one row per observed combination of dimension values with the
+# number of transactions, the number of them with an amount, the amount sum and
+# the sum of squared amounts (missing amounts add 0 to the sums).
+# segment is True for transactions of the given business customers.
+def build_cube(transactions_df, business_customers):
+    codes, labels, sizes = [], [], []
+    for values in _dimension_values(transactions_df, business_customers).values():
+        dimension_codes, dimension_labels = pd.factorize(values, sort=True)
+        # Missing values get their own slot after the observed labels
+        codes.append(np.where(dimension_codes < 0, len(dimension_labels), dimension_codes))
+        labels.append(dimension_labels)
+        sizes.append(len(dimension_labels) + 1)
+
+    # One integer key per cell, then a hash factorization into dense cell ids
+    cell_ids, cell_keys = pd.factorize(np.ravel_multi_index(codes, sizes))
+    amounts = transactions_df['amount_chf'].to_numpy(dtype='float64', na_value=0.0)
+    has_amount = transactions_df['amount_chf'].notna().to_numpy(dtype='float64')
+
+    cube = {}
+    cell_codes = np.unravel_index(cell_keys, sizes)
+    for (name, dtype), dimension_codes, dimension_labels in zip(CUBE_DIMENSIONS.items(), cell_codes, labels):
+        column = pd.Series(dimension_labels).reindex(dimension_codes).reset_index(drop=True)
+        cube[name] = yapeal_data.small_int(column, dtype) if dtype else column
+
+    cube['count'] = np.bincount(cell_ids, minlength=len(cell_keys))
+    cube['amount_count'] = np.bincount(cell_ids, weights=has_amount, minlength=len(cell_keys)).astype('int64')
+    cube['amount_sum'] = np.bincount(cell_ids, weights=amounts, minlength=len(cell_keys))
+    cube['amount_sumsq'] = np.bincount(cell_ids, weights=amounts * amounts, minlength=len(cell_keys))
+    return pd.DataFrame(cube)
+
+
+# Roll the cube (or an earlier roll-up) up to the given dimensions and add the
+# average and sample standard deviation of the amount. Missing labels are dropped
+# like in a regular groupby, and missing amounts are skipped like in mean() and std().
+def rollup(cube, dims):
+    totals = cube.groupby(dims, observed=True)[CUBE_MEASURES].sum().reset_index()
+    counts = totals['amount_count']
+    totals['avg_amount'] = totals['amount_sum'] / counts
+    variance = (totals['amount_sumsq'] - totals['amount_sum'] ** 2 / counts) / (counts - 1)
+    totals['std_amount'] = np.sqrt(variance.clip(lower=0)).where(counts > 1)
+    return totals
+
+
+# Daily totals for the Daily Patterns chart; unique customers per day cannot be
+# rolled up from the cube, so they are materialised separately
+def build_daily_table(transactions_df):
+    return transactions_df.groupby(transactions_df['trx_date'].dt.date).agg(
+        transaction_count=('customer_id', 'count'),
+        unique_customers=('customer_id', 'nunique'),
+        total_amount=('amount_chf', 'sum'),
+        avg_amount=('amount_chf', 'mean')
+    ).reset_index()
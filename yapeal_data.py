@@ -0,0 +1,274 @@
+# Data loading helpers for the Business Transaction Pattern Analysis app.
+# Kept free of Streamlit so the same code can be reused outside the app.
+import hashlib
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+# Define file paths - adjust these to match your environment (or set YAPEAL_DATA_DIR)
+DATA_DIR = os.environ.get("YAPEAL_DATA_DIR", "/Users/valeskablank/Documents/App/Data")
+TRANSACTIONS_PATH = os.path.join(DATA_DIR, "preprocessed_transactions_with_mcc_desc.csv")
+SHARE_OF_WALLET_PATH = os.path.join(DATA_DIR, "preprocessed_share_of_wallet_per_user.csv")
+SHARE_OF_WALLET_DATE_PATH = os.path.join(DATA_DIR, "preprocessed_share_of_wallet_per_user_date.csv")
+
+# Columnar copies of the CSVs are kept here and rebuilt when the source changes
+CACHE_DIR = os.path.join(DATA_DIR, ".yapeal_cache")
+
+# Bump this whenever a schema below (or the calendar features) changes so old cache files are ignored
+SCHEMA_VERSION = 2
+
+# Explicit column types for the transaction export
+TRANSACTIONS_SCHEMA = {
+    'trx_date': 'datetime',
+    'customer_id': 'category',
+    'category': 'category',
+    'mcc_category': 'category',
+    'mcc_description': 'category',
+    'counterpart': 'category',
+    'mcc': 'int32',
+    'year': 'int16',
+    'amount_chf': 'float32',
+}
+
+# Category order of the compact calendar columns
+DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+SEASONS = ['Spring', 'Summer', 'Autumn', 'Winter']
+MONTH_NAMES = ['January', 'February', 'March', 'April', 'May', 'June', 'July',
+               'August', 'September', 'October', 'November', 'December']
+
+# Season code (index into SEASONS) for each month, January first
+SEASON_OF_MONTH = np.array([3, 3, 0, 0, 0, 1, 1, 1, 2, 2, 2, 3], dtype='int8')
+
+# Calendar columns derived from trx_date when the transactions are loaded
+# (season holds the index into SEASONS, weekday 0 = Monday)
+CALENDAR_COLUMNS = {
+    'year': 'int16',
+    'quarter': 'int8',
+    'month': 'int8',
+    'iso_week': 'int8',
+    'weekday': 'int8',
+    'is_weekend': 'int8',
+    'hour': 'int8',
+    'season': 'int8',
+}
+
+# Column types for both share-of-wallet exports
+SHARE_OF_WALLET_SCHEMA = {
+    'date': 'datetime',
+    'customer_id': 'category',
+}
+
+
+# Convert the columns of a freshly parsed CSV to the given schema
+def apply_schema(df, schema):
+    for col, dtype in schema.items():
+        if col not in df.columns:
+            continue
+        if dtype == 'datetime':
+            df[col] = pd.to_datetime(df[col], errors='coerce')
+        elif dtype == 'category':
+            df[col] = df[col].astype('category')
+        elif dtype in ('int8', 'int16', 'int32'):
+            df[col] = small_int(df[col], dtype)
+        else:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype(dtype)
+    return df
+
+
+# Store integer data in a small integer type.
+# Plain integers when the values are complete, nullable integers otherwise.
+def small_int(values, dtype):
+    values = pd.to_numeric(values, errors='coerce')
+    return values.astype(dtype if values.notna().all() else dtype.capitalize())
+
+
+# Categorical column from integer codes; missing codes become missing values
+def _categorical_from_codes(codes, categories, index):
+    codes = np.asarray(pd.Series(codes).fillna(-1), dtype='int8')
+    return pd.Series(pd.Categorical.from_codes(codes, categories=categories), index=index)
+
+
+# Day names as a categorical built from the weekday number (0 = Monday)
+def day_name_column(weekday):
+    return _categorical_from_codes(weekday, DAY_NAMES, weekday.index)
+
+
+# Month names as a categorical built from the month number (1 = January)
+def month_name_column(month):
+    codes = pd.Series(month).fillna(0).astype('int64').values - 1
+    return _categorical_from_codes(codes, MONTH_NAMES, month.index)
+
+
+# Season as a categorical built from the month number (1 = January)
+def season_column(month):
+    codes = pd.Series(month).fillna(0).astype('int64').values
+    season_codes = np.where((codes >= 1) & (codes <= 12), SEASON_OF_MONTH[(codes - 1) % 12], -1)
+    return _categorical_from_codes(season_codes, SEASONS, month.index)
+
+
+# Two-valued label per row from a hash-based membership test: true_label where
+# the value is one of members, false_label otherwise (as a categorical)
+def membership_labels(values, members, true_label, false_label):
+    values = pd.Series(values)
+    codes = values.isin(members).to_numpy().astype('int8')
+    return _categorical_from_codes(codes, [false_label, true_label], values.index).cat.remove_unused_categories()
+
+
+# "Cluster <n>" label for every cluster number (negative numbers = noise), formatted
+# once per distinct cluster and spread to the rows through a lookup array
+def cluster_label_column(labels, noise_label='Noise'):
+    clusters, inverse = np.unique(np.asarray(labels, dtype='int64'), return_inverse=True)
+    names = np.array([f"Cluster {cluster}" if cluster >= 0 else noise_label for cluster in clusters], dtype=object)
+    return names[inverse]
+
+
+# Add the calendar columns of CALENDAR_COLUMNS to a transaction frame, each derived
+# once from trx_date and stored as a small integer. An existing year column is kept.
+def add_calendar_features(df):
+    dates = df['trx_date']
+    if 'year' not in df.columns:
+        df['year'] = small_int(dates.dt.year, 'int16')
+    df['quarter'] = small_int(dates.dt.quarter, 'int8')
+    df['month'] = small_int(dates.dt.month, 'int8')
+    df['iso_week'] = small_int(dates.dt.isocalendar().week, 'int8')
+    df['weekday'] = small_int(dates.dt.dayofweek, 'int8')
+    df['is_weekend'] = df['weekday'].isin([5, 6]).astype('int8')
+    df['hour'] = small_int(dates.dt.hour, 'int8')
+    months = df['month'].fillna(0).astype('int64').to_numpy()
+    seasons = pd.Series(np.where(months >= 1, SEASON_OF_MONTH[(months - 1) % 12], np.nan), index=df.index)
+    df['season'] = small_int(seasons, 'int8')
+    return df
+
+
+# Cheap fingerprint of a source file: path, size and modification time
+def file_fingerprint(path, schema):
+    stat = os.stat(path)
+    key = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}|{SCHEMA_VERSION}|{sorted(schema.items())}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+
+# Location of the columnar copy of a CSV for a given fingerprint
+def cache_path(path, fingerprint, cache_dir=None):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(cache_dir or CACHE_DIR, f"{stem}-{fingerprint}.parquet")
+
+
+# Remove columnar copies of a CSV that belong to an older fingerprint
+def _remove_stale_cache_files(path, keep, cache_dir):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    for name in os.listdir(cache_dir):
+        full = os.path.join(cache_dir, name)
+        if name.startswith(f"{stem}-") and name.endswith('.parquet') and full != keep:
+            try:
+                os.remove(full)
+            except OSError:
+                pass
+
+
+# Read a CSV through the Parquet cache.
+# The first load parses the CSV and writes a typed Parquet copy; later loads
+# read that copy directly as long as the CSV's fingerprint is unchanged.
+# derive (optional) adds derived columns to the parsed frame before it is cached.
+def read_csv_cached(path, schema, cache_dir=None, use_cache=True, derive=None):
+    cache_dir = cache_dir or CACHE_DIR
+    fingerprint = file_fingerprint(path, schema)
+    cached = cache_path(path, fingerprint, cache_dir)
+
+    if use_cache and os.path.exists(cached):
+        try:
+            return pd.read_parquet(cached)
+        except Exception:
+            # Corrupt or unreadable cache file - fall back to the CSV below
+            pass
+
+    df = apply_schema(pd.read_csv(path), schema)
+    if derive is not None:
+        df = derive(df)
+
+    if use_cache:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            # Write to a temporary file first so readers never see a partial file
+            tmp = f"{cached}.{os.getpid()}.tmp"
+            df.to_parquet(tmp, index=False)
+            os.replace(tmp, cached)
+            _remove_stale_cache_files(path, cached, cache_dir)
+        except (ImportError, OSError, ValueError):
+            # pyarrow missing or cache directory not writable - the parsed CSV is still valid
+            pass
+
+    return df
+
+
+# Load the transaction export with its explicit schema and calendar columns
+def load_transactions(path=None, use_cache=True):
+    return read_csv_cached(path or TRANSACTIONS_PATH, TRANSACTIONS_SCHEMA, use_cache=use_cache,
+                           derive=add_calendar_features)
+
+
+# Registry of the datasets the pages can ask for: name -> (path, schema, derive).
+# Nothing is read until a dataset is requested through load_dataset().
+DATASETS = {
+    'transactions': (TRANSACTIONS_PATH, TRANSACTIONS_SCHEMA, add_calendar_features),
+    'share_of_wallet': (SHARE_OF_WALLET_PATH, SHARE_OF_WALLET_SCHEMA, None),
+    'share_of_wallet_date': (SHARE_OF_WALLET_DATE_PATH, SHARE_OF_WALLET_SCHEMA, None),
+}
+
+
+# Load a registered dataset by name (through the Parquet cache)
+def load_dataset(name, use_cache=True):
+    if name not in DATASETS:
+        raise KeyError(f"Unknown dataset '{name}', expected one of {sorted(DATASETS)}")
+    path, schema, derive = DATASETS[name]
+    return read_csv_cached(path, schema, use_cache=use_cache, derive=derive)
+
+
+# Drop categories that no longer occur after a frame has been filtered, so
+# value_counts, get_dummies and Plotly colour groups only see observed values
+def drop_unused_categories(df):
+    df = df.copy(deep=False)
+    for col in df.select_dtypes('category').columns:
+        df[col] = df[col].cat.remove_unused_categories()
+    return df
+
+
+# Bytes one value of a column would take in the default pandas representation
+# (Python strings in object columns, 64-bit numbers), without building that copy
+def _default_bytes(series):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.values
+        string_sizes = np.array([sys.getsizeof(value) for value in series.cat.categories], dtype='int64')
+        counts = np.bincount(codes[codes >= 0], minlength=len(string_sizes))
+        missing = int((codes < 0).sum())
+        # One 8-byte pointer per row plus the string object it points to
+        return 8 * len(series) + int(counts @ string_sizes) + missing * sys.getsizeof(np.nan)
+    if series.dtype == bool:
+        return len(series)
+    return 8 * len(series)
+
+
+# Bytes per row of each column in the compact representation compared with
+# the default pandas representation of the same data
+def memory_report(df):
+    rows = max(len(df), 1)
+    records = []
+    for col in df.columns:
+        series = df[col]
+        records.append({
+            'column': col,
+            'dtype': str(series.dtype),
+            'bytes_per_row_before': _default_bytes(series) / rows,
+            'bytes_per_row_after': series.memory_usage(index=False, deep=True) / rows,
+        })
+    report = pd.DataFrame(records)
+    total = pd.DataFrame([{
+        'column': 'TOTAL',
+        'dtype': '',
+        'bytes_per_row_before': report['bytes_per_row_before'].sum(),
+        'bytes_per_row_after': report['bytes_per_row_after'].sum(),
+    }])
+    report = pd.concat([report, total], ignore_index=True)
+    report['reduction'] = report['bytes_per_row_before'] / report['bytes_per_row_after']
+    return report
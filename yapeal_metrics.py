@@ -0,0 +1,300 @@
+# Per-customer metrics for the Business Transaction Pattern Analysis app.
+# Metrics are built from mergeable partial aggregates (counts and sums per
+# customer), so the same code works on a full frame, on CSV/Parquet chunks
+# streamed from disk, or on batches folded into an existing result.
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import yapeal_data
+
+# Columns needed to compute the customer metrics
+METRIC_COLUMNS = ['customer_id', 'trx_date', 'amount_chf', 'category', 'year']
+
+# Prefixes of the per-category and per-year columns in an aggregate frame
+CATEGORY_PREFIX = 'amount__'
+CATEGORY_COUNT_PREFIX = 'txns__'
+YEAR_PREFIX = 'count__'
+
+# Persisted aggregates used for incremental updates
+AGGREGATE_STORE_PATH = os.path.join(yapeal_data.CACHE_DIR, 'customer_aggregates.parquet')
+
+# Bump when the aggregate columns change so stored aggregates are rebuilt
+AGGREGATE_STORE_VERSION = 3
+
+# Default number of transactions read per chunk in streaming mode
+DEFAULT_CHUNK_ROWS = 1_000_000
+
+# Default IQR multiplier of the outlier rule (upper bound = Q3 + multiplier * IQR)
+DEFAULT_IQR_MULTIPLIER = 2.0
+
+
+# Sum of weights (or number of rows) per code; rows with a missing code (-1) are skipped
+def _bincount(codes, n_groups, weights=None):
+    valid = codes >= 0
+    if weights is not None:
+        weights = weights[valid]
+    return np.bincount(codes[valid], weights=weights, minlength=n_groups)
+
+
+# Same as _bincount for pairs of codes, returned as a dense (n_rows, n_cols) matrix
+def _bincount_2d(row_codes, n_rows, col_codes, n_cols, weights=None):
+    valid = (row_codes >= 0) & (col_codes >= 0)
+    flat = row_codes[valid].astype('int64') * n_cols + col_codes[valid]
+    if weights is not None:
+        weights = weights[valid]
+    return np.bincount(flat, weights=weights, minlength=n_rows * n_cols).reshape(n_rows, n_cols)
+
+
+# Partial aggregates of one chunk of transactions, indexed by customer_id:
+# transaction_count, amount_count (transactions with an amount), amount_sum, weekend_count, amount and transaction count
+# per category, and transaction count per year.
+# The key columns are factorized once and every aggregate is a bincount over
+# the integer codes, so the whole table is built in a single pass.
+def customer_aggregates(transactions_df):
+    customer_codes, customers = pd.factorize(transactions_df['customer_id'], sort=True)
+    n_customers = len(customers)
+    amounts = transactions_df['amount_chf'].to_numpy(dtype='float64', na_value=0.0)
+    # Missing amounts add 0 to the sums and are left out of the average amount
+    has_amount = transactions_df['amount_chf'].notna().to_numpy(dtype='float64')
+    if 'is_weekend' in transactions_df.columns:
+        is_weekend = transactions_df['is_weekend'].to_numpy(dtype='float64')
+    else:
+        is_weekend = transactions_df['trx_date'].dt.dayofweek.isin([5, 6]).to_numpy(dtype='float64')
+
+    columns = {
+        'transaction_count': _bincount(customer_codes, n_customers),
+        'amount_count': _bincount(customer_codes, n_customers, has_amount).astype('int64'),
+        'amount_sum': _bincount(customer_codes, n_customers, amounts),
+        'weekend_count': _bincount(customer_codes, n_customers, is_weekend).astype('int64'),
+    }
+
+    if 'category' in transactions_df.columns:
+        category_codes, categories = pd.factorize(transactions_df['category'], sort=True)
+        category_amounts = _bincount_2d(customer_codes, n_customers, category_codes, len(categories), amounts)
+        category_counts = _bincount_2d(customer_codes, n_customers, category_codes, len(categories))
+        for i, category in enumerate(categories):
+            columns[f"{CATEGORY_PREFIX}{category}"] = category_amounts[:, i]
+        for i, category in enumerate(categories):
+            columns[f"{CATEGORY_COUNT_PREFIX}{category}"] = category_counts[:, i]
+
+    # Transactions per year (from the year column, or the transaction date if it is missing)
+    years = transactions_df['year'] if 'year' in transactions_df.columns else transactions_df['trx_date'].dt.year
+    year_codes, year_values = pd.factorize(years, sort=True)
+    yearly_counts = _bincount_2d(customer_codes, n_customers, year_codes, len(year_values))
+    for i, year in enumerate(year_values):
+        columns[f"{YEAR_PREFIX}{int(year)}"] = yearly_counts[:, i]
+
+    return pd.DataFrame(columns, index=pd.Index(np.asarray(customers), name='customer_id'))
+
+
+# Merge partial aggregates; customers and categories missing from a part count as zero
+def merge_customer_aggregates(parts):
+    parts = [part for part in parts if part is not None and not part.empty]
+    if not parts:
+        return pd.DataFrame(columns=['transaction_count', 'amount_count', 'amount_sum', 'weekend_count'])
+    merged = pd.concat(parts).fillna(0).groupby(level=0).sum()
+    merged.index.name = 'customer_id'
+    return merged
+
+
+# Turn (merged) aggregates into the customer_metrics frame returned by load_data()
+def customer_metrics_from_aggregates(aggregates):
+    aggregates = aggregates.sort_index()
+    counts = aggregates['transaction_count']
+    totals = aggregates['amount_sum']
+
+    customer_metrics = pd.DataFrame({
+        'customer_id': aggregates.index,
+        'transaction_frequency': counts.astype('int64').values,
+        'avg_transaction_amount': (totals / aggregates['amount_count']).values,
+        'total_spent': totals.values,
+    })
+
+    # Category spending as a percentage of each customer's total spending
+    for category in aggregate_categories(aggregates):
+        customer_metrics[f"{category}_pct"] = (aggregates[f"{CATEGORY_PREFIX}{category}"] / totals * 100).fillna(0).values
+
+    # Share of transactions made on weekdays
+    customer_metrics['weekday_ratio'] = (100 - aggregates['weekend_count'] / counts * 100).values
+    return customer_metrics
+
+
+# Category names present in an aggregate frame
+def aggregate_categories(aggregates):
+    return sorted(col[len(CATEGORY_PREFIX):] for col in aggregates.columns if col.startswith(CATEGORY_PREFIX))
+
+
+# Customer-indexed feature table shared by all pages: transaction count,
+# total/average amount, weekday ratio, and per category the transaction count
+# ('<category>_count'), amount ('<category>_amount') and share of spending ('<category>_pct')
+def customer_feature_table(aggregates):
+    aggregates = aggregates.sort_index()
+    counts = aggregates['transaction_count']
+    totals = aggregates['amount_sum']
+
+    columns = {
+        'transaction_count': counts.astype('int64'),
+        'total_amount': totals,
+        'avg_amount': totals / aggregates['amount_count'],
+        'weekday_ratio': 100 - aggregates['weekend_count'] / counts * 100,
+    }
+    for category in aggregate_categories(aggregates):
+        columns[f"{category}_count"] = aggregates[f"{CATEGORY_COUNT_PREFIX}{category}"].astype('int64')
+        columns[f"{category}_amount"] = aggregates[f"{CATEGORY_PREFIX}{category}"]
+        columns[f"{category}_pct"] = (aggregates[f"{CATEGORY_PREFIX}{category}"] / totals * 100).fillna(0)
+    return pd.DataFrame(columns, index=aggregates.index)
+
+
+# Upper IQR bound (Q3 + multiplier * IQR) of a value column for every group,
+# computed with a single grouped quantile
+def iqr_upper_bounds(frame, value_column, group_column='year', multiplier=DEFAULT_IQR_MULTIPLIER):
+    quartiles = frame.groupby(group_column, observed=True)[value_column].quantile([0.25, 0.75]).unstack()
+    return quartiles[0.75] + multiplier * (quartiles[0.75] - quartiles[0.25])
+
+
+# Boolean Series marking the rows whose value lies above the upper IQR bound of their group
+def flag_outliers(frame, value_column, group_column='year', multiplier=DEFAULT_IQR_MULTIPLIER):
+    bounds = iqr_upper_bounds(frame, value_column, group_column, multiplier)
+    row_bounds = bounds.reindex(frame[group_column]).to_numpy()
+    return pd.Series(frame[value_column].to_numpy() > row_bounds, index=frame.index)
+
+
+# Customers that are outliers in every year they were active.
+# frame holds one row per customer and active year (e.g. yearly transaction counts
+# or yearly average amounts); returns the customer ids.
+def all_years_outliers(frame, value_column, customer_column='customer_id', group_column='year',
+                       multiplier=DEFAULT_IQR_MULTIPLIER):
+    is_outlier = flag_outliers(frame, value_column, group_column, multiplier)
+    in_all_years = is_outlier.groupby(frame[customer_column], observed=True).all()
+    return in_all_years.index[in_all_years.to_numpy()]
+
+
+# Customer metrics of a transaction frame that is already in memory
+def compute_customer_metrics(transactions_df):
+    return customer_metrics_from_aggregates(customer_aggregates(transactions_df))
+
+
+# Yield typed transaction chunks from a CSV or Parquet file.
+# A CSV whose Parquet cache copy is up to date is read from the cache instead.
+def iter_transaction_chunks(path=None, chunk_rows=DEFAULT_CHUNK_ROWS, columns=METRIC_COLUMNS):
+    path = path or yapeal_data.TRANSACTIONS_PATH
+
+    if not path.endswith('.parquet'):
+        cached = yapeal_data.cache_path(path, yapeal_data.file_fingerprint(path, yapeal_data.TRANSACTIONS_SCHEMA))
+        if os.path.exists(cached):
+            path = cached
+
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(path)
+        available = [col for col in columns if col in parquet_file.schema_arrow.names]
+        for batch in parquet_file.iter_batches(batch_size=chunk_rows, columns=available):
+            yield batch.to_pandas()
+    else:
+        reader = pd.read_csv(path, usecols=lambda col: col in columns, chunksize=chunk_rows)
+        for chunk in reader:
+            yield yapeal_data.apply_schema(chunk, yapeal_data.TRANSACTIONS_SCHEMA)
+
+
+# Streaming mode: build customer_metrics chunk by chunk.
+# Only the running per-customer aggregates are kept between chunks, so memory
+# grows with the number of customers rather than the number of transactions.
+def stream_customer_aggregates(path=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+    aggregates = None
+    for chunk in iter_transaction_chunks(path, chunk_rows):
+        aggregates = merge_customer_aggregates([aggregates, customer_aggregates(chunk)])
+    return merge_customer_aggregates([aggregates])
+
+
+# Streaming mode counterpart of compute_customer_metrics()
+def stream_customer_metrics(path=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+    return customer_metrics_from_aggregates(stream_customer_aggregates(path, chunk_rows))
+
+
+# Write the aggregates together with the fingerprint of the transaction file they describe
+def save_aggregate_store(aggregates, source_fingerprint, store_path=None):
+    store_path = store_path or AGGREGATE_STORE_PATH
+    try:
+        os.makedirs(os.path.dirname(store_path), exist_ok=True)
+        tmp = f"{store_path}.{os.getpid()}.tmp"
+        aggregates.to_parquet(tmp)
+        os.replace(tmp, store_path)
+        with open(f"{store_path}.json", 'w') as f:
+            json.dump({'source_fingerprint': source_fingerprint, 'version': AGGREGATE_STORE_VERSION}, f)
+    except (ImportError, OSError, ValueError):
+        # pyarrow missing or cache directory not writable - the next call simply rebuilds
+        pass
+
+
+# Read persisted aggregates; returns (None, None) when there is no usable store
+def load_aggregate_store(store_path=None):
+    store_path = store_path or AGGREGATE_STORE_PATH
+    try:
+        with open(f"{store_path}.json", 'r') as f:
+            meta = json.load(f)
+        return pd.read_parquet(store_path), meta
+    except Exception:
+        return None, None
+
+
+# Aggregates of the current transaction file.
+# The persisted store is reused while it matches the file's fingerprint;
+# otherwise it is rebuilt from transactions_df (if given) or by streaming the file.
+def current_customer_aggregates(path=None, transactions_df=None, store_path=None):
+    path = path or yapeal_data.TRANSACTIONS_PATH
+    fingerprint = yapeal_data.file_fingerprint(path, yapeal_data.TRANSACTIONS_SCHEMA)
+
+    aggregates, meta = load_aggregate_store(store_path)
+    if (aggregates is not None and meta.get('source_fingerprint') == fingerprint
+            and meta.get('version') == AGGREGATE_STORE_VERSION):
+        return aggregates
+
+    if transactions_df is not None:
+        aggregates = customer_aggregates(transactions_df)
+    else:
+        aggregates = stream_customer_aggregates(path)
+    save_aggregate_store(aggregates, fingerprint, store_path)
+    return aggregates
+
+
+# Fold a new batch of transactions into the persisted aggregates and return
+# the updated customer_metrics. Only the batch is aggregated; the history is
+# represented by the stored per-customer totals. With append_to_source the
+# batch is also appended to the transaction CSV and the store is marked as
+# matching the extended file; without it the store is left as it is (it must
+# keep describing the unchanged file) and only the returned metrics include the batch.
+def append_transactions(batch_df, path=None, store_path=None, append_to_source=True):
+    path = path or yapeal_data.TRANSACTIONS_PATH
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Transaction file {path} not found - batches are appended to an existing export")
+    # An empty transaction file (not even a header) has no history to aggregate
+    empty_source = os.path.exists(path) and os.path.getsize(path) == 0
+    if empty_source:
+        aggregates = merge_customer_aggregates([])
+    else:
+        aggregates = current_customer_aggregates(path, store_path=store_path)
+
+    batch = yapeal_data.apply_schema(batch_df.copy(), yapeal_data.TRANSACTIONS_SCHEMA)
+    aggregates = aggregates.add(customer_aggregates(batch), fill_value=0)
+    aggregates.index.name = 'customer_id'
+
+    if append_to_source and empty_source:
+        # The batch's columns become the header of the file
+        batch_df.to_csv(path, index=False)
+    elif append_to_source:
+        # Keep the CSV's column order; columns missing from the batch stay empty
+        header = pd.read_csv(path, nrows=0).columns
+        with open(path, 'rb+') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                f.write(b'\n')
+        batch_df.reindex(columns=header).to_csv(path, mode='a', header=False, index=False)
+
+    if append_to_source:
+        fingerprint = yapeal_data.file_fingerprint(path, yapeal_data.TRANSACTIONS_SCHEMA)
+        save_aggregate_store(aggregates, fingerprint, store_path)
+    return customer_metrics_from_aggregates(aggregates)
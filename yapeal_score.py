@@ -0,0 +1,141 @@
+# Headless batch scoring: assign customers to the K-Means clusters of a scoring
+# model saved by the Clustering page (see yapeal_artifacts.save_scoring_model).
+# Feature rows are streamed in chunks through min-max scaling, the PCA
+# projection and a vectorized nearest-centroid assignment, and the labels are
+# written to Parquet or CSV.
+# Run with: python yapeal_score.py <input> <output> [--model PATH] [--transactions] [--chunk-rows N]
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import yapeal_artifacts
+
+# Feature rows scored per chunk
+SCORE_CHUNK_ROWS = 200_000
+
+# Output columns of the scored file
+SCORE_COLUMNS = ['customer_id', 'cluster', 'distance', 'pca1', 'pca2']
+
+
+# Scale a block of feature rows (columns in the model's feature order) and assign
+# every row to its nearest centroid. Returns (labels, squared distances, PCA coordinates).
+def score_block(model, block):
+    scaled = (np.asarray(block, dtype='float64') - model['data_min']) * model['scale']
+    centroids = model['centroids']
+    # ||x - c||^2 = ||x||^2 - 2 x.c + ||c||^2 for all rows and centroids at once
+    distances = (np.einsum('ij,ij->i', scaled, scaled)[:, None] - 2 * scaled @ centroids.T
+                 + np.einsum('ij,ij->i', centroids, centroids)[None, :])
+    labels = distances.argmin(axis=1)
+    nearest = np.maximum(distances[np.arange(len(labels)), labels], 0.0)
+    coordinates = (scaled - model['pca_mean']) @ model['pca_components'].T
+    return labels, nearest, coordinates
+
+
+# Chunks of (customer ids, feature block) from a table of feature rows: one row per
+# customer with a customer_id column and one column per feature. Features the
+# table lacks count as 0; extra columns are ignored.
+def feature_row_chunks(path, feature_names, chunk_rows=SCORE_CHUNK_ROWS):
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        frames = (batch.to_pandas() for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows))
+    else:
+        frames = pd.read_csv(path, chunksize=chunk_rows)
+    for frame in frames:
+        block = frame.reindex(columns=feature_names, fill_value=0).to_numpy(dtype='float64', na_value=0.0)
+        yield frame['customer_id'].to_numpy(), block
+
+
+# Chunks of (customer ids, feature block) built from a transaction export with the
+# same features as the Clustering page (the page's filters are not applied, the
+# export is expected to hold the transactions to score). The export is streamed
+# in chunks of transactions into the per-customer aggregates of yapeal_metrics
+# (memory grows with the number of customers, not transactions), which
+# yapeal_clustering.clustering_features turns into features. Categories the model
+# has not seen are dropped.
+def transaction_chunks(path, feature_names, chunk_rows=SCORE_CHUNK_ROWS):
+    import yapeal_clustering
+    import yapeal_metrics
+
+    customers, names, matrix = yapeal_clustering.clustering_features(yapeal_metrics.stream_customer_aggregates(path))
+    # Model column j is read from input column positions[j] (or stays 0 when the input lacks it)
+    lookup = {name: position for position, name in enumerate(names)}
+    positions = np.array([lookup.get(name, -1) for name in feature_names])
+    present = positions >= 0
+    for start in range(0, matrix.shape[0], chunk_rows):
+        block = np.zeros((min(chunk_rows, matrix.shape[0] - start), len(feature_names)))
+        block[:, present] = matrix[start:start + chunk_rows][:, positions[present]].toarray()
+        yield customers[start:start + chunk_rows], block
+
+
+# Write frames to Parquet (one row group per frame) or CSV (appended) through a
+# temporary file, so readers never see a partial output. Returns the number of rows.
+def write_frames(frames, path):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    parquet = path.endswith('.parquet')
+    if parquet:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    n_rows = 0
+    writer = None
+    for frame in frames:
+        if parquet:
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            writer = writer or pq.ParquetWriter(tmp, table.schema)
+            writer.write_table(table)
+        else:
+            frame.to_csv(tmp, mode='a' if n_rows else 'w', header=not n_rows, index=False)
+        n_rows += len(frame)
+    if writer is not None:
+        writer.close()
+    elif parquet:
+        pd.DataFrame(columns=SCORE_COLUMNS).to_parquet(tmp, index=False)
+    elif n_rows == 0:
+        pd.DataFrame(columns=SCORE_COLUMNS).to_csv(tmp, index=False)
+    os.replace(tmp, path)
+    return n_rows
+
+
+# Scored frame of every chunk of (customer ids, feature block)
+def scored_frames(model, chunks):
+    for customer_ids, block in chunks:
+        labels, distances, coordinates = score_block(model, block)
+        frame = pd.DataFrame({
+            'customer_id': customer_ids,
+            'cluster': labels.astype('int32'),
+            'distance': np.sqrt(distances),
+        })
+        for component in range(coordinates.shape[1]):
+            frame[f"pca{component + 1}"] = coordinates[:, component]
+        yield frame
+
+
+# Score all chunks and write them; returns the number of rows and the elapsed seconds
+def score_file(model, chunks, output_path):
+    start = time.perf_counter()
+    n_rows = write_frames(scored_frames(model, chunks), output_path)
+    return n_rows, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Assign customers to the clusters of a saved K-Means scoring model")
+    parser.add_argument('input', help="feature rows (customer_id + one column per feature) as .csv or .parquet")
+    parser.add_argument('output', help="output file for the labels (.parquet or .csv)")
+    parser.add_argument('--model', help="scoring_model-*.npz file (default: the latest one saved by the app)")
+    parser.add_argument('--transactions', action='store_true',
+                        help="the input is a transaction export; the features are built like on the Clustering page")
+    parser.add_argument('--chunk-rows', type=int, default=SCORE_CHUNK_ROWS, help="customers scored per chunk")
+    args = parser.parse_args()
+
+    try:
+        model = yapeal_artifacts.load_scoring_model(args.model)
+    except FileNotFoundError as e:
+        sys.exit(str(e))
+    chunks = (transaction_chunks if args.transactions else feature_row_chunks)(
+        args.input, model['feature_names'], args.chunk_rows)
+    n_rows, elapsed = score_file(model, chunks, args.output)
+    print(f"Scored {n_rows:,} customers into {len(model['centroids'])} clusters with {model['path']}")
+    print(f"Wrote {args.output} in {elapsed:.2f} s ({n_rows / max(elapsed, 1e-9):,.0f} rows/s)")
@@ -0,0 +1,144 @@
+# Business-segment memberships for the Business Transaction Pattern Analysis app.
+# Every rule that marks customers as "potential business" is evaluated once per
+# dataset and stored as a boolean index over customers (one column per segment);
+# pages read their segment from that table instead of regrouping the transactions.
+import numpy as np
+import pandas as pd
+
+import yapeal_metrics
+
+# Business-related MCC codes (Counterpart analysis and Clustering)
+BUSINESS_MCCS = [2741, 2842, 5013, 5021, 5039, 5044, 5045,
+                 5046, 5047, 5051, 5065, 5072, 5074, 5085,
+                 5094, 5099, 5111, 5122, 5131, 5137, 5139,
+                 5189, 5172, 5192, 5193, 5198, 5199, 7375, 7829]
+
+# Segment columns and the rule behind each of them
+SEGMENTS = {
+    'high_frequency': "Top 20% of customers by transaction count",
+    'iqr_count_all_years': "Transaction count above the IQR bound in every active year",
+    'iqr_amount_all_years': "Average amount above the IQR bound in every active year",
+    'business_mcc': "At least one transaction with a business-related MCC",
+}
+
+# Years left out of the per-year IQR rules (not analyzed)
+EXCLUDED_YEARS = (2020,)
+
+# Per-customer metrics that can be thresholded by percentile
+THRESHOLD_METRICS = {
+    'transaction_count': "Transaction Count",
+    'avg_amount': "Average Amount (CHF)",
+    'business_mcc_share': "Business MCC Share (%)",
+}
+
+
+# Transaction count (all transactions, also those without an amount) and average
+# amount per customer and active year
+def customer_yearly_stats(transactions_df, exclude_years=EXCLUDED_YEARS):
+    if exclude_years:
+        transactions_df = transactions_df[~transactions_df['year'].isin(exclude_years)]
+    return transactions_df.groupby(['customer_id', 'year'], observed=True)['amount_chf'].agg(
+        transaction_count='size',
+        average_amount='mean'
+    ).reset_index()
+
+
+# Boolean segment table: one row per customer of customer_features, one column per entry of SEGMENTS
+def build_segments(transactions_df, customer_features, exclude_years=EXCLUDED_YEARS,
+                   iqr_multiplier=yapeal_metrics.DEFAULT_IQR_MULTIPLIER):
+    customers = pd.Index(np.asarray(customer_features.index), name='customer_id')
+    counts = customer_features['transaction_count'].to_numpy()
+
+    yearly = customer_yearly_stats(transactions_df, exclude_years)
+    count_outliers = yapeal_metrics.all_years_outliers(yearly, 'transaction_count', multiplier=iqr_multiplier)
+    amount_outliers = yapeal_metrics.all_years_outliers(yearly, 'average_amount', multiplier=iqr_multiplier)
+    business_mcc_customers = transactions_df.loc[transactions_df['mcc'].isin(BUSINESS_MCCS), 'customer_id'].unique()
+
+    return pd.DataFrame({
+        'high_frequency': counts >= np.quantile(counts, 0.80),
+        'iqr_count_all_years': customers.isin(np.asarray(count_outliers)),
+        'iqr_amount_all_years': customers.isin(np.asarray(amount_outliers)),
+        'business_mcc': customers.isin(np.asarray(business_mcc_customers)),
+    }, index=customers)
+
+
+# Customer ids that belong to a segment
+def segment_customers(segments, name):
+    return segments.index[segments[name].to_numpy()]
+
+
+# Segment membership of every transaction, looked up through the customer ids.
+# For categorical ids the lookup runs once per category and is spread to the
+# rows through the category codes.
+def transaction_segment(segments, customer_ids, name):
+    customer_ids = pd.Series(customer_ids)
+    if isinstance(customer_ids.dtype, pd.CategoricalDtype):
+        members = segments[name].reindex(customer_ids.cat.categories.astype(segments.index.dtype), fill_value=False)
+        codes = customer_ids.cat.codes.to_numpy()
+        return np.where(codes >= 0, members.to_numpy()[codes], False)
+    return customer_ids.isin(segment_customers(segments, name)).to_numpy()
+
+
+# Share (in %) of each customer's transactions that have a business-related MCC
+def business_mcc_share(transactions_df, customers):
+    customer_codes = pd.Categorical(transactions_df['customer_id'], categories=customers).codes
+    known = customer_codes >= 0
+    is_business = transactions_df['mcc'].isin(BUSINESS_MCCS).to_numpy()[known]
+    counts = np.bincount(customer_codes[known], minlength=len(customers))
+    business_counts = np.bincount(customer_codes[known], weights=is_business, minlength=len(customers))
+    return pd.Series(np.divide(business_counts * 100, counts, out=np.zeros(len(customers)), where=counts > 0),
+                     index=customers)
+
+
+# Pre-sorted per-customer arrays for percentile thresholds. For every metric of
+# THRESHOLD_METRICS the values are sorted once, together with cumulative
+# transaction counts and amounts in the same order, so any threshold resolves
+# with a searchsorted instead of a pass over the customers or transactions.
+# Customers without a value (no amounts at all for avg_amount) are left out of
+# that metric, so a NaN never becomes a threshold.
+def build_percentile_index(customer_features, business_share):
+    metrics = {
+        'transaction_count': customer_features['transaction_count'].to_numpy(dtype='float64'),
+        'avg_amount': customer_features['avg_amount'].to_numpy(dtype='float64'),
+        'business_mcc_share': business_share.reindex(customer_features.index).to_numpy(dtype='float64'),
+    }
+    counts = customer_features['transaction_count'].to_numpy(dtype='float64')
+    amounts = customer_features['total_amount'].to_numpy(dtype='float64')
+
+    index = {}
+    for name, values in metrics.items():
+        known = np.flatnonzero(~np.isnan(values))
+        order = known[np.argsort(values[known], kind='stable')]
+        index[name] = {
+            'values': values[order],
+            # Cumulative totals with a leading zero: cum[i] = total of the i smallest customers
+            'cum_transactions': np.concatenate([[0.0], np.cumsum(counts[order])]),
+            'cum_amount': np.concatenate([[0.0], np.cumsum(amounts[order])]),
+        }
+    return index
+
+
+# Value of a metric at a percentile (0-100), linear interpolation like np.percentile
+def percentile_value(index, metric, percentile):
+    values = index[metric]['values']
+    position = percentile / 100 * (len(values) - 1)
+    lower = int(np.floor(position))
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+# Customers at or above the percentile of a metric: threshold, number of customers,
+# their transactions and amount, and the same totals for all customers
+def threshold_summary(index, metric, percentile):
+    entry = index[metric]
+    threshold = percentile_value(index, metric, percentile)
+    start = int(np.searchsorted(entry['values'], threshold, side='left'))
+    return {
+        'threshold': threshold,
+        'customers': len(entry['values']) - start,
+        'transactions': entry['cum_transactions'][-1] - entry['cum_transactions'][start],
+        'amount': entry['cum_amount'][-1] - entry['cum_amount'][start],
+        'total_customers': len(entry['values']),
+        'total_transactions': entry['cum_transactions'][-1],
+        'total_amount': entry['cum_amount'][-1],
+    }
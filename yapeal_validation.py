@@ -0,0 +1,102 @@
+# Statistical validation of a clustering against the spending categories: the
+# cluster x category contingency table of the transactions, chi-square,
+# Cramer's V, adjusted standardized residuals and a permutation test.
+# Everything works on the sparse customer x category count matrix of
+# yapeal_clustering.clustering_features: the observed table is a bincount over
+# its stored entries, and permuted tables are matrix products with its dense copy
+# (there are only a few categories). Imported lazily by the Clustering page.
+import numpy as np
+import scipy.sparse as sp
+import scipy.stats
+from joblib import Parallel, delayed
+
+# Label shuffles of the permutation test
+PERMUTATIONS = 5_000
+
+# Shuffled labels (shuffles x customers) held at once; more shuffles are processed in blocks
+PERMUTATION_BLOCK_ENTRIES = 10_000_000
+
+
+# Cluster x category table of transaction counts: counts is the customer x category
+# count matrix, labels the 0-based cluster of every customer (row)
+def contingency_table(counts, labels, n_clusters=None):
+    counts = sp.coo_matrix(counts)
+    labels = np.asarray(labels, dtype='int64')
+    n_clusters = n_clusters or int(labels.max()) + 1
+    n_categories = counts.shape[1]
+    table = np.bincount(labels[counts.row] * n_categories + counts.col, weights=counts.data,
+                        minlength=n_clusters * n_categories)
+    return table.reshape(n_clusters, n_categories)
+
+
+# Chi-square statistic of one table or a stack of tables (..., clusters, categories),
+# computed as sum(O^2 / E) - N; rows or columns without transactions are ignored
+def chi_square(tables):
+    total = tables.sum(axis=(-2, -1), keepdims=True)
+    expected = tables.sum(axis=-1, keepdims=True) * tables.sum(axis=-2, keepdims=True) / total
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where(expected > 0, tables ** 2 / expected, 0.0)
+    return ratio.sum(axis=(-2, -1)) - total[..., 0, 0]
+
+
+# Chi-square statistics of the tables of a block of label shuffles. Shuffles move
+# whole customers between clusters (their transactions are not independent).
+# The tables of all shuffles are built at once: per cluster, one matrix product of
+# the shuffles' membership masks with the dense customer x category counts.
+def _permutation_block(counts, labels, n_clusters, n_shuffles, seed):
+    rng = np.random.default_rng(seed)
+    shuffled = rng.permuted(np.tile(labels, (n_shuffles, 1)), axis=1)
+    tables = np.empty((n_shuffles, n_clusters, counts.shape[1]))
+    for cluster in range(n_clusters - 1):
+        tables[:, cluster, :] = (shuffled == cluster).astype('float64') @ counts
+    # The last cluster holds every transaction the others do not
+    tables[:, -1, :] = counts.sum(axis=0) - tables[:, :-1, :].sum(axis=1)
+    return chi_square(tables)
+
+
+# Validation of a clustering against the categories of the customers' transactions.
+# Returns {'table', 'categories_used', 'chi2', 'dof', 'p_value' (chi-square distribution),
+# 'cramers_v', 'residuals' (adjusted standardized residuals),
+# 'permutation_p_value', 'permutations'}.
+def validate_clusters(counts, labels, permutations=PERMUTATIONS, random_state=0, n_jobs=-1):
+    counts = sp.coo_matrix(counts)
+    labels = np.unique(np.asarray(labels), return_inverse=True)[1]
+    n_clusters = int(labels.max()) + 1
+    table = contingency_table(counts, labels, n_clusters)
+    # Drop categories without transactions (they add nothing and break the residuals)
+    used = table.sum(axis=0) > 0
+    table = table[:, used]
+    dense_counts = sp.csc_matrix(counts)[:, np.flatnonzero(used)].toarray()
+
+    total = table.sum()
+    row_share = table.sum(axis=1, keepdims=True) / total
+    column_share = table.sum(axis=0, keepdims=True) / total
+    expected = row_share * column_share * total
+    chi2 = float(chi_square(table))
+    dof = (table.shape[0] - 1) * (table.shape[1] - 1)
+    smaller_side = min(table.shape) - 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        residuals = (table - expected) / np.sqrt(expected * (1 - row_share) * (1 - column_share))
+
+    permutation_p_value = None
+    if permutations and n_clusters > 1:
+        block = max(1, PERMUTATION_BLOCK_ENTRIES // len(labels))
+        sizes = [min(block, permutations - start) for start in range(0, permutations, block)]
+        seeds = np.random.SeedSequence(random_state).spawn(len(sizes))
+        statistics = np.concatenate(Parallel(n_jobs=n_jobs)(
+            delayed(_permutation_block)(dense_counts, labels, n_clusters, size, seed) for size, seed in zip(sizes, seeds)
+        ))
+        # Small tolerance so shuffles that reproduce the observed table count as "at least as extreme"
+        permutation_p_value = float((1 + np.sum(statistics >= chi2 * (1 - 1e-12))) / (permutations + 1))
+
+    return {
+        'table': table,
+        'categories_used': used,
+        'chi2': chi2,
+        'dof': dof,
+        'p_value': float(scipy.stats.chi2.sf(chi2, dof)) if dof > 0 else None,
+        'cramers_v': float(np.sqrt(chi2 / (total * smaller_side))) if smaller_side > 0 else None,
+        'residuals': np.nan_to_num(residuals),
+        'permutation_p_value': permutation_p_value,
+        'permutations': permutations,
+    }